@@ -4,37 +4,40 @@
 # 1) coqa-news-preprocessed-final.json - Preprocessed file with tags, parses, corefs from Stanford CoreNLP
 # 2) sentence-scores.txt (externally generated): by sentence score (higher is better) for each question against each sentence of the passage
 #    the file has 2 columns: col1:passage#.question#.sentence#    col2: the score for that p#.q#.s#
+#    several scores files (runs of different models) may be compared by naming them on the command line (the first one is
+#    shown in full, the others' ranks next to it):  python coqa-news-viz.py run1-scores.txt run2-scores.txt ...
+#    scores files are followed while the viewer is open: rows appended to them (or written to a named pipe, or to stdin
+#    given as -, e.g. scorer.py | python coqa-news-viz.py -) are read as they come and the rankings shown are updated
 #
-import json
+import time
+STARTUP_T0 = time.perf_counter()    # startup times are logged relative to this (taken before the imports, which are part of them)
+
 from tkinter import *
-from PIL import Image, ImageTk
+import os
+import queue
 import random
-
-# indices to the token tuples sored in the preprocess file:
-TOK = 0              # Token
-P_TAG = 1            # Part-of-speech tag
-L_TAG = 2            # Lemma tag
-N_TAG = 3            # Named-entity tag
-M_TAG = 4            # Mapping tag (string index to token index)
+import re
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+from PIL import Image, ImageTk
+from coqa_cache import P_NQ, P_NSEG, P_COLS, load_corpus
+from coqa_layout import M_TAG, W_GAP, V_GAP, FONT_W, FONT_H, X_MIN, X_MAX, Y_MIN, Q_Y_MIN, A_Y_MIN
+from coqa_layout import token_at, passage_layout, qa_layout
+from coqa_metrics import QuestionFacts, score_metrics, metrics_text, runs_text
+from coqa_model import RationaleMap, CategoryCodes, PassageModel, QAModel
+from coqa_prefetch import Prefetcher
+from coqa_scores import load_score_runs
+from coqa_search import FIELDS, TextIndex, load_index, hit_groups, pack_hit, unpack_hit
+from coqa_trace import Tracer, record_text
 
 # images and widgets dictionary (required by tkinter for permanence)
 images = {}
 images['rationale'] = []
 
-# Constants for outputting passages/stories
-# Consolas 8 font is 6 pixels wide by 8 pixels high
-W_GAP = 2       # gap between words
-V_GAP = 30      # vertical gap between lines
-FONT_W = 6      # font's width
-FONT_H = 8      # font's height
-X_MIN = 20      # minimum x coordinate of text
-X_MAX = 1480    # maximum x coordinate of text
-Y_MIN = 40      # minimum y coordinate of text (1st line)
-
-# Constants for outputting questions and answers
-Q_X_MAX = 980   # maximum x coordinate for question
-Q_Y_MIN = 26    # minimum y coordinate for question
-A_Y_MIN = 125   # minimum y coordinate for answer
+OVERLAY_CACHE_SIZE = 128                # translucent overlay images kept for reuse
+overlay_cache = OrderedDict()           # (width, height, color, alpha) -> PhotoImage, least recently used first
 
 # POS tag colors
 nncolr = '#00FF7F'
@@ -84,22 +87,20 @@ DEPLST = [y for x in tag_colors if tag_colors[x]['ttype'] == 'DEP' for y in tag_
 revdeplst = [(y,x) for x in tag_colors if tag_colors[x]['ttype'] == 'DEP' for y in tag_colors[x]['mbrs']]
 REVDEPD = {}
 for itm in revdeplst: REVDEPD[itm[0]] = itm[1]
+DEPSET = frozenset(DEPLST)
 
 dcolr = '#FFFFFF'       # default text background color (white)
 
 # ********************************** Definitions that enable hovering ***************************************
 
-# ghost labels are invisible (since they same color as background) labels at upper left of tokens that allow hovering information
-ghost_lbl_colr = '#F0F0F0'  # default color of ghost token labels in passage (used in hovering information) 
-p_ghost_labels = []         # list containing passage ghost labels to enable hover info (destroyed when new passage is loaded)
-q_ghost_labels = []         # list containing question ghost labels to enable hover info (destroyed when new question is loaded)
-a_ghost_labels = []         # list containing question ghost labels to enable hover info (destroyed when new question is loaded)
+hover_ref = None            # (hover name, token) whose hover information is displayed (hover is resolved by canvas hit-testing)
 
-# token dictionaries
-psgtok_d = {}               # passage token dictionary: holds passage tokens data as output on storyCnv (some displayed on hover) 
-segtok_d = {}               # sentence token dictionary: maps token in psgtok_d to sentence/sentence token
-qtok_d = {}                 # question token dictionary: holds question tokens data as output on qarCnv (some displayed on hover)
-atok_d = {}                 # answer token dictionary: holds answer tokens data as output on qarCnv (some displayed on hover)
+# canvas layers and colors (tokens are tagged by token and category, so checkbox changes only reconfigure items)
+color_lut = {}              # category tag (e.g. 'POS:NN') -> color, for the checked tags of the displayed tag type
+code_colors = []            # category code (of the displayed tag type) -> color
+drawn_layers = set()        # layers ('coref', 'pdeps', 'qdeps', 'rationale') drawn for the displayed passage/question
+p_deps = []                 # (dependency type, from token, to token) links of the displayed passage
+q_deps = []                 # (dependency type, from token, to token) links of the displayed question
 
 # ********************************** Callback functions ***************************************
 
@@ -140,6 +141,97 @@ def qar_next_cb(e=None):
     show_qar(currpsg, currqar)
 
 
+# callback for the navigation keys (Left/Right: passage, Up/Down: question)
+# key repeats only move the target and (once per batch of queued events) redraw the header; the passage/question is
+# drawn once the key is released
+def nav_key_cb(e, dp, dq):
+    global currpsg
+    global currqar
+    global nav_header_id
+    global nav_render_id
+    global nav_psg
+    if dp:
+        currpsg = (currpsg + dp) % len(coqa)
+        currqar = 0
+        nav_psg = True
+    else:
+        currqar = (currqar + dq) % coqa.passage_row(currpsg)[P_NQ]
+    if dp:
+        cancel_render()                             # whatever was being drawn is no longer wanted
+    else:
+        cancel_render(('qar', 'layers'))            # (the passage stays: a question key only redraws the question)
+    if nav_render_id is not None:                   # the key is still held (auto-repeat releases/presses it)
+        root.after_cancel(nav_render_id)
+        nav_render_id = None
+    if nav_header_id is None:
+        nav_header_id = root.after_idle(show_header)
+
+
+# callback for the release of a navigation key: draws the passage/question navigated to (unless the key is pressed
+# again within NAV_RELEASE_MS, as auto-repeat does)
+def nav_release_cb(e):
+    global nav_render_id
+    if nav_render_id is not None:
+        root.after_cancel(nav_render_id)
+    nav_render_id = root.after(NAV_RELEASE_MS, nav_render)
+
+
+# cheap render while a navigation key is held: clears the panel(s) and shows only the passage header/question number
+def show_header():
+    global nav_header_id
+    global nav_held
+    nav_header_id = None
+    nav_held = True                                 # the panels no longer match the token dictionaries (no hovering)
+    hover_off()
+    if nav_psg:
+        storyCnv.delete("all")
+        clear_lines()
+        storyCnv.yview_moveto(0)
+        drawn_layers.clear()
+        storyCnv.create_text(100, 5, text=str(currpsg+1)+' (News Story # '+str(coqa.extra(currpsg)['story_num'])+')', font=("Arial", 14), anchor=NW)
+    else:
+        storyCnv.delete('rationale', 'score')
+    images['rationale'].clear()
+    qarCnv.delete("all")
+    qarCnv.create_text(98, 10, text=str(currqar+1), font=("Arial", 14))
+    models.schedule([('p', currpsg), ('q', currpsg, currqar)])     # prepare the target while the key is held
+
+
+# draws the passage (or only the question) navigated to with the navigation keys
+def nav_render():
+    global nav_render_id
+    nav_render_id = None
+    goto(currpsg, currqar)
+
+
+# returns whether a navigation key moved to a passage/question that is not drawn yet (its header may be all that shows,
+# and the passage model may be gone)
+def navigating():
+    return nav_held or nav_header_id is not None or nav_render_id is not None
+
+
+# moves to a passage/question (navigated to, a search hit, a disagreement) and draws what is not drawn yet: the passage
+# (and its question) if it changed, or only the question; a pending navigation render is dropped (it is drawn here)
+def goto(pnum, qnum, keep_search=False):
+    global currpsg
+    global currqar
+    global nav_header_id
+    global nav_render_id
+    global nav_psg
+    held = navigating()
+    for after_id in (nav_header_id, nav_render_id):
+        if after_id is not None:
+            root.after_cancel(after_id)
+    nav_header_id = nav_render_id = None
+    if pnum != currpsg or nav_psg or psg_model is None:
+        nav_psg = False
+        currpsg, currqar = pnum, qnum
+        show_passage(currpsg, currqar, keep_search=keep_search)
+    elif qnum != currqar or held:
+        currqar = qnum
+        show_qar(currpsg, currqar, keep_search=keep_search)
+
+
 # callback for search entry box
 def get_search_term(name, entry_w):
     srch_term = entry_w.get()
@@ -152,58 +244,108 @@ def get_search_term(name, entry_w):
             scroll_a_list()
 
     
-# searches for a term (a string)
+# searches the whole corpus for a term (a string)
+# single tokens are found with the corpus-wide inverted index, and may name the field searched: lemma:run, ne:person, tok:run
+# phrases ("quoted", or containing spaces) and regular expressions (re:pattern) are matched against the story text
 def search_for_term(tok):
     global search_fail_lbl
     global scrollable_lst
     global scroll_idx
     global scrollable
     global search_term
+    global search_index
+    global text_index
+    global scroll_spans
+    global search_groups
     search_term = tok
-    search_results = []
     if search_fail_lbl:
         search_fail_lbl.destroy()
-    search_toks = psgtok_d
-    for i in search_toks:
-        if tok.lower() in search_toks[i]['tok'].lower():
-            search_results.append(('P', i))
-    search_toks = qtok_d        
-    for i in search_toks:
-        if tok.lower() in search_toks[i]['tok'].lower():
-            search_results.append(('Q', i))
-    search_toks = atok_d
-    for i in search_toks:
-        if tok.lower() in search_toks[i]['tok'].lower():
-            search_results.append(('A', i))
+    clear_found()
+    spans = None
+    t = time.perf_counter()
+    if tok.startswith('re:') or (len(tok) > 1 and tok[0] == tok[-1] == '"') or ' ' in tok.strip():
+        if text_index is None:
+            text_index = TextIndex(coqa)            # built on the first phrase/regex search
+        try:
+            if tok.startswith('re:'):
+                pnums, ftoks, ltoks = text_index.find(tok[3:], regex=True)
+            else:
+                pnums, ftoks, ltoks = text_index.find(tok.strip('"'))
+        except re.error:                            # not a valid regular expression (reported as not found)
+            pnums = ftoks = ltoks = np.zeros(0, dtype=np.int64)
+        search_results = pack_hit(pnums, 'P', 0, ftoks)     # spans are walked by their first token
+        spans = ltoks
+    else:
+        if search_index is None:
+            index_loader.join()                     # (built, or loaded, in the background since the corpus was loaded)
+            if isinstance(loaded['index'], Exception):
+                raise loaded['index']
+            search_index = loaded['index']
+        field, sep, text = tok.partition(':')
+        if not sep or field.lower() not in FIELDS:
+            field, text = 'tok', tok
+        search_results = search_index.find(text, field.lower())
+    tracer.add('search', time.perf_counter() - t)
     if len(search_results) > 0:
         scrollable_lst = search_results
+        scroll_spans = spans
+        search_groups = hit_groups(search_results)
         scrollable = True
-        scroll_idx = 0
+        # start at the first hit in (or after) the displayed passage
+        scroll_idx = int(np.searchsorted(search_results, pack_hit(currpsg, 'P', 0, 0))) % len(search_results)
         scroll_a_list()
     else:
+        scrollable = False
+        scroll_spans = None
+        search_count_lbl.config(text='')
         search_fail_lbl = Label(storyCnv, text='End reached. Text not found.', font="consolas 7 bold", anchor='nw', bg='red', borderwidth=0, justify=CENTER) # relief="solid")
         search_fail_lbl.place(x=1351,y=24)
 
             
-# scroll through a list, highlighting the token at each element        
+# scroll through a list of hits, moving to the hit's passage/question and highlighting its token
 def scroll_a_list():
     global scroll_rect
     global scroll_cnv
     scroll_cnv.delete(scroll_rect)
-    tup = scrollable_lst[scroll_idx]
-    tokidx = tup[1]
-    if tup[0] == 'P':
-        toks_d = psgtok_d
+    pnum, part, qnum, tokidx = unpack_hit(scrollable_lst[scroll_idx])
+    goto(pnum, qnum if part != 'P' or pnum != currpsg else currqar, keep_search=True)   # (a passage hit keeps the question)
+    if part == 'P':
+        toks = psg_model.toks
         scroll_cnv = storyCnv
     else:
         scroll_cnv = qarCnv
-        if tup[0] == 'Q': toks_d = qtok_d
-        else: toks_d = atok_d
-    tok = toks_d[tokidx]
-    x1 = tok['x']
-    y1 = tok['y']
-    tlen = len(tok['tok'])
+        if part == 'Q': toks = qar_model.qtoks
+        else: toks = qar_model.atoks
+    if scroll_spans is not None and found_psg != currpsg:
+        show_found(currpsg)
+    x1 = toks.x[tokidx]
+    y1 = toks.y[tokidx]
+    tlen = len(toks.tok[tokidx])
     scroll_rect = scroll_cnv.create_rectangle(x1-6, y1-4, x1+(tlen * FONT_W)+7, y1+18, width=4, outline='blue')
+    if scroll_cnv is storyCnv:
+        see_y(y1)                               # (the hit may be on a line scrolled out of view)
+    g = int(np.searchsorted(search_groups, scroll_idx, side='right')) - 1    # the hit's passage/question/answer group
+    where = 'passage' if part == 'P' else part+str(qnum+1)
+    search_count_lbl.config(text=str(scroll_idx+1)+' of '+str(len(scrollable_lst))+' ('+str(scroll_idx-search_groups[g]+1)+'/'+str(search_groups[g+1]-search_groups[g])+' in '+where+')')
+
+
+# highlights (as the rationale is highlighted) every phrase/regex match in the displayed passage
+def show_found(pnum):
+    global found_psg
+    clear_found()
+    found_psg = pnum
+    first = np.searchsorted(scrollable_lst, pack_hit(pnum, 'P', 0, 0))
+    last = np.searchsorted(scrollable_lst, pack_hit(pnum + 1, 'P', 0, 0))
+    for k in range(first, last):
+        highlight_span(unpack_hit(scrollable_lst[k])[3], int(scroll_spans[k]), 'deepskyblue', .3, 'found')
+
+
+# removes the phrase/regex match highlights
+def clear_found():
+    global found_psg
+    found_psg = -1
+    storyCnv.delete('found')
+    images.pop('found', None)
 
 
 # clears scroll        
@@ -213,6 +355,8 @@ def clear_scrollable_cb(e):
     search_entry.delete(0, END)
     storyCnv.delete(scroll_rect)
     qarCnv.delete(scroll_rect)
+    search_count_lbl.config(text='')
+    clear_found()
     if search_fail_lbl:
         search_fail_lbl.destroy()
 
@@ -246,97 +390,142 @@ def get_psg_entry(entry_w):
             show_passage(currpsg, currqar)
 
 
-# turn on hover text
-def hover_on(lbl, name, ref, x, y):
-    global hoverlbl
+# resolves the token under the mouse (through the layout's line/x-interval index) and shows its hover information
+def hover_motion(e, cnv):
+    global hover_ref
+    if nav_held or qar_model is None:           # only the header is drawn while a navigation key is held
+        return
+    x = int(cnv.canvasx(e.x))
+    y = int(cnv.canvasy(e.y))
+    if cnv is storyCnv:
+        name = 'phover'
+        ref = token_at(psg_model.geo, x, y)
+    else:
+        name = 'qhover'
+        ref = token_at(qar_model.qgeo, x, y)
+        if ref is None:
+            name = 'ahover'
+            ref = token_at(qar_model.ageo, x, y)
+    key = (name, ref) if ref is not None else None
+    if key == hover_ref:                        # still over the same token (or still over none)
+        return
+    hover_off()
+    if key is not None:
+        hover_ref = key
+        hover_on(name, ref)
+
+
+# turn on hover text (precomputed for every token of the passage/question/answer) in the single hover label
+def hover_on(name, ref):
     if name == 'phover':
         P_X_MAX = 1499
         P_Y_MAX = 499
-        tok_d = psgtok_d
+        toks = psg_model.toks
         Cnv = storyCnv
+        txt, w, h = psg_model.hover[ref]
     elif name == 'qhover' or name == 'ahover':
         P_X_MAX = 999
         P_Y_MAX = 249
         Cnv = qarCnv
         if name == 'qhover':
-            tok_d = qtok_d
-        else:
-            tok_d = atok_d
-    txtlst = []
-    txtlst.append("POS: "+tok_d[ref]['pos'])
-    if tok_d[ref]['lemma'] != '~': txtlst.append("lemma: "+tok_d[ref]['lemma'])
-    if tok_d[ref]['ne'] != '-':
-        if tok_d[ref]['ne'] == '<':
-            i = 1
-            while tok_d[ref-i]['ne'] == '<':
-                i += 1
-            txtlst.append("NE: "+tok_d[ref-i]['ne'])
+            toks = qar_model.qtoks
+            txt, w, h = qar_model.qhover[ref]
         else:
-            txtlst.append("NE: "+tok_d[ref]['ne'])
-    if tok_d[ref]['deptype'] != '':
-       txtlst.append("DEP: "+tok_d[ref]['deptype']+"("+tok_d[tok_d[ref]['dep_ref']]['tok']+")")
-
-    txtlst.append("S"+str(tok_d[ref]['sent']+1)+"/W"+str(tok_d[ref]['s_tok']+1)+"/X"+str(tok_d[ref]['x'])+"/Y"+str(tok_d[ref]['y'])+"/L"+str(tok_d[ref]['line']))
-    txt = '\n'.join(txtlst)
-    w = max([len(s) for s in txtlst])
-    h = len(txtlst)
-    x = x + 5
-    y = y + 12
+            toks = qar_model.atoks
+            txt, w, h = qar_model.ahover[ref]
+    x = toks.x[ref] + 5
+    y = toks.y[ref] + FONT_H + 7            # below the token's box, so the label never sits under the mouse
+    y -= int(Cnv.canvasy(0))                    # (the label is placed in window coordinates of the scrolled canvas)
     H_V_GAP = 15
     if x + w * FONT_W > P_X_MAX: x = P_X_MAX - w * FONT_W
     if y + h * (FONT_H + H_V_GAP) > P_Y_MAX: y -= h * (FONT_H + H_V_GAP)
-    hoverlbl = Label(Cnv, text=txt, font=("consolas", 8), anchor='nw', bg='#FFFF00', relief=GROOVE, justify=LEFT)
-    hoverlbl.place(x=x, y=y)
+    with tracer.phase('canvas'):
+        hoverlbl.config(text=txt)
+        hoverlbl.place(in_=Cnv, x=x, y=y)
+        hoverlbl.lift()
 
 
 # turn off hover text
-def hover_off(lbl):
-    hoverlbl.destroy()
+def hover_off(e=None):
+    global hover_ref
+    hover_ref = None
+    hoverlbl.place_forget()
 
 
 # handle checkbox for displaying rationale
 def show_rationale_chk():
-    show_passage(currpsg, currqar)
+    update_layers(currpsg, currqar)
 
 
 # handle checkbox for displaying coreferences
 def show_coref_chk():
     global showDeps
     showDeps.set(False)
-    show_passage(currpsg, currqar)
+    update_layers(currpsg, currqar)
 
 
 # handle checkbox for displaying dependency parse
 def show_dep_chk():
     global showCorefs
     showCorefs.set(False)
-    show_passage(currpsg, currqar)
+    update_layers(currpsg, currqar)
 
 
-# callback for changing color scheme
+# callback for changing color scheme (recolors the token boxes in place, and shows/hides the dependency group's links)
 def tag_color_cb(k):  
     global lbltg
     if tag_colors[k]['sel'].get():
         lbltg = tag_colors[k]['ttype']
-    show_passage(currpsg, currqar)
-    
+    build_color_lut()
+    recolor()
+    update_layers(currpsg, currqar)
+
+
+# precompiles the tag -> color lookup of the checked tags of the displayed tag type (lbltg)
+# keys are the category tags given to token boxes, e.g. 'POS:NNS', 'NE:CITY', 'DEP:NSUBJ'
+# (and the same colors by category code, for drawing the tokens of a passage model)
+def build_color_lut():
+    color_lut.clear()
+    for tagk in tag_colors:                         # it's a many to one (color) mapping
+        if tag_colors[tagk]['ttype'] == lbltg and tag_colors[tagk]['sel'].get():
+            for m in tag_colors[tagk]['mbrs']:
+                color_lut.setdefault(lbltg+':'+m, tag_colors[tagk]['color'])
+    code_colors[:] = [color_lut.get(t, dcolr) for t in categories.tags[lbltg]] + [dcolr]   # (code -1 is not colored)
+
+
+# recolors all token boxes from the color lookup (one itemconfigure per colored tag, instead of a redraw)
+def recolor():
+    for cnv in (storyCnv, qarCnv):
+        cnv.itemconfigure('tokbox', fill=dcolr)
+        for cat in color_lut:
+            cnv.itemconfigure(cat, fill=color_lut[cat])
+
 
 # displays transparent rectangle over text	
 def alpha_rect(root, canvas, x1, y1, x2, y2, border, **kwargs):
     alpha = int(kwargs.pop('alpha') * 255)
     fill = kwargs.pop('fill')
-    fill = root.winfo_rgb(fill) + (alpha,)
-    image = Image.new('RGBA', (x2-x1, y2-y1), fill)
-    alpha_image = ImageTk.PhotoImage(image)
-    images['rationale'].append(alpha_image)
-    canvas.create_image(x1, y1, image=images['rationale'][-1], anchor='nw', tags='alpha')
+    layer = kwargs.pop('tags', 'rationale')         # the image is kept (in images[layer]) until its layer is cleared
+    key = (x2-x1, y2-y1, fill, alpha)
+    alpha_image = overlay_cache.get(key)
+    if alpha_image is None:                         # new size/color: build (and cache) its translucent image
+        fill = root.winfo_rgb(fill) + (alpha,)
+        image = Image.new('RGBA', (x2-x1, y2-y1), fill)
+        alpha_image = ImageTk.PhotoImage(image)
+        overlay_cache[key] = alpha_image
+        if len(overlay_cache) > OVERLAY_CACHE_SIZE:
+            overlay_cache.popitem(last=False)       # evicted images stay alive while their layer still shows them
+    else:
+        overlay_cache.move_to_end(key)
+    images.setdefault(layer, []).append(alpha_image)
+    canvas.create_image(x1, y1, image=images[layer][-1], anchor='nw', tags=('alpha', layer))
     if border:
         r = canvas.create_rectangle(x1, y1, x2, y2, **kwargs)
         return r
 
 
 # draw curved lines between tokens (if straight lines are used, it's difficult to discern connection endpoints)
-def link_toks(cnv, startx, starty, endx, endy, lcolor, arcit=False):
+def link_toks(cnv, startx, starty, endx, endy, lcolor, arcit=False, tags=()):
 
    midx = (startx + endx)/2      # midpoint x to create arc
    if arcit:
@@ -350,488 +539,709 @@ def link_toks(cnv, startx, starty, endx, endy, lcolor, arcit=False):
    else:
       midy = max(starty, endy) + 28
 
-   cnv.create_line(startx, starty, midx, midy, endx, endy+FONT_H+4, arrow=LAST, fill=lcolor, smooth="true")
+   cnv.create_line(startx, starty, midx, midy, endx, endy+FONT_H+4, arrow=LAST, fill=lcolor, smooth="true", tags=tags)
 
 
 # output the current passage on the canvas   
-def show_passage(pnum=0, qnum=0):
-
-    tg = P_TAG                                  # Assume POS tags will be used for label colors
-    if lbltg == 'NE':                           # Unless NE tags are called for
-        tg = N_TAG
+def show_passage(pnum=0, qnum=0, keep_search=False):
 
-    d = coqa[pnum]                              # load passage from coqa in dictionary d
+    with tracer.phase('prep'):
+        d = coqa[pnum]                          # load passage from coqa in dictionary d
 
+    cancel_render()                             # a passage still being drawn is abandoned
     storyCnv.delete("all")                      # clear all canvas items
-    while p_ghost_labels:                       # clear all ghost labels 
-        widget = p_ghost_labels.pop()
-        widget.destroy()
+    clear_lines()
+    drawn_layers.clear()                        # and forget the (lazily drawn) coref/dependency/rationale layers
+    clear_found()
+    hover_off()
     
-    global search_term
-    search_term = ""
-    search_entry.delete(0, END)
-
-    global scrollable
-    scrollable = False
+    if not keep_search:                         # a search moving to its next hit keeps its term and hits
+        global search_term
+        search_term = ""
+        search_entry.delete(0, END)
+        search_count_lbl.config(text='')
+
+        global scrollable
+        scrollable = False
     
     storyCnv.create_text(100, 5, text=str(pnum+1)+' (News Story # '+str(d['story_num'])+')', font=("Arial", 14), anchor=NW)     # output the passage/story #
 
-    psgtok_d.clear()
-    segtok_d.clear()
-
-    x = X_MIN                                       # x is token's x coordinate
-    y = Y_MIN                                       # y is token's y coordinate
-
-    line_num = 1
-    tok_cnt = 0
-    pdeps = []
-
-    
-    for i in range(len(d['seg_tagged'])):           # i is each tagged sentence
-        sg = d['seg_tagged'][i]                     # sg is the tagged sentence being processed
-        #print(d['seg_dep'][i])
-        deps = [(dep[0], dep[1], dep[2]) for dep in d['seg_dep'][i]]  # (1-based) index0 is dependency type, index1 is token index receiver of dependency, index2 token index of dependency 
-        depd = {}
-        rootdep = -1
-        for dep in deps:
-           if dep[0] != 'ROOT':
-              depd[dep[2]-1] = (dep[0].upper(),dep[1]-1)        # ensure 0-based token indices are stored
-           else:
-              rootdep = dep[2]-1
-              
-        for j in range(len(sg)):                    # j is each token tuple index in sg
-            segtok_d[(i,j)] = tok_cnt
-            tok_d = {}
-            tok = sg[j][TOK]                       # tok is the jth token
-            tlen = len(tok)                         # tlen is token's length in characters           
-            glen = W_GAP * FONT_W                   # glen is the gap that precedes the token (in pixels)
-            outlen = tlen * FONT_W                  # outlen is the token's length in pixels
-            if x + (W_GAP + tlen) * FONT_W >= X_MAX:# text exceeds X_MAX (right screen margin), so wrap 
-                x = X_MIN
-                y += V_GAP
-                line_num += 1
-            elif x > X_MIN:                         # only precede token by gap if it is not the first token in the line
-                x += glen
-
-            if sg[j][tg] == '<':
-               sg[j][tg] = sg[j-1][tg]              # "Fixes" preprocessed data by expanding previously collapsed token tag (<)
-            toktag = sg[j][tg]                      # extract the tag that will be used for label color
-                                 
-
-            # load the token's output (on storyCnv) info: sentence it came, token in sentence, x and y coords, line it was output on
-            tok_d['tok'] = tok
-            tok_d['s_map'] = sg[j][M_TAG]
-            tok_d['pos'] = sg[j][P_TAG]
-            tok_d['ne'] = sg[j][N_TAG]
-            tok_d['lemma'] = sg[j][L_TAG]
-            tok_d['sent'] = i
-            tok_d['s_tok'] = j
-            tok_d['x'] = x
-            tok_d['y'] = y
-            tok_d['line'] = line_num
-            if j in depd and depd[j][0] in DEPLST:          # if tag is a member of the selected highlighting (the split[0] is for NE tags)
-                  tok_d['deptype'] = depd[j][0]
-                  tok_d['dep_ref'] = tok_cnt+(depd[j][1]-j)
-                  pdeps.append((depd[j][0], tok_cnt, tok_cnt+(depd[j][1]-j)))
-            else:
-               tok_d['deptype'] = ""
-               tok_d['dep_ref'] = ""
+    with tracer.phase('layout'):
+        passage_layout(coqa, pnum)                  # (memoized, and reused by the model: timed on its own)
+    with tracer.phase('prep'):
+        m = models.get(('p', pnum))                 # render-ready passage (usually prefetched while the previous one was shown)
+    p_deps[:] = m.deps
+
+    global psg_model
+    global psg_height
+    psg_model = m
+    psg_height = max(STORY_H, Y_MIN + m.geo.nlines * V_GAP + V_GAP)    # the passage scrolls when it is taller than the canvas
+    storyCnv.configure(scrollregion=(0, 0, STORY_W, psg_height))
+    storyCnv.yview_moveto(0)
+    queue_render('psg', passage_steps(m))           # the visible lines are drawn in chunks, between which the mainloop runs
+    show_qar(pnum, qnum, keep_search)                     # call function to output the question/answer
+
+
+# returns the lines of a passage in the viewport of storyCnv, followed by the lines within VIRT_MARGIN of it
+# (line l is output at y = Y_MIN + l * V_GAP)
+def window_lines(geo):
+    top = int(storyCnv.canvasy(0))
+    first = max(0, (top - Y_MIN) // V_GAP)
+    last = min(geo.nlines - 1, (top + STORY_H - Y_MIN) // V_GAP)
+    near_first = max(0, (top - VIRT_MARGIN - Y_MIN) // V_GAP)
+    near_last = min(geo.nlines - 1, (top + STORY_H + VIRT_MARGIN - Y_MIN) // V_GAP)
+    return list(range(first, last + 1)) + list(range(last + 1, near_last + 1)) + list(range(first - 1, near_first - 1, -1))
+
+
+# render steps of a passage's tokens: draws the lines in (then near) the viewport that are not drawn yet (a line per step)
+def passage_steps(m):
+    while True:
+        todo = [l for l in window_lines(m.geo) if l not in line_items]
+        if not todo:
+            break
+        draw_line(m, todo[0])
+        yield
+    lower_tokens()
+
+
+# draws the tokens of a line of the passage, reusing the items of lines scrolled out of view
+def draw_line(m, l):
+    items = []
+    for k in range(m.geo.line_first[l], m.geo.line_first[l + 1]):     # k is each passage token of the line
+        tok = m.toks.tok[k]                         # tok is the kth token
+        outlen = len(tok) * FONT_W                  # outlen is the token's length in pixels
+        x = m.toks.x[k]                             # x is token's x coordinate
+        y = m.toks.y[k]                             # y is token's y coordinate
 
-
-            # Code below select the label color for the token
-            colr = dcolr                              # Tokens not having tags of interest are output with default label color
-
-            if lbltg != 'DEP':
-               for tagk in tag_colors:                 # Search for the correct color (it's a many to one (color) mapping
-                  if tag_colors[tagk]['ttype'] == lbltg and tag_colors[tagk]['sel'].get():    # if right label and checked for viewing
-                     if toktag.split()[0] in tag_colors[tagk]['mbrs']:          # if tag is a member of the selected highlighting (the split[0] is for NE tags)
-                        colr = tag_colors[tagk]['color']            # store its color value
-                        break
+        # output the (colorized) token
+        colr = code_colors[m.codes[lbltg][k]]
+        tags = m.tags[k]
+        txt = None
+        if item_pool:
+            box, txt = item_pool.pop()
+            storyCnv.coords(box, x-2, y, x+outlen+2, y+FONT_H+5)
+            storyCnv.itemconfigure(box, fill=colr, tags=tags, state=NORMAL)
+        else:
+            box = storyCnv.create_rectangle(x-2, y, x+outlen+2, y+FONT_H+5, outline="#000", fill=colr, tags=tags)
+        rbox = None
+        if k in m.roots:
+            if root_pool:
+                rbox = root_pool.pop()
+                storyCnv.coords(rbox, x-3, y-2, x+outlen+4, y+FONT_H+7)
+                storyCnv.itemconfigure(rbox, state=NORMAL)
             else:
-               for tagk in tag_colors:                 # Search for the correct color (it's a many to one (color) mapping
-                     if tag_colors[tagk]['ttype'] == lbltg and tag_colors[tagk]['sel'].get():    # if right label and checked for viewing
-                        if j in depd and depd[j][0] in tag_colors[tagk]['mbrs']:          # if tag is a member of the selected highlighting (the split[0] is for NE tags)
-                           colr = tag_colors[tagk]['color']            # store its color value
-                           break
-     
-               
-            # output ghost label in upper left corner of label to enable hovering information, and append ghost label to list
-            lbl = Label(storyCnv, text='', font=("consolas", 1), anchor='nw', bg=ghost_lbl_colr) #, borderwidth=1, relief="solid")
-            lbl.bind("<Enter>", lambda name='pghost', ref=tok_cnt, x=x, y=y : hover_on(lbl, 'phover', ref, x, y))
-            lbl.bind("<Leave>", lambda name='pghost': hover_off(lbl))
-            lbl.place(x=x-8, y=y)
-            p_ghost_labels.append(lbl)
-
-            # output the (colorized) token
-            storyCnv.create_rectangle(x-2, y, x+outlen+2, y+FONT_H+5, outline="#000", fill=colr)
-            if j == rootdep: storyCnv.create_rectangle(x-3, y-2, x+outlen+4, y+FONT_H+7, width=3, outline="#000")
-            storyCnv.create_text(x, y, text=tok, font=("consolas", 8), anchor='nw')
-
-            
-            psgtok_d[tok_cnt] = tok_d                  # append the tokens dictionary to the passage dictionary
-
-            x += (W_GAP + tlen) * FONT_W            # update the x pixel coordinate
-   
-            tok_cnt += 1                            # increment the (passage) token counter
-
-
-    if showCorefs.get():
-
-       crefcolr = 0
-       for k in d['corefs']:                          # k is the key to a single set of coreferences (refs to same entity)
-          references = []                             # this will store the referring tokens
-          for ref in d['corefs'][k]:                  # ref is an individual coref in k
-             sentnum = ref['sentNum']
-             toknum = ref['startIndex']
-             if ref['repmention']:
-               referent = segtok_d[(sentnum,toknum)]
-             else:         
-               references.append(segtok_d[(sentnum,toknum)])
-          endx = psgtok_d[referent]['x']
-          endy = psgtok_d[referent]['y']
-          for ref in references:
-            startx = psgtok_d[ref]['x']
-            starty = psgtok_d[ref]['y']
-
-            crefcolr = (crefcolr + 1) % len(coref_colors)
-
-            link_toks(storyCnv, startx, starty, endx, endy, coref_colors[crefcolr], arcit=True)
-
-    if showDeps.get():
-      for dep in pdeps:
-         dtype = dep[0] # dependency type
-         t1 = dep[1]    # token 1 (from)
-         t2 = dep[2]    # token 2 (to)
-         if tag_colors[REVDEPD[dtype]]['sel'].get():
-            startx = psgtok_d[t1]['x']
-            starty = psgtok_d[t1]['y'] + FONT_H + 6
-            endx = psgtok_d[t2]['x']
-            endy = psgtok_d[t2]['y']
-            link_toks(storyCnv, startx, starty, endx, endy, "#DC143C")
-              
-    show_qar(pnum, qnum)                                  # call function to output the question/answer
+                rbox = storyCnv.create_rectangle(x-3, y-2, x+outlen+4, y+FONT_H+7, width=3, outline="#000", tags='tokroot')
+        if txt is not None:
+            storyCnv.coords(txt, x, y)
+            storyCnv.itemconfigure(txt, text=tok, state=NORMAL)
+        else:
+            txt = storyCnv.create_text(x, y, text=tok, font=("consolas", 8), anchor='nw', tags='toktext')
+        items.append((box, rbox, txt))
+    line_items[l] = items
+
+
+# hides the token items of a line of the passage and keeps them for reuse
+def release_line(l):
+    for box, rbox, txt in line_items.pop(l):
+        storyCnv.itemconfigure(box, state=HIDDEN, tags='tokbox')    # (drops its token/category tags)
+        storyCnv.itemconfigure(txt, state=HIDDEN)
+        item_pool.append((box, txt))
+        if rbox is not None:
+            storyCnv.itemconfigure(rbox, state=HIDDEN)
+            root_pool.append(rbox)
+
+
+# keeps the token boxes and text under everything drawn over the passage (links, highlights, scores)
+def lower_tokens():
+    storyCnv.tag_lower('toktext')
+    storyCnv.tag_lower('tokroot')
+    storyCnv.tag_lower('tokbox')
+
+
+# forgets the token items of the displayed passage (after the canvas is cleared)
+def clear_lines():
+    global psg_model
+    psg_model = None
+    line_items.clear()
+    item_pool.clear()
+    root_pool.clear()
+
+
+# yscrollcommand of storyCnv: moves the scrollbar, and (once per batch of scroll events) draws the lines scrolled into view
+def story_scrolled(first, last):
+    global view_id
+    storyScroll.set(first, last)
+    if view_id is None and psg_model is not None:
+        view_id = root.after_idle(sync_view)
+
+
+# releases the lines that left the viewport (and its margin), and draws the lines that entered it
+def sync_view():
+    global view_id
+    view_id = None
+    if psg_model is None:
+        return
+    win = set(window_lines(psg_model.geo))
+    for l in [l for l in line_items if l not in win]:
+        release_line(l)
+    queue_render('psg', passage_steps(psg_model))
+
+
+# scrolls the passage so that canvas y coordinate y is in view
+def see_y(y):
+    top = storyCnv.canvasy(0)
+    if y < top + Y_MIN or y > top + STORY_H - V_GAP:
+        storyCnv.yview_moveto(max(0, y - STORY_H // 3) / psg_height)
+
+
+# draws the passage's coreference links (layer tagged 'coref'), a link per step
+def draw_corefs(d, toks):
+    crefcolr = 0
+    for k in d['corefs']:                          # k is the key to a single set of coreferences (refs to same entity)
+       references = []                             # this will store the referring tokens
+       for ref in d['corefs'][k]:                  # ref is an individual coref in k
+          sentnum = ref['sentNum']
+          toknum = ref['startIndex']
+          if ref['repmention']:
+            referent = toks.sent_first[sentnum] + toknum
+          else:         
+            references.append(toks.sent_first[sentnum] + toknum)
+       endx = toks.x[referent]
+       endy = toks.y[referent]
+       for ref in references:
+         startx = toks.x[ref]
+         starty = toks.y[ref]
+
+         crefcolr = (crefcolr + 1) % len(coref_colors)
+
+         link_toks(storyCnv, startx, starty, endx, endy, coref_colors[crefcolr], arcit=True, tags='coref')
+         yield
+
+
+# draws the dependency links of a passage or question (layer tagged layer, and each link tagged with its dependency group),
+# a link per step
+def draw_deps(cnv, toks, deps, layer):
+    for dep in deps:
+       dtype = dep[0] # dependency type
+       t1 = dep[1]    # token 1 (from)
+       t2 = dep[2]    # token 2 (to)
+       startx = toks.x[t1]
+       starty = toks.y[t1] + FONT_H + 6
+       endx = toks.x[t2]
+       endy = toks.y[t2]
+       link_toks(cnv, startx, starty, endx, endy, "#DC143C", tags=(layer, 'dep-'+REVDEPD[dtype]))
+       yield
+
+
+# draws the rationale highlight of a question over the passage (layer tagged 'rationale')
+# the rationale's first/last tokens were resolved when the corpus was loaded (unresolved spans are not highlighted)
+def draw_rationale(pnum, qnum):
+    span = rationales.span(pnum, qnum)
+    if span is None:
+        return
+    highlight_span(span[0], span[1], 'orange', .3, 'rationale')
+
+
+# highlights the passage tokens f_tok..l_tok (one translucent box per line: first line, last line, lines in between)
+def highlight_span(f_tok, l_tok, fill, alpha, layer):
+    toks = psg_model.toks
+    f_line = toks.line[f_tok]                   # get first line (on canvas) of span
+    l_line = toks.line[l_tok]                   # get last line (on canvas) of span
+                
+    # highlingt first line of span
+    x1 = toks.x[f_tok]
+    if x1 == X_MIN:
+        x1 = X_MIN - 10                             # if it begins at the start of canvas line, add a border to left
+    else:
+        x1 -= W_GAP * FONT_W                                # otherwise slightly pad the highlingh on the left
+    if l_line != f_line or (l_tok < len(toks) - 1 and toks.line[l_tok+1] != f_line):
+        x2 = X_MAX + 10                             # if first will span to right margin, add border
+    else:
+         x2 = toks.x[l_tok] + (len(toks.tok[l_tok])+2) * FONT_W     # otherwise pad last token on the right
+    y1 = toks.y[f_tok] - V_GAP//3               # pad highlight above token
+    y2 = toks.y[f_tok] + FONT_H + V_GAP//2      # pad highlight below token
+
+    alpha_rect(root, storyCnv, x1, y1, x2, y2, False, fill=fill, alpha=alpha, tags=layer)
+
+    # highlight last line of span, when there are at least two lines to be highlighted    
+    if l_line != f_line:
+        x1 = X_MIN - 10                             # last line (of multi-line) always begins at left margin
+        if l_tok < len(toks) - 1 and toks.line[l_tok+1] != l_line:
+            #print("DIFF")
+            x2 = X_MAX + 10                         # if first will span to right margin, add border
+        else:
+             x2 = toks.x[l_tok] + (len(toks.tok[l_tok])+1) * FONT_W # otherwise pad last token on the right
+        y1 = toks.y[l_tok] - V_GAP//3                                   # pad highlight above token
+        y2 = toks.y[l_tok] + FONT_H + V_GAP//2                          # pad highlight below token
+        alpha_rect(root, storyCnv, x1, y1, x2, y2, False, fill=fill, alpha=alpha, tags=layer)
 
+    # highlight spans of more than 2 lines (from line after the first to the line before the last)
+    if l_line - f_line > 1:
+        x1 = X_MIN - 10                                                     # the "betweens" are always full lines - start at left
+        x2 = X_MAX + 10                                                     # and go to the right margin
+        y1 = toks.y[f_tok] + FONT_H + V_GAP//2 + 1                      # y1 begins immediately after first line
+        y2 = toks.y[l_tok] - V_GAP//3                                   # y2 ends immediately before last line                    
+        alpha_rect(root, storyCnv, x1, y1, x2, y2, False, fill=fill, alpha=alpha, tags=layer)
 
 
 # output the current question/answer/rationale on the qar canvas
-def show_qar(pnum=0, qnum=0):
-    tg = P_TAG                                  # Assume POS tags will be used for label colors
-    if lbltg == 'NE':                           # Unless NE tags are called for
-        tg = N_TAG
-
+def show_qar(pnum=0, qnum=0, keep_search=False):
     global scrollable
-    scrollable = False
+    if not keep_search:
+        scrollable = False
 
     global seg_scores_list
     
     qarCnv.delete("all")                            # clear the qar canvas
-    qtok_d.clear()
-    atok_d.clear()
 
-    while q_ghost_labels:                           # clear all question ghost labels 
-        widget = q_ghost_labels.pop()
-        widget.destroy()
+    global nav_held
+    nav_held = False                                # (the panels are drawn in full again)
+    hover_off()
 
-    while a_ghost_labels:                           # clear all answer ghost labels 
-        widget = a_ghost_labels.pop()
-        widget.destroy()
-
-    images['rationale'].clear()                     # clear all rationale highlights
-    
-    d = coqa[pnum]                                  # load entire passage from coqa
+    storyCnv.delete('rationale')                    # clear all rationale highlights
+    images['rationale'].clear()
+    drawn_layers.difference_update(('rationale', 'qdeps'))
     
     qarCnv.create_text(98, 10, text=str(qnum+1), font=("Arial", 14)) # output question number
    
-    qs = d['q_tagged'][qnum]                        # load the tagged question from coqa
-
-    x = X_MIN                                       # x is token's x coordinate
-    y = Q_Y_MIN                                     # y is token's y coordinate
-    qline_num = 1
+    global qar_model
+    with tracer.phase('layout'):
+        qa_layout(coqa, pnum, qnum)
+    with tracer.phase('prep'):
+        m = qar_model = models.get(('q', pnum, qnum))   # render-ready question/answer (usually prefetched)
+    q_deps[:] = m.deps
 
-    pdeps = []
+    # remove the old span scores (rankings) for the question from the story/passage board
+    for itm in seg_scores_list:
+       storyCnv.delete(itm)
+    seg_scores_list.clear()
 
-    deps = [(dep[0], dep[1], dep[2]) for dep in d['q_dep'][qnum]]  # (1-based) index0 is dependency type, index1 is token index receiver of dependency, index2 token index of dependency 
-    depd = {}
-    rootdep = -1
-    for dep in deps:
-      if dep[0] != 'ROOT':
-         depd[dep[2]-1] = (dep[0].upper(),dep[1]-1)        # ensure 0-based token indices are stored
-      else:
-         rootdep = dep[2]-1
-
-
-    for j in range(len(qs)):                        # j is the index of each token tuple
-        qtoks = {}
-        q = qs[j]                                   # q is the entire token tuple
-        tok = q[TOK]                                # tok is the token
-        tlen = len(tok)                             # tlen is token's length in characters 
-        glen = W_GAP * FONT_W                       # glen is the gap that precedes the token (in pixels)
-        outlen = tlen * FONT_W                      # outlen is the token's length in pixels
-        if x + (W_GAP + tlen) * FONT_W >= Q_X_MAX:  # text exceeds Q_X_MAX (right screen margin), so wrap 
-            x = X_MIN
-            y += V_GAP
-            qline_num += 1
-        elif x > X_MIN:                             # only precede token by gap if it is not the first token in the line
-            x += glen
-
-        colr = dcolr                            # Tokens not having tags of interest are output with default label color
-
-        if qs[j][tg] == '<':
-            qs[j][tg] = qs[j-1][tg]              # "Fixes" preprocessed data by expanding previously collapsed token tag (<)
-        toktag = qs[j][tg]                      # extract the tag that will be used for label color
-                              
-        qtoks['tok'] = tok
-        qtoks['pos'] = q[P_TAG]
-        qtoks['ne'] = q[N_TAG]
-        qtoks['lemma'] = q[L_TAG]
-        qtoks['sent'] = 0
-        qtoks['s_tok'] = j
-        qtoks['x'] = x
-        qtoks['y'] = y
-        qtoks['line'] = qline_num
-        if j in depd and depd[j][0] in DEPLST:          # if tag is a member of the selected highlighting (the split[0] is for NE tags)
-            qtoks['deptype'] = depd[j][0]
-            qtoks['dep_ref'] = depd[j][1]
-            pdeps.append((depd[j][0], j, depd[j][1]))
-        else:
-           qtoks['deptype'] = ""
-           qtoks['dep_ref'] = ""
+    cancel_render(('qar', 'layers'))                # a question still being drawn is abandoned (its passage is not)
+    queue_render('qar', qar_steps(pnum, qnum, m))
+    queue_render('layers', layer_steps(pnum, qnum)) # then the rationale and the links
 
-        qtok_d[j] = qtoks
-        
 
-        if lbltg != 'DEP':
-           for tagk in tag_colors:                 # Search for the correct color (it's a many to one (color) mapping
-            if tag_colors[tagk]['ttype'] == lbltg and tag_colors[tagk]['sel'].get():    # if right label and checked for viewing
-                if toktag.split()[0] in tag_colors[tagk]['mbrs']:          # search all tags that use the particular color
-                    colr = tag_colors[tagk]['color']            # and store its value
-                    break
-        else:
-            for tagk in tag_colors:                 # Search for the correct color (it's a many to one (color) mapping
-               if tag_colors[tagk]['ttype'] == lbltg and tag_colors[tagk]['sel'].get():    # if right label and checked for viewing
-                  if j in depd and depd[j][0] in tag_colors[tagk]['mbrs']:          # if tag is a member of the selected highlighting (the split[0] is for NE tags)
-                     colr = tag_colors[tagk]['color']            # store its color value
-                     break
-           
-
-      
-        # output ghost label to enable hovering information, and append ghost label to list
-        lbl = Label(qarCnv, text='', font=("consolas", 1), anchor='nw', bg=ghost_lbl_colr) #, borderwidth=1, relief="solid")
-        lbl.bind("<Enter>", lambda name='qghost', ref=j, x=x, y=y : hover_on(lbl, 'qhover', ref, x, y))
-        lbl.bind("<Leave>", lambda name='qghost': hover_off(lbl))
-        lbl.place(x=x-8, y=y)
-        q_ghost_labels.append(lbl)
+# render steps of a question/answer (a token per step), then of the passage's span scores for the question
+def qar_steps(pnum, qnum, m):
+    for j in range(len(m.qtoks)):                   # j is each question token
+        tok = m.qtoks.tok[j]                        # tok is the token
+        outlen = len(tok) * FONT_W                  # outlen is the token's length in pixels
+        x = m.qtoks.x[j]                            # x is token's x coordinate
+        y = m.qtoks.y[j]                            # y is token's y coordinate
 
         # output the (colorized) token
-        qarCnv.create_rectangle(x-2, y, x+outlen+2, y+FONT_H+5, outline="#000", fill=colr)
-        if j == rootdep: qarCnv.create_rectangle(x-3, y-2, x+outlen+4, y+FONT_H+7, width=3, outline="#000")
+        colr = code_colors[m.qcodes[lbltg][j]]
+        tags = m.qtags[j]
+        qarCnv.create_rectangle(x-2, y, x+outlen+2, y+FONT_H+5, outline="#000", fill=colr, tags=tags)
+        if j == m.root: qarCnv.create_rectangle(x-3, y-2, x+outlen+4, y+FONT_H+7, width=3, outline="#000")
         qarCnv.create_text(x, y, text=tok, font=("consolas", 8), anchor='nw')
+        yield
 
-        x += (W_GAP + tlen) * FONT_W                # update the x pixel coordinate
-
-
-
-    ans = d['a_tagged'][qnum]                       # load the tagged answer from coqa
-
-    x = X_MIN                                       # x is token's x coordinate
-    y = A_Y_MIN                                     # y is token's y coordinate
-    aline_num = 1    
-    for j in range(len(ans)):                       # j is the index of each token tuple
-        atoks = {}
-        a = ans[j]                                  # a is the entire token tuple
-        tok = a[TOK]                                # tok is the token
-        tlen = len(tok)                             # tlen is token's length in characters 
-        glen = W_GAP * FONT_W                       # glen is the gap that precedes the token (in pixels)
-        outlen = tlen * FONT_W                      # outlen is the token's length in pixels
-        if x + (W_GAP + tlen) * FONT_W >= Q_X_MAX:  # text exceeds Q_X_MAX (right screen margin), so wrap
-            x = X_MIN
-            y += V_GAP
-            aline_num += 1
-        elif x > X_MIN:                             # only precede token by gap if it is not the first token in the line
-            x += glen
-
-        colr = dcolr                               # Tokens not having tags of interest are output with default label color
-
-
-        if ans[j][tg] == '<':
-            ans[j][tg] = ans[j-1][tg]              # "Fixes" preprocessed data by expanding previously collapsed token tag (<)
-        toktag = ans[j][tg]                        # extract the tag that will be used for label color
-                              
-        for tagk in tag_colors:                    # Search for the correct color (it's a many to one (color) mapping
-            if tag_colors[tagk]['ttype'] == lbltg and tag_colors[tagk]['sel'].get():    # if right label and checked for viewing
-                if toktag.split()[0] in tag_colors[tagk]['mbrs']:          # search all tags that use the particular color
-                    colr = tag_colors[tagk]['color']            # and store its value
-                    break
-
-        # output ghost label to enable hovering information, and append ghost label to list
-        lbl = Label(qarCnv, text='', font=("consolas", 1), anchor='nw', bg=ghost_lbl_colr) #, borderwidth=1, relief="solid")
-        lbl.bind("<Enter>", lambda name='aghost', ref=j, x=x, y=y : hover_on(lbl, 'ahover', ref, x, y))
-        lbl.bind("<Leave>", lambda name='aghost': hover_off(lbl))
-        lbl.place(x=x-8, y=y)
-        a_ghost_labels.append(lbl)
+    for j in range(len(m.atoks)):                   # j is each answer token
+        tok = m.atoks.tok[j]                        # tok is the token
+        outlen = len(tok) * FONT_W                  # outlen is the token's length in pixels
+        x = m.atoks.x[j]                            # x is token's x coordinate
+        y = m.atoks.y[j]                            # y is token's y coordinate
 
         # output the (colorized) token
-        qarCnv.create_rectangle(x-2, y, x+outlen+2, y+FONT_H+5, outline="#000", fill=colr)
+        colr = code_colors[m.acodes[lbltg][j]]
+        tags = m.atags[j]
+        qarCnv.create_rectangle(x-2, y, x+outlen+2, y+FONT_H+5, outline="#000", fill=colr, tags=tags)
         qarCnv.create_text(x, y, text=tok, font=("consolas", 8), anchor='nw')
+        yield
 
-        atoks['tok'] = tok
-        atoks['pos'] = a[P_TAG]
-        atoks['ne'] = a[N_TAG]
-        atoks['lemma'] = a[L_TAG]
-        atoks['sent'] = 0
-        atoks['s_tok'] = j
-        atoks['x'] = x
-        atoks['y'] = y
-        atoks['line'] = aline_num
-        atoks['deptype'] = ""
-        atoks['dep_ref'] = ""
-
-        atok_d[j] = atoks
-        
-        x += (W_GAP + tlen) * FONT_W                # update the x pixel coordinate
-
-
-    if showRationale.get():
-        # highligh rationale given for answer - remove leading/trailing punctuation and whitespace
-        r_start = d['rationale'][qnum][0]          
-        r_end = d['rationale'][qnum][1]
-        span = d['story'][r_start:r_end]                # original rationale span
-        blen = len(span)                                # get span length
-        span = span.lstrip(' \t\n,.:')                  # remove leading undesired
-        alen = len(span)                                # get (possibly) new length
-        r_start += blen - alen                          # adjust span start by leading removed (if any)
-        span = span.rstrip(' \t\n,.:')                  # remove trailing undesired
-        blen = len(span)                                # get (possibly) new length
-        r_end -= alen - blen                            # adjust span end by trailing removed (if any)
-        span = d['story'][r_start:r_end]                # get "cleaned" span
-
-        f_tok = -1
-        l_tok = -1
-        for k in range(len(psgtok_d)):
-            if int(psgtok_d[k]['s_map']) >= r_start:
-                break
-
-        if int(psgtok_d[k]['s_map']) > r_start and k > 0:
-            f_tok = k - 1
-        elif int(psgtok_d[k]['s_map']) == r_start:
-            f_tok = k
-        else:
-            print("Error did not find start token!")
+    if scores is not None:                          # (scores still loading are drawn once they arrive)
+        yield from score_steps(pnum, qnum)
 
-        if len(span) > len(psgtok_d[f_tok]['tok']): 
-            for k in range(f_tok, len(psgtok_d)):
-                if int(psgtok_d[k]['s_map']) >= r_end:
-                    break
-            l_tok = k - 1
-        else:
-            l_tok = f_tok
-        
-        f_line = psgtok_d[f_tok]['line']                   # get first line (on canvas) of span
-        l_line = psgtok_d[l_tok]['line']                   # get last line (on canvas) of span
-                    
-        # highlingt first line of rationale span
-        x1 = psgtok_d[f_tok]['x']
-        if x1 == X_MIN:
-            x1 = X_MIN - 10                             # if it begins at the start of canvas line, add a border to left
-        else:
-            x1 -= W_GAP * FONT_W                                # otherwise slightly pad the highlingh on the left
-        if l_tok < len(psgtok_d) - 1 and psgtok_d[l_tok+1]['line'] != f_line:
-            x2 = X_MAX + 10                             # if first will span to right margin, add border
-        else:
-             x2 = psgtok_d[l_tok]['x'] + (len(psgtok_d[l_tok]['tok'])+2) * FONT_W     # otherwise pad last token on the right
-        y1 = psgtok_d[f_tok]['y'] - V_GAP//3               # pad highlight above token
-        y2 = psgtok_d[f_tok]['y'] + FONT_H + V_GAP//2      # pad highlight below token
-
-        alpha_rect(root, storyCnv, x1, y1, x2, y2, False, fill='orange', alpha=.3)
-
-        # highlight last line of rationale, when there are at least two lines to be highlighted    
-        if l_line != f_line:
-            x1 = X_MIN - 10                             # last line (of multi-line) always begins at left margin
-            if l_tok < len(psgtok_d) - 1 and psgtok_d[l_tok+1]['line'] != l_line:
-                #print("DIFF")
-                x2 = X_MAX + 10                         # if first will span to right margin, add border
-            else:
-                 x2 = psgtok_d[l_tok]['x'] + (len(psgtok_d[l_tok]['tok'])+1) * FONT_W # otherwise pad last token on the right
-            y1 = psgtok_d[l_tok]['y'] - V_GAP//3                                   # pad highlight above token
-            y2 = psgtok_d[l_tok]['y'] + FONT_H + V_GAP//2                          # pad highlight below token
-            alpha_rect(root, storyCnv, x1, y1, x2, y2, False, fill='orange', alpha=.3)
-
-        # highlight rationales that span more than 2 lines (from line after the first to the line before the last)
-        if l_line - f_line > 1:
-            x1 = X_MIN - 10                                                     # the "betweens" are always full lines - start at left
-            x2 = X_MAX + 10                                                     # and go to the right margin
-            y1 = psgtok_d[f_tok]['y'] + FONT_H + V_GAP//2 + 1                      # y1 begins immediately after first line
-            y2 = psgtok_d[l_tok]['y'] - V_GAP//3                                   # y2 ends immediately before last line                    
-            alpha_rect(root, storyCnv, x1, y1, x2, y2, False, fill='orange', alpha=.3)
-        
-    if showDeps.get():
-      for dep in pdeps:
-         dtype = dep[0] # dependency type
-         t1 = dep[1]    # token 1 (from)
-         t2 = dep[2]    # token 2 (to)
-         if tag_colors[REVDEPD[dtype]]['sel'].get():
-            startx = qtok_d[t1]['x']
-            starty = qtok_d[t1]['y'] + FONT_H + 6
-            endx = qtok_d[t2]['x']
-            endy = qtok_d[t2]['y']
-            link_toks(qarCnv, startx, starty, endx, endy, "#DC143C")
 
-    # remove the old span scores (rankings) for the question from the story/passage board
-    for itm in seg_scores_list:
-       storyCnv.delete(itm)
-    seg_scores_list.clear()
+# render steps of the passage's span scores (rankings) for a question, a sentence per step
+def score_steps(pnum, qnum):
+    segnums, segscores = get_seg_ranks(pnum,qnum)     # already in rank order (ranked once at load time)
+    others = {}                                       # sentence -> ranks of the other runs (when several are compared)
+    if len(score_runs) > 1:
+        sents, ranks = score_runs.ranks(pnum, qnum)
+        others = {int(s): ranks[1:, i] for i, s in enumerate(sents)}
 
-    # output the span scores/rankings for this question
-    segscores = get_seg_scores(pnum,qnum)
-    segscores = sorted(segscores,key=lambda x: x[1],reverse=True)
-    
     rank = 1       
-    for itm in segscores:
-       snum = itm[0]
-       qscore = format(itm[1],'.3f')
-       tok = segtok_d[(snum,0)]
+    for k in range(len(segnums)):
+       snum = int(segnums[k])
+       qscore = format(segscores[k],'.3f')
+       tok = psg_model.toks.sent_first[snum]        # first token of the sentence
        fcolor = 'black'
        txt = '#'+str(rank)+'  '+qscore
-       x = psgtok_d[tok]['x']
-       y = psgtok_d[tok]['y']
+       if others:
+          txt += '  | '+' '.join(str(r) if r else '-' for r in others[snum])    # (run 2, 3, ... ranks)
+       x = psg_model.toks.x[tok]
+       y = psg_model.toks.y[tok]
        if rank == 1:
           fcolor = 'red'
-          seg_scores_list.append(storyCnv.create_rectangle(x-10, y-12, x+30, y-1, fill='yellow', outline=""))
-       seg_scores_list.append(storyCnv.create_text(x-10, y-12, text=txt, font=("Arial 7"), anchor='nw', fill=fcolor)) 
+          seg_scores_list.append(storyCnv.create_rectangle(x-10, y-12, x+30, y-1, fill='yellow', outline="", tags='score'))
+       seg_scores_list.append(storyCnv.create_text(x-10, y-12, text=txt, font=("Arial 7"), anchor='nw', fill=fcolor, tags='score')) 
        rank += 1
-
- 
-# loads the (externally generated) scores for individual sentences 
-def load_scores_dict():
-   with open('sentence-scores.txt','r') as ff:
-      sdict = {}                                              # scores dictionary
-      for line in ff:
-         line = line.split()
-         pqs = line[0].split('.')
-         pnum = int(pqs[0])
-         qnum = int(pqs[1])
-         segnum = int(pqs[2])
-         segscore = float(line[1])
-         if pnum not in sdict:
-            sdict[pnum] = {}
-         if qnum not in sdict[pnum]:
-            sdict[pnum][qnum] = []
-
-         sdict[pnum][qnum].append((segnum,segscore))
-
-   return sdict
-
-
-# returns (a copy) of the list of sentence scores from the scores dictionary for the passage (pnum)/question(num)
-# the copy preserves original list since returned value is manipulated
-def get_seg_scores(pnum,qnum):
-   return([] + scores_dict[pnum][qnum])
+       yield
+
+
+# shows/hides the coref, dependency and rationale layers at once, and queues the drawing of the layers that are shown
+# but not drawn yet for the passage/question
+def update_layers(pnum, qnum):
+    layer_states()
+    if navigating():
+        return                                      # (drawn with the passage/question navigated to)
+    queue_render('layers', layer_steps(pnum, qnum))
+
+
+# render steps of the layers: draws (rationale first, then the links) each layer shown for the first time for the
+# passage/question, then shows/hides the layers and prepares the neighbors in the background while the user reads
+# (layers are hidden with item state, so toggling a checkbox never re-creates the passage)
+def layer_steps(pnum, qnum):
+    if showRationale.get() and 'rationale' not in drawn_layers:
+        storyCnv.delete('rationale')                # (a layer abandoned while it was drawn is redrawn from scratch)
+        images['rationale'].clear()
+        draw_rationale(pnum, qnum)
+        drawn_layers.add('rationale')
+        yield 'rationale'                           # (the step's phase, for the instrumentation)
+    if showCorefs.get() and 'coref' not in drawn_layers:
+        storyCnv.delete('coref')
+        yield from draw_corefs(coqa[pnum], psg_model.toks)
+        drawn_layers.add('coref')
+    if showDeps.get() and 'pdeps' not in drawn_layers:
+        storyCnv.delete('pdeps')
+        yield from draw_deps(storyCnv, psg_model.toks, p_deps, 'pdeps')
+        drawn_layers.add('pdeps')
+    if showDeps.get() and 'qdeps' not in drawn_layers:
+        qarCnv.delete('qdeps')
+        yield from draw_deps(qarCnv, qar_model.qtoks, q_deps, 'qdeps')
+        drawn_layers.add('qdeps')
+    storyCnv.tag_raise('score')                     # keep the sentence rankings above any layer drawn after them
+    layer_states()
+    prefetch_near(pnum, qnum)
+
+
+# shows/hides the drawn layers (and the dependency groups) as the checkboxes are set
+def layer_states():
+    storyCnv.itemconfigure('coref', state=NORMAL if showCorefs.get() else HIDDEN)
+    storyCnv.itemconfigure('rationale', state=NORMAL if showRationale.get() else HIDDEN)
+    for tagk in tag_colors:
+        if tag_colors[tagk]['ttype'] == 'DEP':
+            state = NORMAL if showDeps.get() and tag_colors[tagk]['sel'].get() else HIDDEN
+            storyCnv.itemconfigure('dep-'+tagk, state=state)
+            qarCnv.itemconfigure('dep-'+tagk, state=state)
+
+
+# queues render steps (a generator that draws a little per step), replacing any queued (or partly drawn) steps of the
+# same kind: 'psg' (passage tokens), 'qar' (question/answer tokens and span scores) or 'layers'
+def queue_render(kind, steps):
+    global render_id
+    render_queue[:] = [r for r in render_queue if r[0] != kind]
+    render_queue.append((kind, steps))
+    if render_id is None:
+        render_id = root.after_idle(run_render)
+
+
+# abandons the queued render steps of the given kinds (all of them by default)
+def cancel_render(kinds=None):
+    global render_id
+    render_queue[:] = [r for r in render_queue if kinds is not None and r[0] not in kinds]
+    if not render_queue and render_id is not None:
+        root.after_cancel(render_id)
+        render_id = None
+
+
+# draws queued render steps for up to RENDER_SLICE_MS, then lets the mainloop handle events before the next chunk
+# (the time of each step is added to its phase: the phase it yields, or its kind's)
+def run_render():
+    global render_id
+    render_id = None
+    end = time.perf_counter() + RENDER_SLICE_MS / 1000
+    while render_queue:
+        kind, steps = render_queue[0]
+        t = time.perf_counter()
+        for phase in steps:
+            now = time.perf_counter()
+            tracer.add(phase or RENDER_PHASES[kind], now - t)
+            if now >= end:
+                render_id = root.after(1, run_render)
+                return
+            t = now
+        tracer.add(RENDER_PHASES[kind], time.perf_counter() - t)
+        render_queue.pop(0)
+    tracer.rendered()
+
+
+# builds the render-ready model of ('p', passage) or ('q', passage, question) (called on the prefetch thread)
+def build_model(key):
+    if key[0] == 'p':
+        return PassageModel(coqa, key[1], DEPSET, categories)
+    return QAModel(coqa, key[1], key[2], DEPSET, categories)
+
+
+# schedules the models of the passages/questions the user can page to next: the neighboring questions of the
+# displayed passage, and the neighboring passages (with their first question), nearest first
+def prefetch_near(pnum, qnum):
+    nq = coqa.passage_row(pnum)[P_NQ]
+    keys = []
+    for k in range(1, PREFETCH_DEPTH + 1):
+        for p in ((pnum + k) % len(coqa), (pnum - k) % len(coqa)):
+            keys += [('p', p), ('q', p, 0)]
+        if nq:
+            keys += [('q', pnum, (qnum + k) % nq), ('q', pnum, (qnum - k) % nq)]
+    models.schedule(keys)
+
+
+# returns the sentence numbers and scores for the passage (pnum)/question(num) ordered by rank (highest score first)
+def get_seg_ranks(pnum,qnum):
+   return scores.ranked(pnum,qnum)
+
+
+# returns the canvas item counts and the live widget count (for the instrumentation)
+def trace_counts():
+    widgets = 0
+    todo = [root]
+    while todo:
+        w = todo.pop()
+        widgets += 1
+        todo.extend(w.winfo_children())
+    return {'items': {'storyCnv': len(storyCnv.find_all()), 'qarCnv': len(qarCnv.find_all()), 'ctrlCnv': len(ctrlCnv.find_all())},
+            'widgets': widgets}
+
+
+# returns the state an instrumented operation runs under (passage/question and toggles)
+def trace_context():
+    return {'passage': currpsg, 'question': currqar, 'scheme': lbltg, 'corefs': showCorefs.get(), 'deps': showDeps.get(),
+            'rationale': showRationale.get()}
+
+
+# shows the last instrumentation record in the overlay
+def show_trace(rec):
+    ctrlCnv.itemconfigure(hudtxt, text=record_text(rec))
+
+
+# callback for F12: turns the instrumentation (and its overlay) on/off
+def toggle_tracing(e=None):
+    tracer.enabled = not tracer.enabled
+    tracer.current = None                           # (an operation still being drawn is not recorded)
+    ctrlCnv.itemconfigure(hudtxt, text='instrumentation on (F12 turns it off)' if tracer.enabled else '')
+
+
+# callback for the Metrics button: shows how the scores rank the rationale sentences of the whole corpus (MRR, top-k hit
+# rates and rank histogram, per question position and answer NE type) in the metrics panel (opened if it is closed)
+def show_metrics(e=None, refresh=False):
+    global question_facts
+    global metrics_win
+    global metrics_txt
+    if coqa is None or scores is None:
+        return
+    t = time.perf_counter()
+    if question_facts is None:
+        question_facts = QuestionFacts(coqa, rationales)    # (rationale sentences and answer NE types, computed once)
+    text = metrics_text(score_metrics(question_facts, scores))
+    if len(score_runs) > 1:
+        text = score_runs.names[0] + '\n\n' + text + '\n\n' + runs_text(question_facts, score_runs)
+    text += '\n\nComputed in ' + format((time.perf_counter() - t) * 1000, '.1f') + ' ms'
+    if metrics_win is None or not metrics_win.winfo_exists():
+        metrics_win = Toplevel(root)
+        metrics_win.title('CoQA News Viz - Sentence Ranking Metrics')
+        metrics_txt = Text(metrics_win, width=60, height=45, font=("consolas", 9))
+        metrics_txt.pack(fill="both", expand=True)
+    metrics_txt.config(state=NORMAL)
+    metrics_txt.delete('1.0', END)
+    metrics_txt.insert(END, text)
+    metrics_txt.config(state=DISABLED)
+    if not refresh:                                 # (updated scores refresh the panel without raising it)
+        metrics_win.lift()
+
+
+# callback for the Compare button: lists the questions whose sentences the scores runs rank most differently (in the
+# compare panel, opened if it is closed); double-clicking (or Return on) an entry shows its passage and question
+def show_disagreements(e=None, refresh=False):
+    global compare_win
+    global compare_lst
+    global disagreements
+    if coqa is None or score_runs is None or len(score_runs) < 2:
+        return
+    if not disagreements:
+        disagreements = score_runs.disagreements(DISAGREE_MAX)    # (runs are static: listed once)
+    if compare_win is None or not compare_win.winfo_exists():
+        compare_win = Toplevel(root)
+        compare_win.title('CoQA News Viz - Rank Disagreements')
+        legend = '\n'.join('run '+str(k+1)+': '+score_runs.names[k] for k in range(len(score_runs)))
+        Label(compare_win, text=legend, font=("consolas", 9), anchor='w', justify=LEFT).pack(fill="x")
+        scroll = Scrollbar(compare_win, orient=VERTICAL)
+        compare_lst = Listbox(compare_win, width=60, height=30, font=("consolas", 9), yscrollcommand=scroll.set)
+        scroll.config(command=compare_lst.yview)
+        scroll.pack(side="right", fill="y")
+        compare_lst.pack(side="left", fill="both", expand=True)
+        compare_lst.bind('<Double-Button-1>', goto_disagreement)
+        compare_lst.bind('<Return>', goto_disagreement)
+    compare_lst.delete(0, END)
+    for p, q, snum, spread, ranks in disagreements:
+        compare_lst.insert(END, 'P%-5d Q%-3d S%-3d spread %-3d ranks %s' % (p+1, q+1, snum+1, spread, ' '.join(str(r) for r in ranks)))
+    if not refresh:
+        compare_win.lift()
+
+
+# callback for the compare panel: shows the passage/question of the selected disagreement
+def goto_disagreement(e=None):
+    sel = compare_lst.curselection()
+    if not sel:
+        return
+    goto(*disagreements[sel[0]][:2])
+    see_y(psg_model.toks.y[psg_model.toks.sent_first[disagreements[sel[0]][2]]])    # (the sentence may be scrolled out of view)
+
+
+# asks the scores worker to read the rows added to the scores files/streams (see ScoreRuns.ingest), and applies what
+# its previous read found (on the Tk thread)
+def poll_scores():
+    global scores_reading
+    if score_update:
+        update, error = score_update.pop()
+        scores_reading = False
+        if error:
+            scores_status('Reading the new scores failed: '+error)
+        elif update is not None:
+            apply_scores(*update)
+    if not scores_reading:
+        scores_reading = True
+        score_requests.put(score_runs)
+    root.after(SCORES_POLL_MS, poll_scores)
+
+
+# the scores worker thread: reads the rows added to the sources of the runs it is given (the runs shown are not
+# changed), one read at a time; rows naming no sentence of the corpus are skipped
+def read_scores():
+    while True:
+        runs = score_requests.get()
+        try:
+            score_update.append((runs.ingest(scores_in_corpus), None))
+        except (OSError, ValueError) as e:          # (e.g. a malformed row: the rows read with it are skipped)
+            score_update.append((None, str(e)))
+
+
+# returns which score rows name a sentence of a question of the corpus
+def scores_in_corpus(pnums, qnums, snums):
+    psg = np.frombuffer(coqa.section('psg'), dtype=np.uint32).reshape(-1, P_COLS).astype(np.int64)
+    ok = (pnums >= 0) & (pnums < len(psg))
+    p = np.where(ok, pnums, 0)
+    return ok & (qnums >= 0) & (qnums < psg[p, P_NQ]) & (snums >= 0) & (snums < psg[p, P_NSEG])
+
+
+# shows a message about the scores read while the viewer is open, where the loading progress was shown
+def scores_status(text):
+    loadlbl.config(text=text, bg='orange')
+    loadlbl.place(x=300, y=8)
+
+
+# shows the updated scores: the rankings of the question shown are redrawn (in place) if its rows changed, and the
+# metrics and disagreements (if shown) recomputed
+def apply_scores(runs, pnums, qnums, skipped):
+    global score_runs
+    global scores
+    global disagreements
+    global scores_skipped
+    if skipped:
+        scores_skipped += skipped
+        scores_status(str(scores_skipped)+' new score rows skipped (no such passage, question or sentence)')
+    score_runs = runs
+    scores = runs.base
+    disagreements = None
+    if pnums is None or ((pnums == currpsg) & (qnums == currqar)).any():
+        if qar_model is not None and not nav_held and not any(k == 'qar' for k, _ in render_queue):
+            storyCnv.delete('score')                # (a question still being drawn draws them itself)
+            seg_scores_list.clear()
+            for _ in score_steps(currpsg, currqar):
+                pass
+            storyCnv.tag_raise('score')
+    if metrics_win is not None and metrics_win.winfo_exists():
+        show_metrics(refresh=True)
+    if compare_win is not None and compare_win.winfo_exists():
+        show_disagreements(refresh=True)
+
+
+# loads the corpus (with the category codes and rationale spans derived from it)
+def load_corpus_data():
+    c = load_corpus('coqa-news-preprocessed-final.json', keys=CORPUS_KEYS, tok_fields=M_TAG+1)    # memory-mapped (binary cache is rebuilt when the json file changes)
+    return c, CategoryCodes(c), RationaleMap(c)
+
+
+# runs load() on a worker thread; its result (or the exception it raised) is stored in loaded[name]
+# returns the thread
+def load_in_background(name, load):
+    def run():
+        try:
+            loaded[name] = load()
+        except Exception as e:
+            loaded[name] = e
+    t = threading.Thread(target=run, name='load-'+name, daemon=True)
+    t.start()
+    return t
+
+
+# prints how long after STARTUP_T0 a startup event happened
+def log_startup(event):
+    print('startup: '+event+' after '+format(time.perf_counter() - STARTUP_T0, '.3f')+' s')
+
+
+# render steps that log a startup event once steps are drawn
+def logged_steps(steps, event):
+    yield from steps
+    log_startup(event)
+
+
+# polls the loader threads (on the Tk thread): shows their progress, draws the first passage as soon as the corpus is
+# loaded, and the span scores as soon as they are
+def poll_loading():
+    global coqa
+    global categories
+    global rationales
+    global scores
+    global score_runs
+    global index_loader
+    for name in list(loaded):                       # (the loader threads add to loaded meanwhile)
+        if isinstance(loaded[name], Exception):
+            loadlbl.config(text='Loading the '+name+' failed (see the console)', bg='red')
+            raise loaded[name]
+    if coqa is None and 'corpus' in loaded:
+        coqa, categories, rationales = loaded['corpus']
+        index_loader = load_in_background('index', lambda c=coqa: load_index(c))   # Find's index (ready by the first search)
+        if rationales.report:                       # (rationale spans that could not be resolved to tokens)
+            print(rationales.report_text())
+        build_color_lut()
+        show_passage(currpsg)
+        render_queue[:] = [(k, logged_steps(st, 'first passage drawn') if k == 'psg' else st) for k, st in render_queue]
+        for w in data_widgets:
+            w.config(state=NORMAL)
+        bind_keys()
+        print(coqa.memory_report())
+    if scores is None and 'scores' in loaded:
+        score_runs = loaded['scores']
+        scores = score_runs.base
+        log_startup('scores loaded')
+        if len(score_runs) > 1:
+            for k in range(len(score_runs)):
+                print('scores run', k+1, score_runs.names[k], '('+str(len(score_runs.pending[k][0]))+' rows not in run 1)' if k else '')
+            compareBtn.config(state=NORMAL)
+        if qar_model is not None and not nav_held and not any(k == 'qar' for k, _ in render_queue):
+            queue_render('qar', score_steps(currpsg, currqar))    # (a question still being drawn draws them itself)
+    waiting = [name for name in ('corpus', 'scores') if name not in loaded]
+    if waiting:
+        loadlbl.config(text='Loading '+' and '.join(waiting)+'... '+format(time.perf_counter() - STARTUP_T0, '.1f')+' s')
+        root.after(LOAD_POLL_MS, poll_loading)
+    else:
+        loadlbl.place_forget()
+        metricsBtn.config(state=NORMAL)             # (the metrics need both the corpus and the scores)
+        threading.Thread(target=read_scores, name='scores-update', daemon=True).start()
+        root.after(SCORES_POLL_MS, poll_scores)     # (rows added to the scores files from now on are read as they come)
 
 
 def main():
     #test_it()
 
-    show_passage(currpsg)
+    load_in_background('corpus', load_corpus_data)
+    global score_files
+    score_files = sys.argv[1:] or score_files
+    load_in_background('scores', lambda: load_score_runs(score_files))    # columnar scores (reloaded from their .npz sidecars while the txt files are unchanged)
+    root.after_idle(log_startup, 'window shown')
+    poll_loading()
 
     root.mainloop()
 
@@ -850,7 +1260,11 @@ bottom = Frame(root, borderwidth=2, relief="solid")
 
 left = Frame(bottom, borderwidth=2, relief="solid")
 right = Frame(bottom, borderwidth=2, relief="solid")
-storyCnv = Canvas(top, width=1500, height=500)
+STORY_W = 1500          # passage canvas size (the passage scrolls vertically when it is taller)
+STORY_H = 500
+storyCnv = Canvas(top, width=STORY_W, height=STORY_H, yscrollincrement=V_GAP)    # scrolled a line at a time
+storyScroll = Scrollbar(top, orient=VERTICAL, command=storyCnv.yview)
+storyCnv.configure(yscrollcommand=story_scrolled)
 qarCnv = Canvas(left, width=1000, height=250)
 ctrlCnv = Canvas(right, width=500, height=250)
 
@@ -859,6 +1273,7 @@ bottom.pack(fill="both")
 left.pack(side="left", padx=5, pady=5)
 right.pack(side="right", expand=True, fill="both", padx=5, pady=5)
 storyCnv.pack()
+storyScroll.place(in_=storyCnv, relx=1.0, rely=0, relheight=1.0, anchor='ne')     # over the canvas' right margin
 qarCnv.pack()
 ctrlCnv.pack()
 
@@ -870,6 +1285,8 @@ searchLabel.place(x=1310, y=2)
 search_entry = Entry(storyCnv,width=20, font=("Arial",10), justify=LEFT)
 search_entry.place(x=1350,y=3)
 search_entry.bind("<Return>", lambda event : get_search_term('search', search_entry))
+search_count_lbl = Label(storyCnv, text='', font="consolas 7", anchor='nw')    # hit number / hit count of the search
+search_count_lbl.place(x=1351,y=24)
 
 
 qLabel = Label(qarCnv, text="Question", font=("Arial", 14))
@@ -878,12 +1295,49 @@ qLabel.place(x=2, y=Q_Y_MIN - 30)
 aLabel = Label(qarCnv, text="Answer", font=("Arial", 14))
 aLabel.place(x=2, y=A_Y_MIN - 30)                 
 
-with open('coqa-news-preprocessed-final.json', 'r', encoding='utf-8') as read_file:
-   coqa = json.load(read_file)
-   coqa = coqa['data']
+# passage keys and token fields (TOK..M_TAG) the viewer reads: passages are materialized with only these (compact mode)
+CORPUS_KEYS = ('story', 'story_num', 'rationale', 'corefs', 'seg_tagged', 'seg_dep', 'q_tagged', 'q_dep', 'a_tagged')
+
+# the window is shown at once: the corpus and the scores are loaded on worker threads (see poll_loading)
+LOAD_POLL_MS = 50       # interval at which the Tk thread checks on the loader threads
+loaded = {}             # 'corpus' -> (corpus, category codes, rationales), 'scores' -> scores (or the exception raised)
+coqa = None             # corpus (memory-mapped)
+categories = None       # integer codes of the POS/NE/DEP categories tokens are colored by
+rationales = None       # rationale spans resolved to passage tokens once (unresolved spans are reported when loaded)
+scores = None           # columnar scores (None until loaded: the span scores are then drawn as soon as they are)
+score_files = ['sentence-scores.txt']   # scores files compared (the command line's, if any), the first one shown in full
+score_runs = None       # the scores of every scores file, aligned to the first one's rows (scores is the first one's)
+SCORES_POLL_MS = 1000   # interval at which the scores files/streams are checked for new rows
+score_requests = queue.Queue()  # runs whose sources the scores worker is asked to read
+score_update = []       # ((runs, passages, questions, rows skipped) or None if no row was added, error) of its last read
+scores_reading = False  # the scores worker is reading the scores sources
+scores_skipped = 0      # rows read while the viewer is open that named no sentence of the corpus
+loadlbl = Label(storyCnv, text='Loading...', font="consolas 10", anchor='nw')     # loading progress (hidden once loaded)
+loadlbl.place(x=300, y=8)
+
+VIRT_MARGIN = STORY_H   # lines up to this many pixels above/below the viewport are drawn too (ready to be scrolled to)
+line_items = {}         # line of the displayed passage -> (box, root box or None, text) items of each of its tokens
+item_pool = []          # (box, text) items of lines scrolled out of view, hidden and kept for reuse
+root_pool = []          # root boxes of lines scrolled out of view
+psg_model = None        # model of the displayed passage (None while only its header is drawn)
+qar_model = None        # model of the displayed question/answer
+psg_height = STORY_H    # height of the passage's scroll region
+view_id = None          # pending after id of the redraw of the lines scrolled into view
+
+RENDER_SLICE_MS = 20    # longest a render chunk runs before the mainloop gets control back
+RENDER_PHASES = {'psg': 'canvas', 'qar': 'canvas', 'layers': 'links'}    # instrumentation phase of each render kind
+render_queue = []       # (kind, steps) of the render in progress, drawn in order
+render_id = None        # pending after id of the next render chunk
+
+NAV_RELEASE_MS = 50     # delay before drawing after a navigation key is released (auto-repeat presses it again sooner)
+nav_header_id = None    # pending header-only render (while a navigation key is held)
+nav_render_id = None    # pending render of the passage/question navigated to (after the key is released)
+nav_held = False        # only the header is drawn
+nav_psg = False         # the passage changed since it was last drawn
+
+PREFETCH_DEPTH = 2     # passages (and questions) on either side of the displayed one that are prepared in the background
+models = Prefetcher(build_model)    # render-ready passage/question models, prepared off the Tk thread
 
-scores_dict = load_scores_dict()
-	
 qmap = {}
 
 currpsg = 0    # current passage (story) being displayed
@@ -976,29 +1430,82 @@ defFrame.place(x=432, y=97)
 defChkBtn = Checkbutton(defFrame, text="Show", var=showDeps, command=(lambda : show_dep_chk()))
 defChkBtn.pack(side=LEFT)
 
-hoverlbl = Label(storyCnv, text='sup', font=("consolas", 8), anchor='nw', bg='magenta') #, borderwidth=1, relief="solid")
-hoverlbl.pack_forget()
+# corpus-wide ranking metrics panel (a separate window, opened by the Metrics button)
+question_facts = None   # per-question facts the metrics are computed from (built when the panel is first opened)
+metrics_win = None      # metrics window (None until opened)
+metrics_txt = None      # its text
+metricsBtn = Button(ctrlCnv, text='Metrics', font=("consolas", 9), command=show_metrics, state=DISABLED)
+metricsBtn.place(x=432, y=215)
+
+# rank disagreement panel (a separate window, opened by the Compare button when several scores files are compared)
+DISAGREE_MAX = 200      # questions listed
+disagreements = None    # (passage, question, sentence, rank spread, ranks) of the questions listed
+compare_win = None      # disagreement window (None until opened)
+compare_lst = None      # its list
+compareBtn = Button(ctrlCnv, text='Compare', font=("consolas", 9), command=show_disagreements, state=DISABLED)
+compareBtn.place(x=432, y=188)
+
+hoverlbl = Label(root, text='', font=("consolas", 8), anchor='nw', bg='#FFFF00', relief=GROOVE, justify=LEFT)    # moved/reconfigured on hover
 
 scroll_idx = 0
 scrollable_lst = []
 scroll_cnv = storyCnv
 scrollable = False
 search_term = ""
+search_index = None     # corpus-wide inverted index (taken from its loader on the first search)
+index_loader = None     # thread building (or loading from disk) the inverted index once the corpus is loaded
+text_index = None       # joined story text and token offsets for phrase/regex search (built on the first one)
+scroll_spans = None     # last token of each phrase/regex match (None when searching single tokens)
+search_groups = None    # offsets of the hits of each passage/question/answer in the search results (see hit_groups)
+found_psg = -1          # passage whose phrase/regex matches are highlighted
 search_fail_lbl = Label(storyCnv, text='End reached. Text not found.', font="consolas 7 bold", anchor='nw', bg='red', borderwidth=0, justify=CENTER) # relief="solid")
 scroll_rect = storyCnv.create_rectangle(0,0,0,0)    # bogus rectangle so we get global variable 
 
-# bind callback functions to handle keys
-root.bind('<Prior>', scroll_prior_cb)
-root.bind('<Shift-F3>', scroll_prior_cb)
-root.bind('<Next>', scroll_next_cb)
-root.bind('<F3>', scroll_next_cb)
-root.bind('<Left>', p_prev_cb)
-root.bind('<Right>', p_next_cb)
-root.bind('<Up>', qar_prev_cb)
-root.bind('<Down>', qar_next_cb)
-root.bind('<Escape>', clear_scrollable_cb)
-root.bind('<Control-f>', ctrl_f)
+# controls that need the corpus stay disabled until it is loaded
+data_widgets = [search_entry, passage_entry, btnPprev, btnPnext, btnQprev, btnQnext, rationaleChkBtn, corefChkBtn, defChkBtn]
+data_widgets += [tag_colors[k]['chkbox'] for k in tag_colors]
+for w in data_widgets:
+    w.config(state=DISABLED)
+
+
+# bind callback functions to handle keys (once the corpus is loaded)
+def bind_keys():
+    root.bind('<Prior>', scroll_prior_cb)
+    root.bind('<Shift-F3>', scroll_prior_cb)
+    root.bind('<Next>', scroll_next_cb)
+    root.bind('<F3>', scroll_next_cb)
+    root.bind('<Left>', lambda e: nav_key_cb(e, -1, 0))
+    root.bind('<Right>', lambda e: nav_key_cb(e, 1, 0))
+    root.bind('<Up>', lambda e: nav_key_cb(e, 0, -1))
+    root.bind('<Down>', lambda e: nav_key_cb(e, 0, 1))
+    for key in ('Left', 'Right', 'Up', 'Down'):
+        root.bind('<KeyRelease-'+key+'>', nav_release_cb)
+    root.bind('<Escape>', clear_scrollable_cb)
+    root.bind('<Control-f>', ctrl_f)
+    root.bind('<F12>', toggle_tracing)
+
+    # hovering is resolved by hit-testing the token layout (a single binding per canvas, no per-token widgets)
+    storyCnv.bind('<Motion>', lambda e: hover_motion(e, storyCnv))
+    storyCnv.bind('<Leave>', hover_off)
+    storyCnv.bind('<MouseWheel>', lambda e: storyCnv.yview_scroll(-1 if e.delta > 0 else 1, 'units'))
+    storyCnv.bind('<Button-4>', lambda e: storyCnv.yview_scroll(-1, 'units'))    # (X11 reports the wheel as buttons 4 and 5)
+    storyCnv.bind('<Button-5>', lambda e: storyCnv.yview_scroll(1, 'units'))
+    qarCnv.bind('<Motion>', lambda e: hover_motion(e, qarCnv))
+    qarCnv.bind('<Leave>', hover_off)
+
 
 seg_scores_list = []
 
-main()
+# optional instrumentation (F12, or a COQA_TRACE=file environment variable which also appends every record to the file):
+# show_passage/show_qar/hover_on/search_for_term are timed by phase, and the last one is shown below the control panel
+tracer = Tracer(lambda: bool(render_queue), trace_counts, trace_context, path=os.environ.get('COQA_TRACE'),
+                enabled=bool(os.environ.get('COQA_TRACE')))
+tracer.on_record = show_trace
+show_passage = tracer.wrap('show_passage', show_passage)
+show_qar = tracer.wrap('show_qar', show_qar)
+hover_on = tracer.wrap('hover_on', hover_on, sync=True)    # (hovering during a render is recorded apart from it)
+search_for_term = tracer.wrap('search_for_term', search_for_term)
+hudtxt = ctrlCnv.create_text(5, 150, text='', font=("consolas", 7), anchor='nw', fill='gray20')    # instrumentation overlay
+
+if __name__ == '__main__':     # (coqa_bench.py loads the script without entering its mainloop)
+    main()
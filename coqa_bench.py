@@ -0,0 +1,284 @@
+# Author: Sal Barbosa
+# Benchmarks of the viewer's hot paths, emitted as JSON (so timings can be tracked across changes)
+# The data and layout layers (json/cache load, score load, ranking metrics, layout, render-ready models, hit-testing,
+# search) are timed without Tk, so they run on any headless box.  With --tk, the viewer script itself is loaded (its widgets are created,
+# its mainloop is not entered) and show_passage/show_qar (drawn to completion), hovering and Find are timed under every
+# combination of the Corefs/Deps/Rationale checkboxes and the POS/NE/DEP color schemes.  --tk needs a display; on a
+# headless Linux box run it under Xvfb:  xvfb-run python coqa_bench.py --tk
+#
+#    python coqa_bench.py [--dir DIR] [--passages N] [--repeat R] [--tk] [--out FILE]
+#
+# Every result holds the timing statistics (in milliseconds) of one benchmark (and of one toggle combination for the
+# Tk benchmarks), e.g. {"name": "layout.passage", "n": 30, "mean_ms": 0.41, "median_ms": 0.38, ...}.
+#
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import platform
+import runpy
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from coqa_cache import P_NQ, Corpus, build_cache, load_corpus
+from coqa_layout import FONT_H, passage_layout, qa_layout, clear_layout_cache, token_at
+from coqa_metrics import QuestionFacts, score_metrics
+from coqa_model import CategoryCodes, RationaleMap, PassageModel, QAModel
+from coqa_scores import load_scores, load_score_runs
+from coqa_search import FIELDS, SearchIndex, TextIndex
+
+BENCH_VERSION = 1
+JSON_FILE = 'coqa-news-preprocessed-final.json'
+SCORES_FILE = 'sentence-scores.txt'
+VIEWER_SCRIPT = 'coqa-news-viz.py'
+SEARCH_TERMS = ('the', 'lemma:say', 'ne:person', '"the police"', r're:\d+ years')   # a token, field, phrase and regex search
+SCHEMES = ('POS', 'NE', 'DEP')      # color schemes (the tag type token boxes are colored by)
+QUESTIONS_PER_PASSAGE = 3           # questions shown per passage by the show_qar benchmark
+
+
+# collects the timings of the benchmarks
+class Bench:
+
+    def __init__(self):
+        self.results = []
+
+    # records the statistics of a list of timings (in seconds); info (e.g. the toggles) is kept with them
+    def add(self, name, times, **info):
+        ms = np.array(times, dtype=np.float64) * 1000
+        res = {'name': name, 'n': len(ms)}
+        if len(ms):
+            res.update({'mean_ms': round(float(ms.mean()), 4), 'median_ms': round(float(np.median(ms)), 4),
+                        'min_ms': round(float(ms.min()), 4), 'max_ms': round(float(ms.max()), 4),
+                        'total_ms': round(float(ms.sum()), 4)})
+        res.update(info)
+        self.results.append(res)
+        print(name, info or '', res.get('median_ms'), 'ms', file=sys.stderr)
+
+    # times fn() repeat times
+    def time(self, name, fn, repeat=1, **info):
+        times = []
+        for _ in range(repeat):
+            t = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - t)
+        self.add(name, times, **info)
+
+
+# runs a Find term the way the viewer does (see search_for_term): phrases/regular expressions against the story text,
+# single tokens (optionally prefixed by their field) against the inverted index
+def find(index, text_index, term):
+    if term.startswith('re:'):
+        return text_index.find(term[3:], regex=True)
+    if (len(term) > 1 and term[0] == term[-1] == '"') or ' ' in term.strip():
+        return text_index.find(term.strip('"'))
+    field, sep, text = term.partition(':')
+    if not sep or field.lower() not in FIELDS:
+        field, text = 'tok', term
+    return index.find(text, field.lower())
+
+
+# benchmarks of the data and layout layers (no Tk) over the first passages (all if 0)
+def data_benchmarks(bench, passages, repeat):
+    def json_load():
+        with open(JSON_FILE, 'r', encoding='utf-8') as f:
+            json.load(f)
+    bench.time('load.json', json_load, repeat)
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = os.path.join(tmp, 'bench.cache')
+        bench.time('load.cache_build', lambda: build_cache(JSON_FILE, cache), repeat)
+        bench.time('load.cache_open', lambda: Corpus(cache).close(), repeat)
+
+    corpus = load_corpus(JSON_FILE)
+    cats = CategoryCodes(corpus)
+    bench.time('load.category_codes', lambda: CategoryCodes(corpus), repeat)
+    bench.time('load.rationales', lambda: RationaleMap(corpus), repeat)
+    bench.time('scores.parse', lambda: load_scores(SCORES_FILE, use_sidecar=False), repeat)
+    load_scores(SCORES_FILE)                            # (writes the sidecar if it is missing)
+    bench.time('scores.sidecar', lambda: load_scores(SCORES_FILE), repeat)
+    rationales = RationaleMap(corpus)
+    scores = load_scores(SCORES_FILE)
+    bench.time('metrics.facts', lambda: QuestionFacts(corpus, rationales), repeat)
+    facts = QuestionFacts(corpus, rationales)
+    bench.time('metrics.score', lambda: score_metrics(facts, scores), repeat)
+
+    dep_types = frozenset(t[len('DEP:'):] for t in cats.tags['DEP'])    # (every dependency type is linked)
+    passages = range(min(passages, len(corpus))) if passages else range(len(corpus))
+    layout, qlayout, model, qmodel, hits = [], [], [], [], []
+    ntoks = 0
+    for _ in range(repeat):
+        for p in passages:
+            corpus[p]                                   # (materialized outside the timings)
+            clear_layout_cache()
+            t = time.perf_counter()
+            geo = passage_layout(corpus, p)
+            layout.append(time.perf_counter() - t)
+            t = time.perf_counter()
+            PassageModel(corpus, p, dep_types, cats)
+            model.append(time.perf_counter() - t)
+            t = time.perf_counter()
+            for k in range(len(geo)):
+                token_at(geo, geo.x[k] + 3, geo.y[k] + FONT_H // 2)
+            hits.append(time.perf_counter() - t)
+            ntoks += len(geo)
+            for q in range(min(corpus.passage_row(p)[P_NQ], QUESTIONS_PER_PASSAGE)):
+                t = time.perf_counter()
+                qa_layout(corpus, p, q)
+                qlayout.append(time.perf_counter() - t)
+                t = time.perf_counter()
+                QAModel(corpus, p, q, dep_types, cats)
+                qmodel.append(time.perf_counter() - t)
+    bench.add('layout.passage', layout)
+    bench.add('layout.qa', qlayout)
+    bench.add('model.passage', model)
+    bench.add('model.qa', qmodel)
+    bench.add('hover.hit_test', hits, tokens=ntoks)     # (a hit-test of every token of the passage)
+
+    bench.time('search.index_build', lambda: SearchIndex.build(corpus), repeat)
+    bench.time('search.text_index_build', lambda: TextIndex(corpus), repeat)
+    index = SearchIndex.build(corpus)
+    text_index = TextIndex(corpus)
+    for term in SEARCH_TERMS:
+        bench.time('search.find', lambda: find(index, text_index, term), repeat, term=term)
+
+
+# draws whatever the viewer has queued (as its mainloop would, without the pauses between chunks)
+def drain(g):
+    queue = g['render_queue']
+    while queue:
+        for _ in queue[0][1]:
+            pass
+        queue.pop(0)
+    g['cancel_render']()
+    g['root'].update_idletasks()
+
+
+# sets the viewer's color scheme as checking the tags of a tag type does
+def set_scheme(g, scheme):
+    for k in g['tag_colors']:
+        g['tag_colors'][k]['sel'].set(g['tag_colors'][k]['ttype'] == scheme)
+    g['lbltg'] = scheme
+    g['build_color_lut']()
+
+
+# an event at a canvas point (for the hover callbacks)
+class _Event:
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+# benchmarks of the viewer itself (needs a display) over the first passages (all if 0)
+def tk_benchmarks(bench, passages, repeat):
+    with contextlib.redirect_stdout(sys.stderr):       # (the viewer prints its startup reports)
+        t = time.perf_counter()
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), VIEWER_SCRIPT)
+        g = runpy.run_path(script, run_name='coqa_viewer')['main'].__globals__    # (the live globals, not run_path's copy)
+        bench.add('tk.widgets', [time.perf_counter() - t])
+        g['PREFETCH_DEPTH'] = 0                         # (no background builds competing with the timings)
+        t = time.perf_counter()
+        g['loaded']['corpus'] = g['load_corpus_data']()
+        g['loaded']['scores'] = load_score_runs([SCORES_FILE])
+        g['poll_loading']()
+        drain(g)
+        bench.add('tk.first_passage', [time.perf_counter() - t])
+
+        coqa = g['coqa']
+        models = g['models']
+        passages = range(min(passages, len(coqa))) if passages else range(len(coqa))
+        for scheme in SCHEMES:
+            set_scheme(g, scheme)
+            for corefs, deps, rationale in itertools.product((False, True), repeat=3):
+                g['showCorefs'].set(corefs)
+                g['showDeps'].set(deps)
+                g['showRationale'].set(rationale)
+                psg, qar = [], []
+                for _ in range(repeat):
+                    for p in passages:
+                        models.clear()                  # (models are built, not prefetched)
+                        t = time.perf_counter()
+                        g['currpsg'] = p
+                        g['currqar'] = 0
+                        g['show_passage'](p, 0)
+                        drain(g)
+                        psg.append(time.perf_counter() - t)
+                        for q in range(1, min(coqa.passage_row(p)[P_NQ], QUESTIONS_PER_PASSAGE)):
+                            models.clear()
+                            t = time.perf_counter()
+                            g['currqar'] = q
+                            g['show_qar'](p, q)
+                            drain(g)
+                            qar.append(time.perf_counter() - t)
+                toggles = {'scheme': scheme, 'corefs': corefs, 'deps': deps, 'rationale': rationale}
+                bench.add('tk.show_passage', psg, **toggles)
+                bench.add('tk.show_qar', qar, **toggles)
+
+        hover = []
+        ntoks = 0
+        for p in passages:
+            g['show_passage'](p, 0)
+            drain(g)
+            geo = g['psg_model'].geo
+            cnv = g['storyCnv']
+            top = int(cnv.canvasy(0))
+            t = time.perf_counter()
+            for k in range(len(geo)):
+                g['hover_motion'](_Event(geo.x[k] + 3, geo.y[k] + FONT_H // 2 - top), cnv)
+                g['hover_off']()
+            hover.append(time.perf_counter() - t)
+            ntoks += len(geo)
+        bench.add('tk.hover', hover, tokens=ntoks)     # (hovering over, then off, every token of the passage)
+
+        for term in SEARCH_TERMS:
+            times = []
+            for _ in range(repeat):
+                g['show_passage'](0, 0)
+                drain(g)
+                t = time.perf_counter()
+                g['search_for_term'](term)
+                drain(g)
+                times.append(time.perf_counter() - t)
+                g['clear_scrollable_cb'](None)
+            bench.add('tk.search', times, term=term)
+
+
+# returns the git revision of the source tree (None outside a git checkout)
+def source_revision():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Times the CoQA News Viz hot paths and prints the results as JSON.')
+    ap.add_argument('--dir', default='.', help='directory of the json, scores and png files (default: .)')
+    ap.add_argument('--passages', type=int, default=0, help='number of passages timed (default: all)')
+    ap.add_argument('--repeat', type=int, default=1, help='times each benchmark is repeated (default: 1)')
+    ap.add_argument('--tk', action='store_true', help='also time the viewer itself (needs a display, e.g. xvfb-run)')
+    ap.add_argument('--out', help='file the JSON results are written to (default: stdout)')
+    args = ap.parse_args(argv)
+    out = os.path.abspath(args.out) if args.out else None
+    os.chdir(args.dir)
+
+    bench = Bench()
+    data_benchmarks(bench, args.passages, args.repeat)
+    if args.tk:
+        tk_benchmarks(bench, args.passages, args.repeat)
+    report = {'version': BENCH_VERSION, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'revision': source_revision(),
+              'python': platform.python_version(), 'platform': platform.platform(), 'numpy': np.__version__,
+              'passages': args.passages or None, 'repeat': args.repeat, 'tk': args.tk, 'results': bench.results}
+    if out:
+        with open(out, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+
+
+if __name__ == '__main__':
+    main()
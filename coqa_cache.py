@@ -0,0 +1,393 @@
+# Author: Sal Barbosa
+# Binary, memory-mapped cache of coqa-news-preprocessed-final.json
+# json.load of the preprocessed file builds every story's nested lists of strings before the window can appear.
+# The cache is written once (and rebuilt whenever the json file changes) and holds:
+#    a string table (every distinct token/tag/lemma/dependency string, stored once in a utf-8 blob)
+#    array-backed token columns (string ids) and dependency columns (type id, governor, dependent)
+#    a per-passage offset index into the sentence/question/answer segments (and the passage's story text)
+# The loader memory-maps the cache, and coqa[pnum] materializes a passage only when it is requested.
+# In compact mode (a corpus opened with the passage keys and token fields a reader uses), passages are materialized
+# with only those keys, as tuples of the shared strings; the unused json fields (seg_text, quoted, ...) and token fields
+# are never decoded.  Since the mapped pages are file-backed, instances viewing the same cache share them.
+#
+# The cache may also be built by hand:  python coqa_cache.py coqa-news-preprocessed-final.json
+#
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+try:
+    import resource                 # (not available on Windows, where the report omits the peak resident size)
+except ImportError:
+    resource = None
+from collections import OrderedDict
+
+CACHE_MAGIC = b'COQACCH1'
+CACHE_VERSION = 2
+CACHE_EXT = '.cache'
+HDR_PAD = 4096          # header is padded to a multiple of this, so it can be rewritten in place (see _write_header)
+NONE_ID = 0xFFFFFFFF    # string id that pads tokens holding fewer fields than the widest token
+MATERIALIZED_MAX = 8    # number of materialized passages kept alive by a corpus
+
+# indices to the rows of the passage offset index (psg section)
+P_SEG = 0               # first seg_tagged segment of the passage
+P_NSEG = 1              # number of sentences
+P_Q = 2                 # first q_tagged segment
+P_NQ = 3                # number of questions
+P_A = 4                 # first a_tagged segment
+P_NA = 5                # number of answers
+P_SDEP = 6              # first seg_dep segment
+P_NSDEP = 7             # number of seg_dep segments
+P_QDEP = 8              # first q_dep segment
+P_NQDEP = 9             # number of q_dep segments
+P_STORY = 10            # string id of the story text
+P_EXTRA = 11            # string id of the json encoded remaining fields (corefs, rationale, ...)
+P_COLS = 12
+
+# passage keys held in the token/dependency columns (the story has its own string, all others are kept in the P_EXTRA json)
+TAGGED_KEYS = (('seg_tagged', P_SEG), ('q_tagged', P_Q), ('a_tagged', P_A))
+DEP_KEYS = (('seg_dep', P_SDEP), ('q_dep', P_QDEP))
+
+
+# returns the cache file path used for a json file
+def cache_path_for(json_path):
+    return os.path.splitext(json_path)[0] + CACHE_EXT
+
+
+# returns the sha1 hex digest of a file (read in 1MB chunks)
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# returns the size/mtime/hash signature of the source json file that is stored in the cache header
+def source_signature(json_path, with_hash=True):
+    st = os.stat(json_path)
+    sig = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+    if with_hash:
+        sig['sha1'] = file_hash(json_path)
+    return sig
+
+
+# pads n up to a multiple of align
+def _align(n, align=8):
+    return (n + align - 1) // align * align
+
+
+# reads the header of a cache file (returns None if the file is missing or not a cache)
+def read_header(cache_path):
+    try:
+        with open(cache_path, 'rb') as f:
+            fixed = f.read(len(CACHE_MAGIC) + 8)
+            if len(fixed) < len(CACHE_MAGIC) + 8 or fixed[:len(CACHE_MAGIC)] != CACHE_MAGIC:
+                return None
+            hlen, hcap = struct.unpack('<II', fixed[len(CACHE_MAGIC):])
+            hdr = json.loads(f.read(hlen).decode('utf-8'))
+    except (OSError, ValueError):
+        return None
+    hdr['_hcap'] = hcap
+    return hdr
+
+
+# writes (in place) a new header over an existing cache, provided it fits the reserved header area
+def _write_header(cache_path, hdr):
+    hdr = {k: v for k, v in hdr.items() if not k.startswith('_')}
+    raw = json.dumps(hdr).encode('utf-8')
+    old = read_header(cache_path)
+    if old is None or len(raw) > old['_hcap']:
+        return False
+    with open(cache_path, 'r+b') as f:
+        f.seek(len(CACHE_MAGIC))
+        f.write(struct.pack('<II', len(raw), old['_hcap']))
+        f.write(raw + b' ' * (old['_hcap'] - len(raw)))
+    return True
+
+
+# checks whether the cache was built from the current json file
+# A changed size/mtime forces a hash comparison; a json file that was only touched keeps its cache (header refreshed).
+def cache_is_current(json_path, cache_path):
+    hdr = read_header(cache_path)
+    if hdr is None or hdr.get('cache_version') != CACHE_VERSION or hdr.get('byteorder') != sys.byteorder:
+        return False
+    sig = source_signature(json_path, with_hash=False)
+    src = hdr['source']
+    if src['size'] == sig['size'] and src['mtime_ns'] == sig['mtime_ns']:
+        return True
+    if src['size'] != sig['size'] or file_hash(json_path) != src['sha1']:
+        return False
+    src['mtime_ns'] = sig['mtime_ns']
+    _write_header(cache_path, hdr)
+    return True
+
+
+# one-time conversion of the preprocessed json file to the binary cache
+def build_cache(json_path, cache_path=None):
+    if cache_path is None:
+        cache_path = cache_path_for(json_path)
+    sig = source_signature(json_path)
+    with open(json_path, 'r', encoding='utf-8') as read_file:
+        coqa = json.load(read_file)
+
+    strids = {}                                     # string -> string id
+    strlst = []                                     # string id -> utf-8 bytes
+
+    def sid(s):
+        i = strids.get(s)
+        if i is None:
+            i = strids[s] = len(strlst)
+            strlst.append(s.encode('utf-8'))
+        return i
+
+    ncols = max((len(t) for d in coqa['data'] for k, _ in TAGGED_KEYS for sg in d[k] for t in sg), default=0)
+    toks = array('I')                               # ncols string ids per token
+    deps = array('i')                               # (type id, governor, dependent) per dependency
+    segs = array('I')                               # (first token, token count) per sentence/question/answer
+    dsegs = array('I')                              # (first dependency, dependency count) per segment of seg_dep/q_dep
+    psgs = array('I')                               # P_COLS offsets per passage
+    pad = [NONE_ID] * ncols
+
+    for d in coqa['data']:
+        row = [0] * P_COLS
+        for k, col in TAGGED_KEYS:
+            row[col] = len(segs) // 2
+            row[col + 1] = len(d[k])
+            for sg in d[k]:
+                segs.append(len(toks) // ncols)
+                segs.append(len(sg))
+                for t in sg:
+                    toks.extend([sid(s) for s in t])
+                    toks.extend(pad[len(t):])
+        for k, col in DEP_KEYS:
+            row[col] = len(dsegs) // 2
+            row[col + 1] = len(d[k])
+            for dl in d[k]:
+                dsegs.append(len(deps) // 3)
+                dsegs.append(len(dl))
+                for dep in dl:
+                    deps.extend((sid(dep[0]), dep[1], dep[2]))
+        row[P_STORY] = sid(d['story'])
+        extra = {k: v for k, v in d.items() if k not in dict(TAGGED_KEYS) and k not in dict(DEP_KEYS) and k != 'story'}
+        row[P_EXTRA] = sid(json.dumps(extra))
+        psgs.extend(row)
+
+    str_off = array('Q', [0])
+    for b in strlst:
+        str_off.append(str_off[-1] + len(b))
+    sections = [('str_off', str_off), ('str_blob', b''.join(strlst)), ('tok', toks), ('dep', deps),
+                ('seg', segs), ('dseg', dsegs), ('psg', psgs)]
+
+    hdr = {'cache_version': CACHE_VERSION, 'byteorder': sys.byteorder, 'source': sig,
+           'version': coqa.get('version'), 'ncols': ncols, 'npsg': len(coqa['data']), 'sections': {}}
+    pos = 0
+    for name, data in sections:
+        tc = data.typecode if isinstance(data, array) else 'B'
+        nbytes = len(data) * (data.itemsize if isinstance(data, array) else 1)
+        hdr['sections'][name] = [pos, tc, len(data)]
+        pos = _align(pos + nbytes)
+    raw = json.dumps(hdr).encode('utf-8')
+    hcap = _align(len(raw) + 256, HDR_PAD)
+    data_start = len(CACHE_MAGIC) + 8 + hcap
+
+    tmp = cache_path + '.tmp'
+    with open(tmp, 'wb') as f:                      # write to a temp file and swap, so a crash never leaves a bad cache
+        f.write(CACHE_MAGIC + struct.pack('<II', len(raw), hcap))
+        f.write(raw + b' ' * (hcap - len(raw)))
+        for name, data in sections:
+            f.seek(data_start + hdr['sections'][name][0])
+            f.write(data.tobytes() if isinstance(data, array) else data)
+    os.replace(tmp, cache_path)
+    return cache_path
+
+
+# returns the size in bytes of an object and of the dicts/lists/tuples/strings it holds (objects in seen are not counted)
+def _deep_size(obj, seen):
+    size = 0
+    todo = [obj]
+    while todo:
+        o = todo.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        if isinstance(o, dict):
+            todo.extend(o.keys())
+            todo.extend(o.values())
+        elif isinstance(o, (list, tuple)):
+            todo.extend(o)
+    return size
+
+
+# returns a byte count as KiB/MiB text
+def _mem_text(n):
+    return str(round(n / (1 << 20), 1)) + ' MiB' if n >= 1 << 20 else str(round(n / 1024, 1)) + ' KiB'
+
+
+# a read-only, list-like view of the preprocessed stories backed by a memory-mapped cache
+# corpus[pnum] materializes the passage as the same dictionary json.load would produce (the last few are kept), or, in
+# compact mode, a dictionary of only the keys given (token lists cut to their first tok_fields fields, as tuples)
+class Corpus:
+
+    def __init__(self, cache_path, keys=None, tok_fields=None):
+        hdr = read_header(cache_path)
+        if hdr is None:
+            raise ValueError(cache_path + ' is not a CoQA News Viz cache')
+        self.path = cache_path
+        self.version = hdr['version']
+        self.source = hdr['source']                 # size/mtime/hash of the json file the cache was built from
+        self.ncols = hdr['ncols']
+        self._file = open(cache_path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        data_start = len(CACHE_MAGIC) + 8 + hdr['_hcap']
+        buf = memoryview(self._mm)
+        self._sec = {}
+        for name, (off, tc, n) in hdr['sections'].items():
+            size = array(tc).itemsize
+            view = buf[data_start + off: data_start + off + n * size]
+            self._sec[name] = view.cast(tc) if tc != 'B' else view
+        self._strs = [None] * (len(self._sec['str_off']) - 1)    # decoded strings (shared by all materialized passages)
+        self._live = OrderedDict()                   # pnum -> materialized passage
+        self._lock = threading.Lock()                # guards _live (passages are also materialized by the prefetcher)
+        self._npsg = hdr['npsg']
+        self._keys = frozenset(keys) if keys is not None else None  # passage keys materialized (None: all of them)
+        self._nfields = min(tok_fields or self.ncols, self.ncols)   # token fields materialized
+
+    # returns the string for a string id (decoded once, then shared)
+    def string(self, i):
+        s = self._strs[i]
+        if s is None:
+            off = self._sec['str_off']
+            s = self._strs[i] = str(self._sec['str_blob'][off[i]:off[i + 1]], 'utf-8')
+        return s
+
+    # returns a string without keeping it (for the large, passage-specific strings: stories and json encoded fields)
+    def _decode(self, i):
+        off = self._sec['str_off']
+        return str(self._sec['str_blob'][off[i]:off[i + 1]], 'utf-8')
+
+    # returns the token tuples of segment segi (one list per token, or one tuple per token in compact mode)
+    def segment_tokens(self, segi):
+        seg = self._sec['seg']
+        tok = self._sec['tok']
+        nc = self.ncols
+        nf = self._nfields
+        start = seg[2 * segi] * nc
+        out = []
+        for t in range(start, start + seg[2 * segi + 1] * nc, nc):
+            t = [self.string(i) for i in tok[t:t + nf] if i != NONE_ID]
+            out.append(tuple(t) if self._keys is not None else t)
+        return out
+
+    # returns the dependency triples of dependency segment dsegi
+    def segment_deps(self, dsegi):
+        dseg = self._sec['dseg']
+        dep = self._sec['dep']
+        start = dseg[2 * dsegi] * 3
+        out = [[self.string(dep[k]), dep[k + 1], dep[k + 2]] for k in range(start, start + dseg[2 * dsegi + 1] * 3, 3)]
+        return [tuple(d) for d in out] if self._keys is not None else out
+
+    # returns a section of the cache ('tok', 'dep', 'seg', 'dseg', 'psg', ...) as a memoryview over the mapped file
+    def section(self, name):
+        return self._sec[name]
+
+    # returns the number of strings in the string table
+    def nstrings(self):
+        return len(self._strs)
+
+    # returns the row of the passage offset index for pnum
+    def passage_row(self, pnum):
+        return self._sec['psg'][pnum * P_COLS:(pnum + 1) * P_COLS]
+
+    # returns the story text of passage pnum (without materializing the passage)
+    def story(self, pnum):
+        return self._decode(self.passage_row(pnum)[P_STORY])
+
+    # returns the passage's other json fields (story_num, rationale, corefs, ...) without materializing the passage
+    def extra(self, pnum):
+        return json.loads(self._decode(self.passage_row(pnum)[P_EXTRA]))
+
+    # builds the passage dictionary for pnum
+    def _materialize(self, pnum):
+        keys = self._keys
+        row = self.passage_row(pnum)
+        d = self.extra(pnum)
+        if keys is not None:
+            d = {k: v for k, v in d.items() if k in keys}
+        if keys is None or 'story' in keys:
+            d['story'] = self.story(pnum)
+        for k, col in TAGGED_KEYS:
+            if keys is None or k in keys:
+                d[k] = [self.segment_tokens(s) for s in range(row[col], row[col] + row[col + 1])]
+        for k, col in DEP_KEYS:
+            if keys is None or k in keys:
+                d[k] = [self.segment_deps(s) for s in range(row[col], row[col] + row[col + 1])]
+        return d
+
+    # returns a report of the corpus' memory use: the mapped cache (file-backed pages, shared by every process mapping
+    # the same cache), the decoded strings and the materialized passages (Python objects), and the peak resident size
+    def memory_report(self):
+        seen = set()
+        with self._lock:
+            live = list(self._live.values())
+        strs = [s for s in self._strs if s is not None]
+        str_size = sum(_deep_size(s, seen) for s in strs)
+        psg_size = sum(_deep_size(d, seen) for d in live)
+        lines = ['corpus memory (' + ('compact' if self._keys is not None else 'full') + ' mode):',
+                 '  mapped cache: ' + _mem_text(len(self._mm)) + ' (shared)',
+                 '  decoded strings: ' + str(len(strs)) + ' of ' + str(len(self._strs)) + ', ' + _mem_text(str_size),
+                 '  materialized passages: ' + str(len(live)) + ', ' + _mem_text(psg_size) + ' (excluding the strings)']
+        if resource is not None:
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            lines.append('  peak resident size of the process: ' + _mem_text(rss if sys.platform == 'darwin' else rss * 1024))
+        return '\n'.join(lines)
+
+    def __len__(self):
+        return self._npsg
+
+    def __getitem__(self, pnum):
+        if pnum < 0:
+            pnum += self._npsg
+        if not 0 <= pnum < self._npsg:
+            raise IndexError('passage index out of range')
+        with self._lock:
+            d = self._live.get(pnum)
+            if d is not None:
+                self._live.move_to_end(pnum)
+                return d
+        d = self._materialize(pnum)                  # (outside the lock: the mapped sections are read-only)
+        with self._lock:
+            d = self._live.setdefault(pnum, d)
+            if len(self._live) > MATERIALIZED_MAX:
+                self._live.popitem(last=False)
+        return d
+
+    def __iter__(self):
+        for pnum in range(self._npsg):
+            yield self[pnum]
+
+    def close(self):
+        self._live.clear()
+        self._sec.clear()
+        self._mm.close()
+        self._file.close()
+
+
+# returns the corpus for a preprocessed json file, (re)building its cache when the json file has changed
+# (keys/tok_fields open it in compact mode: see Corpus)
+def load_corpus(json_path, cache_path=None, keys=None, tok_fields=None):
+    if cache_path is None:
+        cache_path = cache_path_for(json_path)
+    if not cache_is_current(json_path, cache_path):
+        build_cache(json_path, cache_path)
+    return Corpus(cache_path, keys, tok_fields)
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:] or ['coqa-news-preprocessed-final.json']:
+        print(build_cache(path))
@@ -0,0 +1,137 @@
+# Author: Sal Barbosa
+# Headless (Tk-free) layout of passages, questions and answers
+# Tokens are wrapped against the right margin (X_MAX for passages, Q_X_MAX for questions/answers) exactly as they are
+# drawn on storyCnv/qarCnv, and the resulting geometry (token x, y, line, sentence, token in sentence, s_map offset)
+# is kept in compact arrays.  Geometry is memoized in bounded LRU caches, so redraws (checkbox toggles, question
+# changes) only issue canvas calls, and layout can be exercised/timed without a display.  Since cached geometry is
+# shared by every model built from it, its arrays are made read-only (memoryviews) once laid out.
+# The geometry doubles as a spatial index (tokens of a line are sorted by x), which resolves the token under the mouse.
+#
+from array import array
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+
+# indices to the token tuples sored in the preprocess file:
+TOK = 0              # Token
+P_TAG = 1            # Part-of-speech tag
+L_TAG = 2            # Lemma tag
+N_TAG = 3            # Named-entity tag
+M_TAG = 4            # Mapping tag (string index to token index)
+
+# Constants for outputting passages/stories
+# Consolas 8 font is 6 pixels wide by 8 pixels high
+W_GAP = 2       # gap between words
+V_GAP = 30      # vertical gap between lines
+FONT_W = 6      # font's width
+FONT_H = 8      # font's height
+X_MIN = 20      # minimum x coordinate of text
+X_MAX = 1480    # maximum x coordinate of text
+Y_MIN = 40      # minimum y coordinate of text (1st line)
+
+# Constants for outputting questions and answers
+Q_X_MAX = 980   # maximum x coordinate for question
+Q_Y_MIN = 26    # minimum y coordinate for question
+A_Y_MIN = 125   # minimum y coordinate for answer
+
+LAYOUT_CACHE_SIZE = 64      # passages (and questions/answers) whose geometry is kept
+
+
+# geometry of a run of tokens (a passage, question or answer), one array entry per token
+# sent_first[i] is the first token of sentence i (sent_first[-1] is the token count)
+class Geometry:
+    __slots__ = ('x', 'y', 'tlen', 'line', 'sent', 's_tok', 's_map', 'sent_first', 'line_first', 'nlines', 'y_min')
+
+    def __init__(self, y_min=Y_MIN):
+        self.x = array('i')             # token's x coordinate
+        self.tlen = array('i')          # token's length in characters
+        self.y = array('i')             # token's y coordinate
+        self.line = array('i')          # (one-based) line the token is output on
+        self.sent = array('i')          # sentence the token came from
+        self.s_tok = array('i')         # token in the sentence
+        self.s_map = array('l')         # token's character offset in the story (-1 if it has none)
+        self.sent_first = array('i', [0])
+        self.line_first = array('i')    # line_first[l] is the first token of (zero-based) line l, line_first[-1] the token count
+        self.nlines = 0
+        self.y_min = y_min              # y coordinate of the first line
+
+    # makes the arrays read-only (once the tokens are laid out)
+    def freeze(self):
+        for k in ('x', 'tlen', 'y', 'line', 'sent', 's_tok', 's_map', 'sent_first', 'line_first'):
+            setattr(self, k, memoryview(getattr(self, k)).toreadonly())
+
+    def __len__(self):
+        return len(self.x)
+
+
+# converts a token's mapping tag to an integer character offset
+def _offset(t):
+    try:
+        return int(t[M_TAG])
+    except (IndexError, ValueError):
+        return -1
+
+
+# lays out the sentences of tagged tokens (a list of sentences, each a list of token tuples), wrapping at x_max
+def layout_tokens(sentences, x_max, y_min):
+    geo = Geometry(y_min)
+    x = X_MIN                                       # x is token's x coordinate
+    y = y_min                                       # y is token's y coordinate
+    line_num = 1
+    glen = W_GAP * FONT_W                           # glen is the gap that precedes the token (in pixels)
+    for i, sg in enumerate(sentences):
+        for j, t in enumerate(sg):
+            tlen = len(t[TOK])                      # tlen is token's length in characters
+            if x + (W_GAP + tlen) * FONT_W >= x_max:    # text exceeds x_max (right screen margin), so wrap
+                x = X_MIN
+                y += V_GAP
+                line_num += 1
+            elif x > X_MIN:                         # only precede token by gap if it is not the first token in the line
+                x += glen
+            geo.x.append(x)
+            geo.y.append(y)
+            geo.tlen.append(tlen)
+            geo.line.append(line_num)
+            geo.sent.append(i)
+            geo.s_tok.append(j)
+            geo.s_map.append(_offset(t))
+            x += (W_GAP + tlen) * FONT_W            # update the x pixel coordinate
+        geo.sent_first.append(len(geo.x))
+    geo.nlines = line_num if len(geo.x) else 0
+    geo.line_first = array('i', [bisect_left(geo.line, l) for l in range(1, geo.nlines + 2)])
+    geo.freeze()
+    return geo
+
+
+# returns the token whose (drawn) box contains canvas point x, y, or None
+# the line is found arithmetically from y, and the token by bisecting the x coordinates of that line
+def token_at(geo, x, y):
+    l = (y - geo.y_min) // V_GAP                    # zero-based line (lines are V_GAP pixels apart)
+    if l < 0 or l >= geo.nlines:
+        return None
+    first = geo.line_first[l]
+    last = geo.line_first[l + 1]
+    if first == last or not geo.y[first] <= y <= geo.y[first] + FONT_H + 5:
+        return None
+    k = bisect_right(geo.x, x + 2, first, last) - 1 # last token of the line whose box (which begins at x-2) starts left of x
+    if k >= first and x <= geo.x[k] + geo.tlen[k] * FONT_W + 2:
+        return k
+    return None
+
+
+# returns the (memoized) geometry of passage pnum of a corpus, as output on storyCnv
+@lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def passage_layout(corpus, pnum):
+    return layout_tokens(corpus[pnum]['seg_tagged'], X_MAX, Y_MIN)
+
+
+# returns the (memoized) geometry of question and answer qnum of passage pnum, as output on qarCnv
+@lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def qa_layout(corpus, pnum, qnum):
+    d = corpus[pnum]
+    return layout_tokens([d['q_tagged'][qnum]], Q_X_MAX, Q_Y_MIN), layout_tokens([d['a_tagged'][qnum]], Q_X_MAX, A_Y_MIN)
+
+
+# forgets all memoized geometry (e.g. after the corpus is reloaded)
+def clear_layout_cache():
+    passage_layout.cache_clear()
+    qa_layout.cache_clear()
@@ -0,0 +1,158 @@
+# Author: Sal Barbosa
+# Corpus-wide metrics of the external sentence ranking (sentence-scores.txt) against the questions' rationales
+# A question is answered by the sentence(s) its rationale spans: the rationale's first/last tokens (see RationaleMap)
+# are mapped to sentences by bisecting the sentences' first tokens (the s_map offsets of the cache's token rows), and the
+# best rank the scores give any of those sentences is the question's rank.  The per-question facts (rationale sentences,
+# question position, answer named entity type) are computed once from the cache; the ranks of every question are then
+# looked up in the score store and reduced (MRR, top-1/top-3 hit rates, rank histogram, per question position and per
+# answer NE type) with a few array operations, so a scores file can be evaluated in milliseconds.
+#
+import numpy as np
+from coqa_cache import P_SEG, P_NSEG, P_A, P_NA, P_COLS, NONE_ID
+from coqa_layout import N_TAG
+from coqa_util import expand_ranges
+
+TOP_K = (1, 3)          # hit rates reported: the rationale sentence ranks within the top k
+HIST_MAX = 10           # ranks above this share the last histogram bucket
+POS_MAX = 10            # questions past this position share the last question position bucket
+NO_NE = 'none'          # answer NE type of answers without a named entity
+
+
+# what the metrics know of every question of the corpus, independent of the scores
+# question i is question qnum[i] of passage pnum[i]; its rationale spans sentences s_first[i]..s_last[i] (-1 if the
+# rationale was not resolved) and its answer's named entity type is ne_types[ne[i]]
+class QuestionFacts:
+
+    def __init__(self, corpus, rationales):
+        seg = np.frombuffer(corpus.section('seg'), dtype=np.uint32).reshape(-1, 2).astype(np.int64)
+        psg = np.frombuffer(corpus.section('psg'), dtype=np.uint32).reshape(-1, P_COLS).astype(np.int64)
+        q_base = np.asarray(rationales.q_base, dtype=np.int64)
+        nq = np.diff(q_base)
+        self.pnum = np.repeat(np.arange(len(nq)), nq)
+        self.qnum = np.arange(q_base[-1]) - q_base[self.pnum]
+
+        # first token of every sentence, numbered like the rationale tokens (passage tokens contiguous across passages)
+        nseg = psg[:, P_NSEG]
+        segi, sp = expand_ranges(psg[:, P_SEG], nseg)
+        psg_first = np.asarray(rationales.psg_first, dtype=np.int64)
+        s_start = psg_first[sp] + seg[segi, 0] - seg[psg[sp, P_SEG], 0]
+        s_base = np.concatenate(([0], np.cumsum(nseg)))
+        ok = rationales.first >= 0
+        base = psg_first[self.pnum]
+        s_first = np.searchsorted(s_start, base + rationales.first, side='right') - 1 - s_base[self.pnum]
+        s_last = np.searchsorted(s_start, base + rationales.last, side='right') - 1 - s_base[self.pnum]
+        self.s_first = np.where(ok, s_first, -1).astype(np.int32)
+        self.s_last = np.where(ok, np.maximum(s_last, s_first), -1).astype(np.int32)
+
+        # named entity type of every answer: the type of its first token carrying one
+        self.ne_types = [NO_NE]
+        self.ne = np.zeros(len(self.pnum), dtype=np.int32)
+        if corpus.ncols > N_TAG:
+            tok = np.frombuffer(corpus.section('tok'), dtype=np.uint32).reshape(-1, corpus.ncols)
+            has = self.qnum < psg[self.pnum, P_NA]
+            ai = np.flatnonzero(has)
+            aseg = psg[self.pnum[ai], P_A] + self.qnum[ai]
+            rows, owner = expand_ranges(seg[aseg, 0], seg[aseg, 1])
+            ids = tok[rows, N_TAG]
+            uids, inv = np.unique(ids, return_inverse=True)
+            codes = np.zeros(len(uids), dtype=np.int32)
+            for k, i in enumerate(uids):
+                if i == NONE_ID:
+                    continue
+                ne = corpus.string(int(i)).split(' ', 1)[0]
+                if ne in ('', '-', '<', 'O'):
+                    continue
+                if ne not in self.ne_types:
+                    self.ne_types.append(ne)
+                codes[k] = self.ne_types.index(ne)
+            tcode = codes[inv.reshape(-1)]
+            named = np.flatnonzero(tcode > 0)
+            ans, first = np.unique(owner[named], return_index=True)    # (tokens are in answer order)
+            self.ne[ai[ans]] = tcode[named[first]]
+
+    def __len__(self):
+        return len(self.pnum)
+
+
+# returns the rank of every question's rationale under a score store: the best rank of its rationale sentences
+# (0 where the question has no resolved rationale or none of its sentences is scored)
+def rationale_ranks(facts, scores):
+    ok = np.flatnonzero(facts.s_first >= 0)
+    counts = (facts.s_last[ok] - facts.s_first[ok] + 1).astype(np.int64)
+    sents, owner = expand_ranges(facts.s_first[ok], counts)
+    q = ok[owner]
+    r = scores.lookup_ranks(facts.pnum[q], facts.qnum[q], sents).astype(np.int64)
+    r[r == 0] = np.iinfo(np.int64).max                     # (unscored sentences never give the best rank)
+    best = np.full(len(facts), np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(best, q, r)
+    best[best == np.iinfo(np.int64).max] = 0
+    return best.astype(np.int32)
+
+
+# returns the metrics of the ranks of a group of questions (group numbers in groups, ranks > 0 only)
+def _group_metrics(ranks, groups, ngroups):
+    n = np.bincount(groups, minlength=ngroups)
+    rr = np.bincount(groups, weights=1.0 / ranks, minlength=ngroups)
+    res = {'n': n, 'mrr': rr / np.maximum(n, 1)}
+    for k in TOP_K:
+        res['top' + str(k)] = np.bincount(groups, weights=ranks <= k, minlength=ngroups) / np.maximum(n, 1)
+    return res
+
+
+# returns the corpus-wide metrics of a score store: overall, per question position and per answer NE type
+def score_metrics(facts, scores):
+    ranks = rationale_ranks(facts, scores)
+    ok = ranks > 0
+    r = ranks[ok]
+    pos = np.minimum(facts.qnum[ok], POS_MAX - 1)
+    ne = facts.ne[ok]
+    overall = _group_metrics(r, np.zeros(len(r), dtype=np.int64), 1)
+    return {'questions': len(facts), 'ranked': int(ok.sum()),
+            'unresolved': int((facts.s_first < 0).sum()),
+            'overall': {k: v[0] for k, v in overall.items()},
+            'mean_rank': float(r.mean()) if len(r) else 0.0,
+            'median_rank': float(np.median(r)) if len(r) else 0.0,
+            'hist': np.bincount(np.minimum(r, HIST_MAX + 1), minlength=HIST_MAX + 2)[1:],
+            'by_position': _group_metrics(r, pos, POS_MAX),
+            'by_ne': _group_metrics(r, ne, len(facts.ne_types)),
+            'ne_types': facts.ne_types}
+
+
+# returns the metrics as the text of the metrics panel
+def metrics_text(m):
+    def row(label, n, mrr, hits):
+        return '%-18s %6d  %6.3f  ' % (label, n, mrr) + '  '.join('%6.1f%%' % (100 * h) for h in hits)
+    head = '%-18s %6s  %6s  ' % ('', 'n', 'MRR') + '  '.join('%7s' % ('top-' + str(k)) for k in TOP_K)
+    o = m['overall']
+    lines = ['Questions ' + str(m['questions']) + ', ranked ' + str(m['ranked'])
+             + ' (unresolved rationale ' + str(m['unresolved']) + ', unscored '
+             + str(m['questions'] - m['ranked'] - m['unresolved']) + ')',
+             'Mean rank %.2f, median rank %.1f' % (m['mean_rank'], m['median_rank']), '', head,
+             row('All questions', o['n'], o['mrr'], [o['top' + str(k)] for k in TOP_K]), '', 'By question position']
+    g = m['by_position']
+    for i in range(POS_MAX):
+        if g['n'][i]:
+            label = 'Q' + str(i + 1) + ('+' if i == POS_MAX - 1 else '')
+            lines.append(row(label, g['n'][i], g['mrr'][i], [g['top' + str(k)][i] for k in TOP_K]))
+    lines += ['', 'By answer NE type']
+    g = m['by_ne']
+    for i in np.argsort(-g['n'], kind='stable'):
+        if g['n'][i]:
+            lines.append(row(m['ne_types'][i], g['n'][i], g['mrr'][i], [g['top' + str(k)][i] for k in TOP_K]))
+    lines += ['', 'Rank of the rationale sentence']
+    hist = m['hist']
+    top = max(int(hist.max()), 1) if len(hist) else 1
+    for i, c in enumerate(hist):
+        label = str(i + 1) if i < HIST_MAX else '>' + str(HIST_MAX)
+        lines.append('%4s %6d %s' % (label, c, '#' * int(round(40 * c / top))))
+    return '\n'.join(lines)
+
+
+# returns the overall metrics of every run of a ScoreRuns side by side (a row per run)
+def runs_text(facts, runs):
+    lines = ['Runs compared', '%-18s %6s  %6s  ' % ('', 'n', 'MRR') + '  '.join('%7s' % ('top-' + str(k)) for k in TOP_K)]
+    for k in range(len(runs)):
+        o = score_metrics(facts, runs.run(k))['overall']
+        lines.append('%-18s %6d  %6.3f  ' % ('run ' + str(k + 1), o['n'], o['mrr'])
+                     + '  '.join('%6.1f%%' % (100 * o['top' + str(t)]) for t in TOP_K))
+    return '\n'.join(lines)
@@ -0,0 +1,295 @@
+# Author: Sal Barbosa
+# Load-time models of the corpus used by the viewer (computed once, then looked up while rendering)
+# Rationales: every question's rationale (a character span of the story) is trimmed of leading/trailing punctuation and
+# whitespace and resolved to its first and last passage token, by bisecting the passages' sorted token (s_map) offsets.
+# Spans that cannot be resolved are collected in a single validation report instead of failing when they are shown.
+# Render-ready models: everything the viewer derives from a passage (or question/answer) before drawing it (token
+# tables, integer-coded coloring categories of the '<' expanded tags, dependency links, root tokens, geometry, hover
+# texts) is normalized once by PassageModel/QAModel, off the Tk thread, into read-only models (tuples, read-only
+# memoryviews and mapping proxies), so the viewer only indexes into them and issues canvas calls (see coqa_prefetch).
+#
+from array import array
+from sys import intern
+from types import MappingProxyType
+import numpy as np
+from coqa_cache import P_SEG, P_NSEG, P_COLS, NONE_ID
+from coqa_layout import TOK, P_TAG, L_TAG, N_TAG, M_TAG, passage_layout, qa_layout
+from coqa_util import expand_ranges
+
+RATIONALE_STRIP = ' \t\n,.:'        # characters trimmed from both ends of a rationale span
+CAT_KINDS = ('POS', 'NE', 'DEP')    # kinds of categories tokens are colored by (the Color Schemes of the control panel)
+
+
+# returns the character offset (s_map) of every passage token of the corpus (-1 where a token has none), and the
+# first (global) token of each passage (psg_first[-1] is the token count), read straight from the cache's token columns
+def passage_token_offsets(corpus):
+    tok = np.frombuffer(corpus.section('tok'), dtype=np.uint32).reshape(-1, corpus.ncols)
+    seg = np.frombuffer(corpus.section('seg'), dtype=np.uint32).reshape(-1, 2).astype(np.int64)
+    psg = np.frombuffer(corpus.section('psg'), dtype=np.uint32).reshape(-1, P_COLS).astype(np.int64)
+    nseg = psg[:, P_NSEG]
+    lastseg = psg[:, P_SEG] + np.maximum(nseg, 1) - 1
+    first = seg[psg[:, P_SEG], 0]                                       # passage tokens are contiguous rows
+    counts = np.where(nseg > 0, seg[lastseg, 0] + seg[lastseg, 1] - first, 0)
+    ids = tok[expand_ranges(first, counts)[0], M_TAG].astype(np.int64)
+    uids = np.unique(ids)
+    offs = []
+    for i in uids:
+        try:
+            offs.append(int(corpus.string(int(i))) if i != NONE_ID else -1)     # (NONE_ID: a token without the field)
+        except ValueError:
+            offs.append(-1)
+    off = np.array(offs, dtype=np.int64)[np.searchsorted(uids, ids)]
+    return off, np.concatenate(([0], np.cumsum(counts)))
+
+
+# trims leading/trailing punctuation and whitespace from a rationale span of the story (returns the new start, end)
+def trim_rationale(story, r_start, r_end):
+    span = story[r_start:r_end]
+    r_start += len(span) - len(span.lstrip(RATIONALE_STRIP))
+    r_end -= len(span) - len(span.rstrip(RATIONALE_STRIP))
+    return r_start, max(r_end, r_start)
+
+
+# the first and last passage token of every question's rationale
+class RationaleMap:
+
+    def __init__(self, corpus):
+        off, psg_first = passage_token_offsets(corpus)
+        self.psg_first = psg_first
+        pnums, starts, ends = [], [], []
+        self.q_base = [0]                                   # rationale of question q of passage p is entry q_base[p]+q
+        self.report = []                                    # (passage, question, start, end, reason) of unresolved spans
+        for p in range(len(corpus)):
+            story = corpus.story(p)
+            rats = corpus.extra(p).get('rationale', [])
+            for q, r in enumerate(rats):
+                r_start, r_end = trim_rationale(story, r[0], r[1])
+                pnums.append(p)
+                starts.append(r_start)
+                ends.append(r_end)
+            self.q_base.append(len(pnums))
+        pnums = np.array(pnums, dtype=np.int64)
+        starts = np.array(starts, dtype=np.int64)
+        ends = np.array(ends, dtype=np.int64)
+
+        # tokens with an offset sorted by (passage, offset), so one searchsorted resolves every rationale of the corpus
+        # (tokens without one are skipped; the -1 key in front stands for 'before every token')
+        mapped = np.flatnonzero(off >= 0)
+        keys = (np.repeat(np.arange(len(psg_first) - 1), np.diff(psg_first))[mapped] << 32) | off[mapped]
+        keys, mapped = np.concatenate(([-1], keys)), np.concatenate(([-1], mapped))
+        f_tok = mapped[np.searchsorted(keys, (pnums << 32) | starts, side='right') - 1]    # token containing the span start
+        l_tok = mapped[np.searchsorted(keys, (pnums << 32) | ends, side='left') - 1]       # last token beginning before the end
+        base = psg_first[pnums]
+        ntoks = psg_first[pnums + 1] - base
+        l_tok = np.maximum(l_tok, f_tok)
+        self.first = (f_tok - base).astype(np.int32)
+        self.last = (l_tok - base).astype(np.int32)
+
+        bad = (ends <= starts) | (self.first < 0) | (self.first >= ntoks)
+        for k in np.flatnonzero(bad):
+            p = int(pnums[k])
+            if ends[k] <= starts[k]:
+                reason = 'empty span'
+            elif ntoks[k] == 0:
+                reason = 'passage has no tokens'
+            else:
+                reason = 'starts before the first token'
+            self.report.append((p, int(k) - self.q_base[p], int(starts[k]), int(ends[k]), reason))
+        self.first[bad] = -1
+        self.last[bad] = -1
+
+    # returns (first token, last token) of the rationale of a passage/question, or None if it is unresolved
+    def span(self, pnum, qnum):
+        k = self.q_base[pnum] + qnum
+        if k >= self.q_base[pnum + 1] or self.first[k] < 0:
+            return None
+        return int(self.first[k]), int(self.last[k])
+
+    # returns the validation report of the unresolved spans ('' if every span was resolved)
+    def report_text(self):
+        if not self.report:
+            return ''
+        lines = [str(len(self.report)) + ' of ' + str(len(self.first)) + ' rationale spans could not be resolved to tokens:']
+        for p, q, s, e, reason in self.report:
+            lines.append('  passage ' + str(p+1) + ' question ' + str(q+1) + ' [' + str(s) + ':' + str(e) + ']: ' + reason)
+        return '\n'.join(lines)
+
+
+# integer codes of the categories tokens are colored by ('POS:NN', 'NE:CITY', 'DEP:NSUBJ', ...), collected once from the
+# cache's POS/NE tag columns and dependency types; tags[kind][code] is a category tag, codes[kind][tag] its code
+class CategoryCodes:
+
+    def __init__(self, corpus):
+        tok = np.frombuffer(corpus.section('tok'), dtype=np.uint32).reshape(-1, corpus.ncols)
+        dep = np.frombuffer(corpus.section('dep'), dtype=np.int32).reshape(-1, 3)
+        ids = {'POS': tok[:, P_TAG], 'NE': tok[:, N_TAG], 'DEP': dep[:, 0]}
+        self.tags = {}
+        self.codes = {}
+        for kind in CAT_KINDS:
+            names = {self.tag(kind, corpus.string(int(i))) for i in np.unique(ids[kind]) if i != NONE_ID}
+            names.add(self.tag(kind, ''))
+            self.tags[kind] = tuple(sorted(names))
+            self.codes[kind] = MappingProxyType({t: c for c, t in enumerate(self.tags[kind])})
+
+    # returns the category tag of a (POS, NE or DEP) tag, e.g. ('NE', 'CITY New_York') -> 'NE:CITY'
+    @staticmethod
+    def tag(kind, s):
+        if kind == 'DEP':
+            return 'DEP:'+s.upper()
+        return kind+':'+(s.split()[0] if s.strip() else '')     # the split[0] is for NE tags
+
+
+# returns {dependent token: (DEPENDENCY TYPE, governor token)} and the root token of a sentence's (1-based) dependencies
+def _dep_links(deps):
+    depd = {}
+    rootdep = -1
+    for dep in deps:
+        if dep[0] != 'ROOT':
+            depd[dep[2]-1] = (dep[0].upper(), dep[1]-1)       # ensure 0-based token indices are stored
+        else:
+            rootdep = dep[2]-1
+    return depd, rootdep
+
+
+# compact table of the tokens of a run (a passage, question or answer): one column per token field, indexed by token
+# number (toks.tok[k], toks.x[k], ...) in place of a dictionary per token.  The geometry columns (x, y, line, sent, s_tok,
+# s_map, sent_first) are the run's (read-only) Geometry arrays (shared, not copied); the string columns are tuples of
+# interned strings, so equal tags are a single object across all tokens/models; dep_ref is -1 where deptype is ''.
+# Once frozen, every column is read-only (tuples and memoryviews).
+# Token j of sentence i is token sent_first[i]+j.
+class TokenTable:
+    __slots__ = ('tok', 'pos', 'ne', 'lemma', 'deptype', 'dep_ref', 'x', 'y', 'line', 'sent', 's_tok', 's_map',
+                 'sent_first')
+
+    def __init__(self, geo):
+        self.tok = []                   # token (string columns are lists while the table is filled, then tuples)
+        self.pos = []                   # POS tag, as in the corpus ('<' if collapsed)
+        self.ne = []                    # NE tag, as in the corpus ('<' if collapsed, '-' if none)
+        self.lemma = []                 # lemma ('~' if it is the token)
+        self.deptype = []               # type of the token's dependency link of dep_types ('' if none)
+        self.dep_ref = array('i')       # governor token of that link (-1 if none)
+        self.x = geo.x
+        self.y = geo.y
+        self.line = geo.line
+        self.sent = geo.sent
+        self.s_tok = geo.s_tok
+        self.s_map = geo.s_map
+        self.sent_first = geo.sent_first
+
+    # makes the columns read-only, dep_ref included (once every token is appended)
+    def freeze(self):
+        self.tok = tuple(self.tok)
+        self.pos = tuple(self.pos)
+        self.ne = tuple(self.ne)
+        self.lemma = tuple(self.lemma)
+        self.deptype = tuple(self.deptype)
+        self.dep_ref = memoryview(self.dep_ref).toreadonly()
+
+    def __len__(self):
+        return len(self.tok)
+
+
+# appends a run of tokens to a token table, and returns the codes of their coloring categories (collapsed '<' tags
+# expanded), their canvas tags, and their dependency links of dep_types (as (type, from, to) links); token numbers are
+# offset by first (dependencies are within the run), and tokens are named prefix+token number in their canvas tags
+def _token_run(toks, sg, first, depd, dep_types, cats, prefix):
+    tags, deps = [], []
+    codes = {kind: array('i') for kind in CAT_KINDS}
+    pos = ne = ''
+    for j, t in enumerate(sg):
+        k = first + j
+        if t[P_TAG] != '<': pos = t[P_TAG]          # expand previously collapsed token tags (<) for coloring
+        if t[N_TAG] != '<': ne = t[N_TAG]
+        toks.tok.append(intern(t[TOK]))
+        toks.pos.append(intern(t[P_TAG]))
+        toks.ne.append(intern(t[N_TAG]))
+        toks.lemma.append(intern(t[L_TAG]))
+        deptype = ''
+        if j in depd and depd[j][0] in dep_types:
+            deptype = intern(depd[j][0])
+            toks.dep_ref.append(first + depd[j][1])
+            deps.append((deptype, k, first + depd[j][1]))
+        else:
+            toks.dep_ref.append(-1)
+        toks.deptype.append(deptype)
+        cat = (cats.tag('POS', pos), cats.tag('NE', ne), cats.tag('DEP', deptype))
+        for kind, tag in zip(CAT_KINDS, cat):
+            codes[kind].append(cats.codes[kind].get(tag, -1))
+        tags.append(('tokbox', prefix+str(k)) + cat)
+    return codes, tuple(tags), tuple(deps)
+
+
+# returns category codes built by _token_run as a read-only mapping of read-only columns
+def _frozen_codes(codes):
+    return MappingProxyType({kind: memoryview(codes[kind]).toreadonly() for kind in CAT_KINDS})
+
+
+# returns the hover text of every token of a token table, as (text, width in characters, height in lines)
+# (a token whose NE tag is collapsed ('<') shows the named entity it continues)
+def hover_texts(toks):
+    out = []
+    ne = ''
+    for k in range(len(toks)):
+        if toks.ne[k] != '<': ne = toks.ne[k]
+        txtlst = ["POS: "+toks.pos[k]]
+        if toks.lemma[k] != '~': txtlst.append("lemma: "+toks.lemma[k])
+        if toks.ne[k] != '-': txtlst.append("NE: "+ne)
+        if toks.deptype[k] != '':
+            txtlst.append("DEP: "+toks.deptype[k]+"("+toks.tok[toks.dep_ref[k]]+")")
+        txtlst.append("S"+str(toks.sent[k]+1)+"/W"+str(toks.s_tok[k]+1)+"/X"+str(toks.x[k])+"/Y"+str(toks.y[k])+"/L"+str(toks.line[k]))
+        out.append(('\n'.join(txtlst), max(len(t) for t in txtlst), len(txtlst)))
+    return out
+
+
+# render-ready passage, as drawn on storyCnv (built once, then only read)
+class PassageModel:
+    __slots__ = ('pnum', 'geo', 'toks', 'codes', 'tags', 'deps', 'roots', 'hover')
+
+    def __init__(self, corpus, pnum, dep_types, cats):
+        d = corpus[pnum]
+        self.pnum = pnum
+        self.geo = geo = passage_layout(corpus, pnum)
+        self.toks = toks = TokenTable(geo)          # passage tokens (token j of sentence i is toks.sent_first[i]+j)
+        tags = []                                   # canvas tags of each token's box
+        deps = []                                   # (dependency type, from token, to token) links of dep_types
+        self.codes = {kind: array('i') for kind in CAT_KINDS}   # kind -> category code of each token (-1: not coded)
+        roots = set()                               # root token of each sentence
+        for i, sg in enumerate(d['seg_tagged']):
+            first = geo.sent_first[i]
+            depd, rootdep = _dep_links(d['seg_dep'][i])
+            codes, g, l = _token_run(toks, sg, first, depd, dep_types, cats, 'p')
+            tags += g
+            deps += l
+            for kind in CAT_KINDS:
+                self.codes[kind] += codes[kind]
+            if 0 <= rootdep < len(sg):
+                roots.add(first + rootdep)
+        toks.freeze()
+        self.codes = _frozen_codes(self.codes)
+        self.tags = tuple(tags)
+        self.deps = tuple(deps)
+        self.roots = frozenset(roots)
+        self.hover = tuple(hover_texts(toks))       # hover (text, width, height) of each token
+
+
+# render-ready question and answer, as drawn on qarCnv (answers have no dependency links)
+class QAModel:
+    __slots__ = ('pnum', 'qnum', 'qgeo', 'ageo', 'qtoks', 'qcodes', 'qtags', 'deps', 'root', 'atoks', 'acodes',
+                 'atags', 'qhover', 'ahover')
+
+    def __init__(self, corpus, pnum, qnum, dep_types, cats):
+        d = corpus[pnum]
+        self.pnum = pnum
+        self.qnum = qnum
+        self.qgeo, self.ageo = qa_layout(corpus, pnum, qnum)
+        depd, self.root = _dep_links(d['q_dep'][qnum])
+        self.qtoks = TokenTable(self.qgeo)
+        self.qcodes, self.qtags, self.deps = _token_run(self.qtoks, d['q_tagged'][qnum], 0, depd, dep_types, cats, 'q')
+        self.atoks = TokenTable(self.ageo)
+        self.acodes, self.atags, _ = _token_run(self.atoks, d['a_tagged'][qnum], 0, {}, (), cats, 'a')
+        self.qtoks.freeze()
+        self.atoks.freeze()
+        self.qcodes = _frozen_codes(self.qcodes)
+        self.acodes = _frozen_codes(self.acodes)
+        self.qhover = tuple(hover_texts(self.qtoks))
+        self.ahover = tuple(hover_texts(self.atoks))
@@ -0,0 +1,77 @@
+# Author: Sal Barbosa
+# Background preparation of render-ready models (see coqa_model) for the passages/questions next to the displayed one
+# A single worker thread builds the models that were last scheduled (nearest first) into a bounded LRU cache, while
+# the Tk thread only asks for the model it is about to draw: a prefetched model is returned at once, any other is
+# built on the spot.  The worker never touches Tk; models are only read once they are built.
+#
+import threading
+from collections import OrderedDict
+
+PREFETCH_CACHE_SIZE = 32    # prepared models kept (the displayed ones and their scheduled neighbors)
+
+
+class Prefetcher:
+
+    def __init__(self, build, size=PREFETCH_CACHE_SIZE):
+        self._build = build                     # key -> model (run on the worker thread, or on the caller's on a miss)
+        self._size = size
+        self._ready = OrderedDict()             # key -> built model, least recently used first
+        self._pending = []                      # keys still to build, in build order
+        self._busy = None                       # key being built by the worker
+        self._gen = 0                           # incremented by clear (a model built before it is dropped)
+        self._cv = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='prefetch', daemon=True)
+        self._thread.start()
+
+    def _store(self, key, model):
+        self._ready[key] = model
+        self._ready.move_to_end(key)
+        while len(self._ready) > self._size:
+            self._ready.popitem(last=False)
+
+    # returns the model of a key, waiting for the worker if it is building it, or building it now if not prefetched
+    def get(self, key):
+        with self._cv:
+            while self._busy == key:
+                self._cv.wait()
+            model = self._ready.get(key)
+            if model is not None:
+                self._ready.move_to_end(key)
+                return model
+        model = self._build(key)
+        with self._cv:
+            self._store(key, model)
+        return model
+
+    # replaces the keys to prefetch (earlier keys are built first; keys already built are skipped)
+    def schedule(self, keys):
+        with self._cv:
+            self._pending = [k for k in keys if k not in self._ready]
+            self._cv.notify_all()
+
+    # forgets every prepared model (e.g. after the data the models are built from changes)
+    def clear(self):
+        with self._cv:
+            self._pending = []
+            self._ready.clear()
+            self._gen += 1
+
+    def _run(self):
+        while True:
+            with self._cv:
+                while not self._pending:
+                    self._cv.wait()
+                key = self._pending.pop(0)
+                if key in self._ready:
+                    continue
+                self._busy = key
+                gen = self._gen
+            try:
+                model = self._build(key)
+            except Exception:
+                model = None                    # a failing build is left to the Tk thread (which reports it)
+            with self._cv:
+                if model is not None and gen == self._gen:
+                    self._store(key, model)
+                self._busy = None
+                self._cv.notify_all()
@@ -0,0 +1,460 @@
+# Author: Sal Barbosa
+# Columnar store of the (externally generated) sentence scores in sentence-scores.txt
+# The file has 2 columns: col1:passage#.question#.sentence#    col2: the score for that p#.q#.s#  (all indices zero-based)
+# Scores are parsed in bulk into flat NumPy arrays (passage, question, sentence, score), grouped by (passage, question)
+# with a CSR-style offset table, so the scores of one question are a zero-copy slice of the arrays.
+# The parsed arrays (and their rank table) are saved to a .npz sidecar that is reloaded (in milliseconds) while the text
+# file is unchanged.
+# Since scores are static, every question's sentences are ranked once at load time (a single segmented sort) and the
+# ranks are kept in a rank table: per-row ranks for corpus-wide queries, and rank-ordered columns for display.
+# Several scores files (model runs) can be loaded side by side (see ScoreRuns): the first one's rows are the index they
+# share, and every other run is aligned to those rows on its passage.question.sentence keys, so it only adds a score
+# column and a rank column.
+# Scores files may grow while they are shown (a scorer writing its rows during a long run): ScoreFile remembers how far
+# a file was read, so only the rows appended since are parsed and merged into the store (a later row of a key replaces
+# the earlier one), and ScoreStream reads rows from a pipe or stdin as they are written.
+#
+import os
+import stat
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from coqa_util import NPZ_ERRORS
+
+SIDECAR_EXT = '.npz'
+SIDECAR_VERSION = 2
+STREAM_NAME = '-'       # name of the scores source read from stdin
+SIDECAR_ARRAYS = ('psg', 'qst', 'sent', 'score', 'q_base', 'offsets', 'rank', 'rank_sent', 'rank_score', '_key_rows',
+                  '_keys')     # store arrays saved in the sidecar (the columns, their grouping and the rank table)
+READ_BLOCK = 65536      # bytes read back from the end of a scores file when looking for its last complete line
+TAIL_BYTES = 64         # bytes before a followed file's read position compared to tell an append from a rewrite
+
+
+# returns the sidecar path used for a scores file
+def sidecar_path_for(scores_path):
+    return os.path.splitext(scores_path)[0] + SIDECAR_EXT
+
+
+# returns the (size, mtime) signature of the scores file that is stored in its sidecar
+def scores_signature(scores_path):
+    st = os.stat(scores_path)
+    return np.array([SIDECAR_VERSION, st.st_size, st.st_mtime_ns], dtype=np.int64)
+
+
+# parses the text of a scores file into the passage, question, sentence and score columns (in file order)
+def parse_scores(text):
+    fields = text.split()                                   # alternating p.q.s keys and scores
+    keys = np.fromstring(' '.join(fields[0::2]).replace('.', ' '), dtype=np.int64, sep=' ')
+    if len(keys) != 3 * len(fields[1::2]):
+        raise ValueError('malformed scores file: every key must have the form passage#.question#.sentence#')
+    keys = keys.reshape(-1, 3)
+    score = np.array(fields[1::2], dtype=np.float64)
+    return keys[:, 0].astype(np.int32), keys[:, 1].astype(np.int32), keys[:, 2].astype(np.int32), score
+
+
+# returns the ranks of rows of a rank column (0 where a row is -1: the key has no score)
+def ranks_of_rows(rank, rows):
+    ranks = np.zeros(len(rows), dtype=np.int32)
+    hit = rows >= 0
+    ranks[hit] = rank[rows[hit]]
+    return ranks
+
+
+# scores for every passage/question/sentence held in flat arrays
+# rows of a (passage, question) are contiguous: rows offsets[q_base[p]+q] up to offsets[q_base[p]+q+1]
+class ScoreStore:
+
+    def __init__(self, psg, qst, sent, score):
+        npsg = int(psg.max()) + 1 if len(psg) else 0
+        nq = np.zeros(npsg, dtype=np.int64)                 # number of questions of each passage
+        np.maximum.at(nq, psg, qst.astype(np.int64) + 1)
+        self.q_base = np.zeros(npsg + 1, dtype=np.int64)
+        np.cumsum(nq, out=self.q_base[1:])
+        gq = self.q_base[psg] + qst                         # group (passage, question) of each row
+        order = np.argsort(gq, kind='stable')               # stable: keeps file order of the sentences in a group
+        self.psg = np.ascontiguousarray(psg[order])
+        self.qst = np.ascontiguousarray(qst[order])
+        self.sent = np.ascontiguousarray(sent[order])
+        self.score = np.ascontiguousarray(score[order])
+        self.offsets = np.searchsorted(gq[order], np.arange(self.q_base[-1] + 1))
+        self._rank()
+
+    # ranks the sentences of every passage/question in one segmented sort over the whole score array
+    # rank[row] is the one-based rank of a row; rank_sent/rank_score hold each group's rows in rank order
+    def _rank(self):
+        self._group_rows()
+        by_rank, self.rank = self.rank_column(self.score)
+        self.rank_sent = self.sent[by_rank]
+        self.rank_score = self.score[by_rank]
+        key = self._gq * self._stride + self.sent           # (group, sentence) key of each row, for rank lookups
+        self._key_rows = np.argsort(key, kind='stable')
+        self._keys = key[self._key_rows]
+
+    # the group (passage, question) of every row and the sentence number stride of the rank lookup keys
+    def _group_rows(self):
+        self._gq = np.repeat(np.arange(len(self.offsets) - 1), np.diff(self.offsets))
+        self._stride = int(self.sent.max()) + 1 if len(self.sent) else 1
+
+    # ranks a column of scores aligned to the rows (NaN where a row has no score: it is ranked 0, after the others)
+    # returns the rows in rank order and the rank of every row
+    def rank_column(self, score):
+        by_rank = np.lexsort((-score, self._gq))           # highest score first within a group (ties keep file order)
+        rank = np.empty(len(score), dtype=np.int32)
+        rank[by_rank] = np.arange(len(score)) - self.offsets[self._gq[by_rank]] + 1
+        rank[np.isnan(score)] = 0
+        return by_rank, rank
+
+    # returns the row range of a passage/question (empty if it has no scores)
+    def rows(self, pnum, qnum):
+        if pnum >= len(self.q_base) - 1 or qnum >= self.q_base[pnum + 1] - self.q_base[pnum]:
+            return 0, 0
+        g = self.q_base[pnum] + qnum
+        return int(self.offsets[g]), int(self.offsets[g + 1])
+
+    # returns the sentence numbers and scores for a passage/question (views, not copies)
+    def seg_scores(self, pnum, qnum):
+        a, b = self.rows(pnum, qnum)
+        return self.sent[a:b], self.score[a:b]
+
+    # returns the sentence numbers and scores of a passage/question in rank order (views; rank is index + 1)
+    def ranked(self, pnum, qnum):
+        a, b = self.rows(pnum, qnum)
+        return self.rank_sent[a:b], self.rank_score[a:b]
+
+    # returns the rows of many passage/question/sentence triples at once (-1 where a triple has no score)
+    def find_rows(self, pnums, qnums, snums):
+        pnums = np.asarray(pnums, dtype=np.int64)
+        qnums = np.asarray(qnums, dtype=np.int64)
+        snums = np.asarray(snums, dtype=np.int64)
+        if len(self._keys) == 0:
+            return np.full(pnums.shape, -1, dtype=np.int64)
+        ok = (pnums >= 0) & (pnums < len(self.q_base) - 1)
+        p = np.where(ok, pnums, 0)
+        ok &= (qnums >= 0) & (qnums < self.q_base[p + 1] - self.q_base[p]) & (snums >= 0) & (snums < self._stride)
+        key = (self.q_base[p] + np.where(ok, qnums, 0)) * self._stride + snums
+        i = np.minimum(np.searchsorted(self._keys, key), len(self._keys) - 1)
+        hit = ok & (self._keys[i] == key)
+        return np.where(hit, self._key_rows[i], -1)
+
+    # returns the ranks of many passage/question/sentence triples at once (0 where a triple has no score)
+    # e.g. questions whose rationale sentence ranks below 3:  lookup_ranks(p, q, rationale_sent) > 3
+    def lookup_ranks(self, pnums, qnums, snums):
+        return ranks_of_rows(self.rank, self.find_rows(pnums, qnums, snums))
+
+    # returns a new store holding the rows of this one and the given rows (which replace the rows of the same keys)
+    def merged(self, psg, qst, sent, score):
+        key = (psg.astype(np.int64) << 42) | (qst.astype(np.int64) << 21) | sent
+        _, last = np.unique(key[::-1], return_index=True)  # (the last row of a key read wins)
+        new = np.sort(len(key) - 1 - last)
+        psg, qst, sent, score = psg[new], qst[new], sent[new], score[new]
+        rows = self.find_rows(psg, qst, sent)
+        keep = np.ones(len(self.score), dtype=bool)
+        keep[rows[rows >= 0]] = False
+        store = ScoreStore(np.concatenate((self.psg[keep], psg)), np.concatenate((self.qst[keep], qst)),
+                           np.concatenate((self.sent[keep], sent)), np.concatenate((self.score[keep], score)))
+        return store
+
+    def __len__(self):
+        return len(self.score)
+
+    # saves the columns to a sidecar file (signature identifies the scores file they were parsed from)
+    # written to a temp file and swapped in, so a crash (or another instance reading it) never sees a partial sidecar
+    def save(self, path, signature):
+        tmp = path + '.' + str(os.getpid()) + '.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                np.savez(f, signature=signature, **{k: getattr(self, k) for k in SIDECAR_ARRAYS})
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    # restores a store from a sidecar file (without regrouping or ranking)
+    @classmethod
+    def from_sidecar(cls, npz):
+        self = cls.__new__(cls)
+        for k in SIDECAR_ARRAYS:
+            setattr(self, k, npz[k])
+        self._group_rows()
+        return self
+
+
+# loads the scores of a scores file, preferring its sidecar while the scores file is unchanged
+def load_scores(scores_path='sentence-scores.txt', use_sidecar=True):
+    sig = scores_signature(scores_path)
+    side = sidecar_path_for(scores_path)
+    if use_sidecar and os.path.exists(side):
+        try:
+            with open(side, 'rb') as f, np.load(f) as npz:
+                if np.array_equal(npz['signature'], sig):
+                    return ScoreStore.from_sidecar(npz)
+        except NPZ_ERRORS:
+            pass                                            # unreadable (e.g. truncated) sidecar: reparse and rewrite it
+    with open(scores_path, 'r') as ff:
+        store = ScoreStore(*parse_scores(ff.read()))
+    if use_sidecar:
+        try:
+            store.save(side, sig)
+        except OSError:
+            pass                                            # read-only directory: run without the sidecar
+    return store
+
+
+# the ranks of one run of a ScoreRuns, looked up like a ScoreStore's (e.g. by the ranking metrics)
+class RunRanks:
+
+    def __init__(self, runs, run):
+        self.base = runs.base
+        self.rank = runs.rank[run]
+
+    def lookup_ranks(self, pnums, qnums, snums):
+        return ranks_of_rows(self.rank, self.base.find_rows(pnums, qnums, snums))
+
+
+_NO_ROWS = (np.zeros(0, dtype=np.int32),) * 3 + (np.zeros(0),)
+
+
+# the scores of several runs (scores files) side by side, aligned on their passage.question.sentence keys
+# the first run's store (base) holds the keys (and is used wherever a single run is shown); every run adds one score
+# column and one rank column aligned to its rows (NaN score and rank 0 where a run has no score for a row).  Rows of the
+# other runs whose keys are not (yet) in the base run are kept aside until they are.
+class ScoreRuns:
+
+    def __init__(self, base, name):
+        self.base = base
+        self.names = [name]
+        self.score = [base.score]
+        self.rank = [base.rank]
+        self.pending = [_NO_ROWS]   # (passage, question, sentence, score) rows of each run whose key is not in the base
+        self.sources = []           # ScoreFile/ScoreStream each run is read from (none: the runs are not updated)
+
+    # adds a run, aligned to the base run's rows
+    def add(self, name, psg, qst, sent, score):
+        self.names.append(name)
+        self.score.append(np.full(len(self.base), np.nan))
+        self.rank.append(None)
+        self.pending.append(_NO_ROWS)
+        self._set_rows(len(self) - 1, (psg, qst, sent, score))
+
+    # sets rows of run k's column (aligned to the base run's rows; the others are kept pending) and reranks it
+    def _set_rows(self, k, *cols):
+        cols = [np.concatenate(c) for c in zip(*cols)]
+        rows = self.base.find_rows(*cols[:3])
+        hit = rows >= 0
+        self.score[k][rows[hit]] = cols[3][hit]          # (of repeated keys, the last row wins)
+        self.rank[k] = self.base.rank_column(self.score[k])[1]
+        self.pending[k] = tuple(c[~hit] for c in cols)
+
+    def __len__(self):
+        return len(self.names)
+
+    # returns the sentence numbers of a passage/question and the rank each run gives them (runs x sentences, 0: none)
+    def ranks(self, pnum, qnum):
+        a, b = self.base.rows(pnum, qnum)
+        return self.base.sent[a:b], np.array([r[a:b] for r in self.rank])
+
+    # returns the questions whose sentences the runs rank most differently, biggest disagreement first:
+    # (passage, question, sentence, rank spread, ranks of the runs) for the sentence of each question with the largest
+    # spread between its highest and lowest rank (only sentences every run ranks), at most n of them
+    def disagreements(self, n=100):
+        if len(self) < 2 or len(self.base) == 0:
+            return []
+        ranks = np.array(self.rank)
+        ranked = (ranks > 0).all(axis=0)
+        spread = np.where(ranked, ranks.max(axis=0) - ranks.min(axis=0), -1)
+        offsets = self.base.offsets
+        groups = np.flatnonzero(np.diff(offsets) > 0)
+        best = np.maximum.reduceat(spread, offsets[groups])             # largest spread of every question
+        order = np.lexsort((groups, -best))[:n]
+        out = []
+        for g in groups[order]:
+            a, b = int(offsets[g]), int(offsets[g + 1])
+            row = a + int(np.argmax(spread[a:b]))
+            if spread[row] <= 0:
+                break
+            out.append((int(self.base.psg[row]), int(self.base.qst[row]), int(self.base.sent[row]), int(spread[row]),
+                        tuple(int(r) for r in ranks[:, row])))
+        return out
+
+    # returns the ranks of a run, to be looked up like a ScoreStore's
+    def run(self, k):
+        return RunRanks(self, k)
+
+    # returns new runs with the rows of run k replaced (replace) or updated by the given rows
+    def updated(self, k, psg, qst, sent, score, replace=False):
+        rows = (psg, qst, sent, score)
+        if k > 0:
+            runs = ScoreRuns(self.base, self.names[0])
+            runs.names = self.names
+            runs.score, runs.rank, runs.pending = list(self.score), list(self.rank), list(self.pending)
+            if replace:
+                runs.score[k] = np.full(len(self.base), np.nan)
+                runs._set_rows(k, rows)
+            else:
+                runs.score[k] = self.score[k].copy()
+                runs._set_rows(k, self.pending[k], rows)
+            return runs
+        if replace:
+            base = ScoreStore(*rows)
+        else:
+            base = self.base.merged(*rows)
+        runs = ScoreRuns(base, self.names[0])
+        old = self.base
+        for j in range(1, len(self)):                      # (the other runs are realigned to the new rows)
+            has = ~np.isnan(self.score[j])
+            cols = zip((old.psg[has], old.qst[has], old.sent[has], self.score[j][has]), self.pending[j])
+            runs.add(self.names[j], *[np.concatenate(c) for c in cols])
+        return runs
+
+    # reads the rows added to the runs' sources since they were last read (on a worker thread: the runs are not
+    # changed) and returns the updated runs, the passage/question numbers of the rows read (None: every question may
+    # have changed) and the number of rows skipped, or None if no row was added
+    # keep (if given) returns which rows of passage, question and sentence columns to keep (e.g. those in the corpus)
+    def ingest(self, keep=None):
+        runs, pnums, qnums, skipped = self, [], [], 0
+        for k, src in enumerate(self.sources):
+            cols, replace = src.read()
+            if cols is None:
+                continue
+            if keep is not None:
+                kept = keep(*cols[:3])
+                skipped += int(len(kept) - kept.sum())
+                cols = tuple(c[kept] for c in cols)
+            runs = runs.updated(k, *cols, replace=replace)
+            if replace:
+                pnums = None
+            elif pnums is not None:
+                pnums.append(cols[0])
+                qnums.append(cols[1])
+        if runs is self and not skipped:
+            return None
+        runs.sources = self.sources
+        if pnums is None:
+            return runs, None, None, skipped
+        none = [np.zeros(0, dtype=np.int32)]                # (every row read was skipped)
+        return runs, np.concatenate(pnums + none), np.concatenate(qnums + none), skipped
+
+
+# a scores file that is followed as rows are appended to it: read() parses the lines added since the file was last
+# read, up to its last newline (or the whole file again if it was replaced, truncated or rewritten in place)
+# a last line without a newline may still be being written: its row is taken (once its key is whole) but the line is
+# read again, and its row replaced, when the file changes
+class ScoreFile:
+
+    def __init__(self, path):
+        self.path = path
+        self.pos = 0                # bytes read (up to the end of the last complete line)
+        self.ident = None           # (device, inode) of the file read
+        self.stamp = None           # (size, mtime) of the file when it was last read
+        self.tail = b''             # last bytes (up to TAIL_BYTES) before pos, as they were read
+
+    # loads the file (see load_scores) and remembers how far it was read
+    def load(self, use_sidecar=True):
+        st = os.stat(self.path)
+        with open(self.path, 'rb') as f:
+            self.pos = _line_end(f, st.st_size)
+            f.seek(max(0, self.pos - TAIL_BYTES))
+            self.tail = f.read(self.pos - max(0, self.pos - TAIL_BYTES))
+            last = f.read(st.st_size - self.pos)                        # (the last line, if it has no newline)
+        self.ident = (st.st_dev, st.st_ino)
+        self.stamp = (st.st_size, st.st_mtime_ns)
+        if _whole_row(last):
+            return load_scores(self.path, use_sidecar)
+        with open(self.path, 'rb') as f:
+            return ScoreStore(*parse_scores(f.read(self.pos).decode()))
+
+    # returns the (passage, question, sentence, score) columns of the rows added since the last read (None if none)
+    # and whether they replace the rows read before (the file was replaced, truncated or rewritten)
+    def read(self):
+        st = os.stat(self.path)
+        ident = (st.st_dev, st.st_ino)
+        stamp = (st.st_size, st.st_mtime_ns)
+        if ident == self.ident and stamp == self.stamp:
+            return None, False
+        with open(self.path, 'rb') as f:
+            f.seek(self.pos - len(self.tail))
+            replace = (ident != self.ident or st.st_size < self.pos or f.read(len(self.tail)) != self.tail
+                       or st.st_size == self.stamp[0])                 # (same size, newer mtime: rewritten in place)
+            if replace:
+                self.pos = 0
+                self.tail = b''
+                f.seek(0)
+            data = f.read(st.st_size - self.pos)
+        self.ident = ident
+        self.stamp = stamp
+        end = data.rfind(b'\n') + 1
+        rows = data[:end] + (data[end:] if _whole_row(data[end:]) else b'')
+        self.pos += end
+        self.tail = (self.tail + data[:end])[-TAIL_BYTES:]
+        if not rows.strip() and not replace:
+            return None, False
+        return parse_scores(rows.decode()), replace
+
+
+# returns the end of the last complete line within the first size bytes of an open file
+def _line_end(f, size):
+    end = size
+    while end > 0:
+        start = max(0, end - READ_BLOCK)
+        f.seek(start)
+        i = f.read(end - start).rfind(b'\n')
+        if i >= 0:
+            return start + i + 1
+        end = start
+    return 0
+
+
+# whether the text of a line without a newline holds a whole row: its key is whole once its score has begun
+def _whole_row(line):
+    return len(line.split()) == 2
+
+
+# a scores stream (stdin or a named pipe) whose rows are read on a thread as they are written; read() parses the
+# complete lines received since the last read
+class ScoreStream:
+
+    def __init__(self, path):
+        self.path = path
+        self.lines = []
+        self.lock = threading.Lock()
+
+    # starts reading the stream; returns an empty store (the rows are read as they arrive)
+    def load(self, use_sidecar=True):
+        threading.Thread(target=self._receive, name='scores-stream', daemon=True).start()
+        empty = np.zeros(0, dtype=np.int32)
+        return ScoreStore(empty, empty, empty, np.zeros(0))
+
+    def _receive(self):
+        stream = sys.stdin if self.path == STREAM_NAME else open(self.path, 'r')    # (a pipe opens once written to)
+        with stream:
+            for line in stream:                     # (lines come whole: a last one without a newline ends the stream)
+                with self.lock:
+                    self.lines.append(line)
+
+    def read(self):
+        with self.lock:
+            lines, self.lines = self.lines, []
+        if not lines:
+            return None, False
+        return parse_scores(''.join(lines)), False
+
+
+# returns the source of a scores run: a ScoreStream for stdin ('-') and named pipes, a ScoreFile otherwise
+def score_source(path):
+    if path == STREAM_NAME or stat.S_ISFIFO(os.stat(path).st_mode):
+        return ScoreStream(path)
+    return ScoreFile(path)
+
+
+# loads several scores files (or streams) in parallel (each file from its sidecar while it is unchanged), aligned to
+# the first one; the runs keep their sources, to read the rows added to them later (see ScoreRuns.ingest)
+def load_score_runs(paths, use_sidecar=True):
+    sources = [score_source(path) for path in paths]
+    with ThreadPoolExecutor(max_workers=len(paths)) as pool:
+        stores = list(pool.map(lambda src: src.load(use_sidecar), sources))
+    runs = ScoreRuns(stores[0], paths[0])
+    for path, store in zip(paths[1:], stores[1:]):
+        runs.add(path, store.psg, store.qst, store.sent, store.score)
+    runs.sources = sources
+    return runs
@@ -0,0 +1,262 @@
+# Author: Sal Barbosa
+# Corpus-wide inverted index for Find
+# Every passage, question and answer token of the corpus is indexed (case-insensitively) by its token, its lemma and
+# its named entity type.  The index is built straight from the cache's token columns (no passage is materialized):
+# each field has a vocabulary of lowercased terms and, per term, a sorted array of hits.  A trigram layer over each
+# vocabulary narrows substring matches to the few terms that can contain the pattern.
+# A hit is packed into one integer (passage, part, question, token), so sorted hits are grouped by passage, then
+# passage/question/answer part, then question (Find shows where a hit is within its passage's or question's hits).
+# The index is persisted next to the cache and reused while it is current; the viewer builds (or loads) it in the
+# background once the corpus is loaded.
+#
+# Phrases and regular expressions (which may span tokens) are matched against the raw story text instead: all stories
+# are joined into one string, so a search is a single C-level regex pass over the corpus, and every match is mapped
+# back to its passage and first/last token by bisecting the stories' and tokens' (s_map) character offsets.
+#
+import os
+import re
+import numpy as np
+from coqa_cache import P_SEG, P_NSEG, P_Q, P_NQ, P_A, P_NA, P_COLS, NONE_ID
+from coqa_model import passage_token_offsets
+from coqa_util import NPZ_ERRORS, expand_ranges
+
+INDEX_EXT = '.index.npz'
+INDEX_VERSION = 1
+
+FIELDS = {'tok': 0, 'lemma': 2, 'ne': 3}    # indexed fields and their token tuple index (TOK, L_TAG, N_TAG)
+STORY_SEP = '\x00'                          # separates the stories in the joined corpus text
+PARTS = 'PQA'                               # passage, question and answer hits (in that order within a passage)
+
+# bit layout of a packed hit: passage | part | question | token
+TOK_BITS = 24
+Q_BITS = 14
+PART_BITS = 2
+Q_SHIFT = TOK_BITS
+PART_SHIFT = TOK_BITS + Q_BITS
+P_SHIFT = TOK_BITS + Q_BITS + PART_BITS
+
+
+# packs a hit: part is 'P', 'Q' or 'A'; tok is the passage token (P) or the token in the question/answer (Q, A)
+def pack_hit(pnum, part, qnum, tok):
+    return (pnum << P_SHIFT) | (PARTS.index(part) << PART_SHIFT) | (qnum << Q_SHIFT) | tok
+
+
+# unpacks a hit into (passage, part, question, token); question is 0 for passage hits
+def unpack_hit(hit):
+    hit = int(hit)
+    return (hit >> P_SHIFT, PARTS[(hit >> PART_SHIFT) & ((1 << PART_BITS) - 1)],
+            (hit >> Q_SHIFT) & ((1 << Q_BITS) - 1), hit & ((1 << TOK_BITS) - 1))
+
+
+# groups sorted hits by passage, part and question (a passage's hits are one group, each question's and each answer's
+# another): hits offsets[g]..offsets[g+1] are group g; returns offsets
+def hit_groups(hits):
+    grp = np.asarray(hits, dtype=np.uint64) >> np.uint64(TOK_BITS)
+    if not len(grp):
+        return np.zeros(1, dtype=np.int64)
+    return np.concatenate(([0], np.flatnonzero(grp[1:] != grp[:-1]) + 1, [len(grp)]))
+
+
+# returns the trigrams of a term
+def trigrams(term):
+    return {term[i:i + 3] for i in range(len(term) - 2)}
+
+
+# returns the term a field string is indexed under (None if the string is not indexed)
+def index_term(field, s):
+    if field == 'ne':
+        if s in ('-', 'O', '<', ''):
+            return None
+        s = s.split()[0]                    # NE type only (the compound named entity follows the type)
+    elif field == 'lemma' and s == '~':     # lemma = token
+        return None
+    return s.lower()
+
+
+# case-insensitive index of the token, lemma and NE fields of every token in the corpus
+class SearchIndex:
+
+    def __init__(self, vocab, offsets, hits):
+        self.vocab = vocab                  # field -> list of terms (term id -> term)
+        self.offsets = offsets              # field -> hits of term t are hits[field][offsets[field][t]:offsets[field][t+1]]
+        self.hits = hits                    # field -> packed hits, grouped by term and sorted within a term
+        self.grams = {}                     # field -> trigram -> term ids (built on first substring search)
+        self.term_ids = {f: {t: i for i, t in enumerate(vocab[f])} for f in vocab}
+
+    # builds the index from a corpus' cache columns
+    @classmethod
+    def build(cls, corpus):
+        ncols = corpus.ncols
+        tok = np.frombuffer(corpus.section('tok'), dtype=np.uint32).reshape(-1, ncols)
+        seg = np.frombuffer(corpus.section('seg'), dtype=np.uint32).reshape(-1, 2).astype(np.int64)
+        psg = np.frombuffer(corpus.section('psg'), dtype=np.uint32).reshape(-1, P_COLS).astype(np.int64)
+
+        keys = []
+        rows = []
+        firsts = []
+        for part, col, ncol in (('P', P_SEG, P_NSEG), ('Q', P_Q, P_NQ), ('A', P_A, P_NA)):
+            segs, seg_p = expand_ranges(psg[:, col], psg[:, ncol])     # segments of the part, and their passage
+            r, si = expand_ranges(seg[segs, 0], seg[segs, 1])           # token rows, and their segment
+            p = seg_p[si]
+            if part == 'P':                                             # passage tokens are numbered across sentences
+                j = r - seg[psg[p, P_SEG], 0]
+                q = np.zeros_like(p)
+            else:
+                j = r - seg[segs[si], 0]
+                q = segs[si] - psg[p, col]                              # (question/answer q is the part's segment q)
+            keys.append((p << P_SHIFT) | (PARTS.index(part) << PART_SHIFT) | (q << Q_SHIFT) | j)
+            rows.append(r)
+            firsts.append(np.diff(si, prepend=-1) != 0)                # first token of each segment
+        keys = np.concatenate(keys)
+        rows = np.concatenate(rows)
+        firsts = np.concatenate(firsts)
+
+        vocab, offsets, hits = {}, {}, {}
+        for field, fidx in FIELDS.items():
+            if fidx >= ncols:
+                continue
+            ids = tok[rows, fidx].astype(np.int64)
+            if field == 'ne':                                           # '<' continues the named entity to its left
+                lt = [i for i in np.unique(ids) if i != NONE_ID and corpus.string(int(i)) == '<']
+                if lt:                                                  # (within its sentence, question or answer)
+                    src = np.where(np.isin(ids, lt) & ~firsts, 0, np.arange(len(ids)))
+                    ids = ids[np.maximum.accumulate(src)]
+            uids = np.unique(ids)
+            terms = [index_term(field, corpus.string(int(i))) if i != NONE_ID else None for i in uids]
+            vocab[field] = sorted({t for t in terms if t})
+            tid = {t: k for k, t in enumerate(vocab[field])}
+            lut = np.array([tid[t] if t else -1 for t in terms], dtype=np.int64)
+            term = lut[np.searchsorted(uids, ids)]                      # term id of every token (-1: not indexed)
+            keep = term >= 0
+            order = np.lexsort((keys[keep], term[keep]))
+            hits[field] = keys[keep][order].astype(np.uint64)
+            offsets[field] = np.searchsorted(term[keep][order], np.arange(len(vocab[field]) + 1))
+        return cls(vocab, offsets, hits)
+
+    # returns the term ids of a field whose term contains text (text must be lowercase)
+    def matching_terms(self, field, text):
+        vocab = self.vocab[field]
+        if len(text) < 3:                                               # too short for trigrams: scan the vocabulary
+            return [i for i, t in enumerate(vocab) if text in t]
+        if field not in self.grams:
+            grams = {}
+            for i, t in enumerate(vocab):
+                for g in trigrams(t):
+                    grams.setdefault(g, []).append(i)
+            self.grams[field] = grams
+        grams = self.grams[field]
+        cands = None
+        for g in sorted(trigrams(text), key=lambda g: len(grams.get(g, ()))):
+            ids = grams.get(g)
+            if not ids:
+                return []
+            cands = set(ids) if cands is None else cands.intersection(ids)
+            if not cands:
+                return []
+        return sorted(i for i in cands if text in vocab[i])
+
+    # returns the sorted packed hits of the tokens whose field contains text (or equals it, if exact)
+    def find(self, text, field='tok', exact=False):
+        text = text.lower()
+        if field not in self.vocab or not text:
+            return np.zeros(0, dtype=np.uint64)
+        if exact:
+            tids = [self.term_ids[field][text]] if text in self.term_ids[field] else []
+        else:
+            tids = self.matching_terms(field, text)
+        off = self.offsets[field]
+        found = [self.hits[field][off[t]:off[t + 1]] for t in tids]
+        if not found:
+            return np.zeros(0, dtype=np.uint64)
+        return np.sort(np.concatenate(found))
+
+    # saves the index (signature identifies the corpus it was built from)
+    # written to a temp file and swapped in, so a crash (or another instance reading it) never sees a partial index
+    def save(self, path, signature):
+        arrays = {'signature': np.array([signature]), 'version': np.array([INDEX_VERSION])}
+        for f in self.vocab:
+            arrays[f + '_vocab'] = np.array(self.vocab[f], dtype=str)
+            arrays[f + '_offsets'] = self.offsets[f]
+            arrays[f + '_hits'] = self.hits[f]
+        tmp = path + '.' + str(os.getpid()) + '.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    # restores an index saved with save
+    @classmethod
+    def load(cls, npz):
+        vocab, offsets, hits = {}, {}, {}
+        for f in FIELDS:
+            if f + '_vocab' in npz:
+                vocab[f] = npz[f + '_vocab'].tolist()
+                offsets[f] = npz[f + '_offsets']
+                hits[f] = npz[f + '_hits']
+        return cls(vocab, offsets, hits)
+
+
+# returns the regular expression matching a phrase (words may be separated by any whitespace)
+def phrase_pattern(phrase):
+    return r'\s+'.join(re.escape(w) for w in phrase.split())
+
+
+# the story text of every passage, joined, with the character offset of every passage token that has one
+class TextIndex:
+
+    def __init__(self, corpus):
+        stories = [corpus.story(p) for p in range(len(corpus))]
+        self.text = STORY_SEP.join(stories)
+        lens = np.array([len(t) + len(STORY_SEP) for t in stories], dtype=np.int64)
+        self.story_first = np.concatenate(([0], np.cumsum(lens)))      # character offset of each story in text
+
+        off, self.psg_first = passage_token_offsets(corpus)            # first (global) token of each passage
+        pnum = np.repeat(np.arange(len(corpus)), np.diff(self.psg_first))
+        self.tok_num = np.flatnonzero(off >= 0)                         # tokens with an offset (unmapped ones are skipped)
+        self.tok_off = (off + self.story_first[pnum])[self.tok_num]     # their (sorted) offsets in the joined text
+
+    # returns (passages, first tokens, last tokens) of every match of a regular expression (or of a phrase)
+    # matches spanning two stories are dropped; tokens are numbered within their passage
+    def find(self, pattern, regex=False, ignore_case=True):
+        rx = re.compile(pattern if regex else phrase_pattern(pattern), re.IGNORECASE if ignore_case else 0)
+        spans = np.array([m.span() for m in rx.finditer(self.text) if m.end() > m.start()], dtype=np.int64).reshape(-1, 2)
+        start, end = spans[:, 0], spans[:, 1]
+        pnum = np.searchsorted(self.story_first, start, side='right') - 1
+        keep = end <= self.story_first[pnum + 1] - len(STORY_SEP)
+        keep &= (self.psg_first[pnum + 1] > self.psg_first[pnum]) & (len(self.tok_num) > 0)    # (a passage has tokens)
+        start, end, pnum = start[keep], end[keep], pnum[keep]
+        fi = np.searchsorted(self.tok_off, start, side='right') - 1    # mapped token that contains the match start
+        li = np.searchsorted(self.tok_off, end, side='left') - 1       # last mapped token beginning before the match end
+        base = self.psg_first[pnum]
+        last = self.psg_first[pnum + 1] - 1
+        ftok = np.clip(np.where(fi >= 0, self.tok_num[np.maximum(fi, 0)], base), base, last)   # (none: the first)
+        ltok = np.clip(np.where(li >= 0, self.tok_num[np.maximum(li, 0)], ftok), ftok, last)
+        return pnum, ftok - base, ltok - base
+
+
+# returns the index path used for a corpus
+def index_path_for(corpus):
+    return os.path.splitext(corpus.path)[0] + INDEX_EXT
+
+
+# returns the search index of a corpus, loading the persisted index if it was built from the same json file
+def load_index(corpus, persist=True):
+    path = index_path_for(corpus)
+    sig = corpus.source['sha1']
+    if persist and os.path.exists(path):
+        try:
+            with open(path, 'rb') as f, np.load(f) as npz:
+                if npz['version'][0] == INDEX_VERSION and str(npz['signature'][0]) == sig:
+                    return SearchIndex.load(npz)
+        except NPZ_ERRORS:
+            pass                                            # unreadable (e.g. truncated) index: rebuild it
+    index = SearchIndex.build(corpus)
+    if persist:
+        try:
+            index.save(path, sig)
+        except OSError:
+            pass
+    return index
@@ -0,0 +1,225 @@
+# Author: Sal Barbosa
+# Synthetic corpus (and sentence scores) for scale testing
+# Writes a coqa-news-preprocessed-final.json with the same schema as the real one (story_num, id, story, seg_text,
+# seg_tagged, seg_dep, q_text, q_tagged, quoted, q_dep, a_text, a_tagged, rationale, corefs) and a matching
+# sentence-scores.txt (a score for every passage.question.sentence), so load time, memory and render time can be
+# measured on corpora many times the size of the CoQA news set.  The passage count, sentence count and length,
+# question count, answer length and coreference density are configurable; a seed makes the output reproducible.
+# Both files are written one passage at a time, so corpora far larger than memory can be generated.
+#
+#    python coqa_synth.py [--passages N] [--sentences A-B] [--sent-len A-B] [--questions A-B] [--answer-len A-B]
+#                         [--corefs D] [--mentions A-B] [--vocab V] [--seed S] [--out DIR]
+#
+# Generated text is made of pseudo-words drawn from a Zipf-like vocabulary, each with a fixed POS tag, lemma and named
+# entity type (so tags repeat as in real text).  Token lists hold the token, POS, lemma ('~' if it is the token), named
+# entity ('-' if none, the type and compound entity in the first token of a compound entity and '<' in the others) and
+# the token's start and end character offsets in the story (as strings).  Dependencies form a tree per sentence, with
+# 1-based token indices (governor 0 for ROOT); coreference mentions use 0-based sentence/token indices.
+#
+import argparse
+import json
+import os
+import random
+
+SYLLABLES = ('ba', 'ko', 'ri', 'ne', 'su', 'ta', 'mi', 'lo', 'de', 'va', 'po', 'ge', 'hu', 'zi', 'ca', 'fe', 'ju', 'ny')
+OPEN_POS = ('NN', 'NN', 'NN', 'NNS', 'VB', 'VBD', 'VBD', 'VBZ', 'VBG', 'JJ', 'JJ', 'RB')     # (weighted by repetition)
+FUNCTION_WORDS = (('the', 'DT'), ('a', 'DT'), ('of', 'IN'), ('in', 'IN'), ('to', 'TO'), ('and', 'CC'), ('he', 'PRP'),
+                  ('she', 'PRP'), ('it', 'PRP'), ('was', 'VBD'), ('is', 'VBZ'), ('on', 'IN'), ('that', 'IN'),
+                  ('for', 'IN'), ('with', 'IN'), ('his', 'PRP$'), ('her', 'PRP$'), ('by', 'IN'), ('at', 'IN'))
+NE_TYPES = ('PERSON', 'CITY', 'ORGANIZATION', 'COUNTRY', 'LOCATION', 'STATE_OR_PROVINCE', 'NATIONALITY')
+NE_FRACTION = 0.08                  # fraction of the vocabulary that are (proper noun) named entities
+COMPOUND_NE = 0.3                   # chance that a named entity token starts a two or three token compound entity
+DEP_TYPES = ('nsubj', 'dobj', 'amod', 'det', 'case', 'compound', 'nmod', 'nmod:poss', 'advmod', 'aux', 'cop', 'conj',
+             'cc', 'mark', 'appos', 'nummod', 'punct', 'xcomp', 'ccomp', 'nsubjpass', 'neg', 'nmod:tmod', 'dep')
+WH_WORDS = ('what', 'who', 'where', 'when', 'how', 'why', 'which')    # question words (tagged WHAT, WHO, ... as in the real file)
+
+
+# parses a 'min-max' (or single number) range argument
+def int_range(text):
+    lo, _, hi = text.partition('-')
+    lo = int(lo)
+    hi = int(hi) if hi else lo
+    if lo < 0 or hi < lo:
+        raise argparse.ArgumentTypeError('expected min-max with 0 <= min <= max: ' + text)
+    return lo, hi
+
+
+# the words of the generated text: (token, POS, lemma, NE type) entries, and their Zipf-like cumulative weights
+class Lexicon:
+
+    def __init__(self, rnd, size):
+        words = [(w, pos, '~', '-') for w, pos in FUNCTION_WORDS]
+        seen = {w for w, _, _, _ in words}
+        while len(words) < size:
+            w = ''.join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(1, 4)))
+            if w in seen:
+                continue
+            seen.add(w)
+            if rnd.random() < NE_FRACTION:
+                words.append((w.capitalize(), 'NNP', '~', rnd.choice(NE_TYPES)))
+            else:
+                pos = rnd.choice(OPEN_POS)
+                lemma = '~'
+                if pos in ('NNS', 'VBZ'):
+                    w += 's'
+                    lemma = w[:-1]
+                elif pos in ('VBD', 'VBG'):
+                    lemma = w
+                    w += 'ed' if pos == 'VBD' else 'ing'
+                words.append((w, pos, lemma, '-'))
+        self.words = words
+        self.cum = []
+        total = 0.0
+        for rank in range(len(words)):
+            total += 1.0 / (rank + 1)
+            self.cum.append(total)
+
+    # returns n random word entries
+    def draw(self, rnd, n):
+        return rnd.choices(self.words, cum_weights=self.cum, k=n)
+
+
+# returns the tagged tokens of a sentence of n tokens (without offsets), ending with a period
+# (question sentences start with a question word and end with a question mark)
+def sentence_tokens(rnd, lex, n, question=False):
+    toks = []
+    words = lex.draw(rnd, max(n - 1, 1))
+    k = 0
+    if question:
+        wh = rnd.choice(WH_WORDS)
+        toks.append([wh, wh.upper(), '~', '-'])
+        k = 1
+    while k < len(words):
+        w, pos, lemma, ne = words[k]
+        if ne != '-' and rnd.random() < COMPOUND_NE:    # compound named entity: its type and name on the first token
+            parts = [w] + [lex.draw(rnd, 1)[0][0].capitalize() for _ in range(rnd.randint(1, 2))]
+            toks.append([w, pos, lemma, ne + ' ' + '_'.join(parts)])
+            for p in parts[1:]:
+                toks.append([p, 'NNP', '~', '<'])
+        else:
+            toks.append([w, pos, lemma, ne])
+        k += 1
+    if toks and not question:
+        toks[0][0] = toks[0][0][:1].upper() + toks[0][0][1:]
+    toks.append(['?' if question else '.', '.', '~', '-'])
+    return toks
+
+
+# appends the start/end character offsets of a sentence's tokens (from offset off, separated by spaces), returns its text
+def place_tokens(toks, off):
+    words = []
+    for t in toks:
+        t.append(str(off))
+        t.append(str(off + len(t[0])))
+        off += len(t[0]) + 1
+        words.append(t[0])
+    return ' '.join(words)
+
+
+# returns a random dependency tree over n tokens as [type, governor, dependent] triples (1-based, ROOT governed by 0)
+def dependency_tree(rnd, n):
+    if n == 0:
+        return []
+    order = list(range(1, n + 1))
+    rnd.shuffle(order)
+    deps = [['ROOT', 0, order[0]]]
+    for k in range(1, n):
+        deps.append([rnd.choice(DEP_TYPES), order[rnd.randrange(k)], order[k]])
+    deps.sort(key=lambda d: d[2])
+    return deps
+
+
+# returns the coreference chains of a passage: {chain id: [mention, ...]}, the first mention of a chain representative
+def coref_chains(rnd, sentences, density, mentions):
+    chains = {}
+    nchains = int(density * len(sentences)) + (rnd.random() < density * len(sentences) % 1)
+    mid = 1
+    for c in range(nchains):
+        refs = []
+        for k in range(rnd.randint(*mentions)):
+            s = rnd.randrange(len(sentences))
+            t = rnd.randrange(max(len(sentences[s]) - 1, 1))   # (not the final period)
+            refs.append({'id': mid, 'text': sentences[s][t][0], 'sentNum': s, 'startIndex': t, 'endIndex': t + 1,
+                         'repmention': k == 0})
+            mid += 1
+        chains[str(c + 1)] = refs
+    return chains
+
+
+# returns a synthetic passage (a dictionary of the preprocessed schema)
+def make_passage(rnd, lex, pnum, args):
+    sentences, texts = [], []
+    off = 0
+    for _ in range(max(rnd.randint(*args.sentences), 1)):
+        toks = sentence_tokens(rnd, lex, max(rnd.randint(*args.sent_len), 2))
+        texts.append(place_tokens(toks, off))
+        off += len(texts[-1]) + 1
+        sentences.append(toks)
+    story = ' '.join(texts)
+
+    q_text, q_tagged, q_dep, a_text, a_tagged, rationale = [], [], [], [], [], []
+    for _ in range(rnd.randint(*args.questions)):
+        q = sentence_tokens(rnd, lex, max(rnd.randint(*args.sent_len) // 3, 3), question=True)
+        q_text.append(place_tokens(q, 0))
+        q_tagged.append(q)
+        q_dep.append(dependency_tree(rnd, len(q)))
+        s = rnd.randrange(len(sentences))                 # the answer is a run of tokens of one sentence (its rationale)
+        n = min(rnd.randint(*args.answer_len), len(sentences[s]) - 1) or 1
+        f = rnd.randrange(max(len(sentences[s]) - n, 1))
+        span = sentences[s][f:f + n]
+        a = [[t[0], t[1], t[2], t[3]] for t in span]
+        a_text.append(place_tokens(a, 0))
+        a_tagged.append(a)
+        rationale.append([int(span[0][4]), int(span[-1][5])])
+
+    return {'story_num': pnum + 1, 'id': 'synth%07d' % pnum, 'story': story, 'seg_text': texts, 'seg_tagged': sentences,
+            'seg_dep': [dependency_tree(rnd, len(s)) for s in sentences], 'q_text': q_text, 'q_tagged': q_tagged,
+            'quoted': [], 'q_dep': q_dep, 'a_text': a_text, 'a_tagged': a_tagged, 'rationale': rationale,
+            'corefs': coref_chains(rnd, sentences, args.corefs, args.mentions)}
+
+
+# writes the corpus json and its scores file (a passage at a time); returns (passages, questions, score rows)
+def generate(args):
+    rnd = random.Random(args.seed)
+    lex = Lexicon(rnd, args.vocab)
+    os.makedirs(args.out, exist_ok=True)
+    nq = nrows = 0
+    with open(os.path.join(args.out, 'coqa-news-preprocessed-final.json'), 'w', encoding='utf-8') as jf, \
+         open(os.path.join(args.out, 'sentence-scores.txt'), 'w') as sf:
+        jf.write('{"version": "1.0", "data": [')
+        for p in range(args.passages):
+            d = make_passage(rnd, lex, p, args)
+            jf.write((', ' if p else '') + json.dumps(d))
+            ns = len(d['seg_tagged'])
+            lines = []
+            for q in range(len(d['q_tagged'])):
+                for s in range(ns):
+                    lines.append('%d.%d.%d %.6f\n' % (p, q, s, rnd.random()))
+            sf.write(''.join(lines))
+            nq += len(d['q_tagged'])
+            nrows += len(lines)
+        jf.write(']}')
+    return args.passages, nq, nrows
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Writes a synthetic CoQA News Viz corpus and sentence scores.')
+    ap.add_argument('--passages', type=int, default=1701, help='number of passages (default: 1701, the CoQA news set)')
+    ap.add_argument('--sentences', type=int_range, default=(8, 24), help='sentences per passage (default: 8-24)')
+    ap.add_argument('--sent-len', type=int_range, default=(6, 35), help='tokens per sentence (default: 6-35)')
+    ap.add_argument('--questions', type=int_range, default=(8, 16), help='questions per passage (default: 8-16)')
+    ap.add_argument('--answer-len', type=int_range, default=(1, 6), help='tokens per answer (default: 1-6)')
+    ap.add_argument('--corefs', type=float, default=0.5, help='coreference chains per sentence (default: 0.5)')
+    ap.add_argument('--mentions', type=int_range, default=(2, 5), help='mentions per coreference chain (default: 2-5)')
+    ap.add_argument('--vocab', type=int, default=20000, help='vocabulary size (default: 20000)')
+    ap.add_argument('--seed', type=int, default=1, help='random seed (default: 1)')
+    ap.add_argument('--out', default='synthetic', help='output directory (default: synthetic)')
+    args = ap.parse_args(argv)
+    if args.mentions[0] < 1:
+        ap.error('a coreference chain needs at least one mention')
+    npsg, nq, nrows = generate(args)
+    print('wrote', npsg, 'passages,', nq, 'questions and', nrows, 'sentence scores to', args.out)
+
+
+if __name__ == '__main__':
+    main()
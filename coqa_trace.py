@@ -0,0 +1,155 @@
+# Author: Sal Barbosa
+# Optional instrumentation of the viewer's user-level operations (show_passage, show_qar, hover_on, search_for_term)
+# An operation is recorded from the moment it is called until everything it queued is drawn (rendering is chunked, see
+# run_render), so its wall time includes the pauses between chunks.  Its busy time is broken down by phase (data prep,
+# layout, canvas items, links, rationale, search, ...), and the record is completed with the toggles it was drawn under
+# and the canvas item/widget counts at its end.  Operations called by another one (show_passage calls show_qar) are
+# part of the outer record; an operation that is started before the previous one is drawn marks it interrupted.
+# Synchronous operations (hovering: done when the call returns) get a record of their own that leaves the record of an
+# operation still being drawn open, so hovering over the passage while it is drawn does not cut its record short.
+# The last records are kept for the viewer's overlay, and every record may be appended to a JSONL trace file.
+# The tracer does not touch Tk: the viewer passes it callables for the render state, the counts and the context.
+#
+import json
+import time
+from collections import deque
+
+TRACE_KEEP = 5          # records kept for the overlay
+
+
+# a phase timer (a context manager adding its elapsed time to a phase of the open record)
+class _Phase:
+    __slots__ = ('tracer', 'name', 't')
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.t = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.tracer.add(self.name, time.perf_counter() - self.t)
+
+
+# does nothing (the phase timer while no operation is recorded)
+class _NoPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_PHASE = _NoPhase()
+
+
+class Tracer:
+
+    def __init__(self, pending, counts, context, path=None, enabled=False):
+        self.pending = pending          # () -> whether rendering is still queued
+        self.counts = counts            # () -> {'items': {canvas: item count}, 'widgets': live widget count}
+        self.context = context          # () -> the state an operation ran under (passage, question, toggles)
+        self.path = path                # JSONL trace file the records are appended to (None: not written)
+        self.enabled = enabled
+        self.current = None             # record of the operation being timed
+        self.depth = 0                  # nesting of the traced calls in progress
+        self.last = deque(maxlen=TRACE_KEEP)
+        self.on_record = None           # called with every completed record (the overlay)
+
+    # returns fn wrapped so that its calls are recorded as operation op (while the tracer is enabled)
+    # (sync: fn draws everything before it returns, see record_sync)
+    def wrap(self, op, fn, sync=False):
+        def traced(*args, **kwargs):
+            if not self.enabled:
+                return fn(*args, **kwargs)
+            if sync and self.depth == 0:
+                return self.record_sync(op, fn, args, kwargs)
+            self.begin(op, args)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.leave()
+        traced.__name__ = fn.__name__
+        return traced
+
+    # records a call of a synchronous operation as a record of its own, completed when the call returns; the record of
+    # an operation still being drawn is set aside meanwhile (not interrupted)
+    def record_sync(self, op, fn, args, kwargs):
+        outer = self.current
+        self.current = None
+        self.begin(op, args)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.depth -= 1
+            self.finish()
+            self.current = outer
+
+    # opens the record of an operation (a call made by a traced operation is part of its record)
+    def begin(self, op, args=()):
+        self.depth += 1
+        if self.depth > 1:
+            return
+        if self.current is not None:                # the previous operation is still being drawn
+            self.finish(interrupted=True)
+        self.current = {'op': op, 'args': [a for a in args if isinstance(a, (int, str))],
+                        'context': self.context(), 't0': time.perf_counter(), 'phases': {}}
+
+    # closes the call of a traced operation (the record is completed once its rendering is done)
+    def leave(self):
+        self.depth -= 1
+        if self.depth == 0 and self.current is not None and not self.pending():
+            self.finish()
+
+    # returns a context manager timing a phase of the open record
+    def phase(self, name):
+        if self.current is None:
+            return _NO_PHASE
+        return _Phase(self, name)
+
+    # adds seconds to a phase of the open record
+    def add(self, name, seconds):
+        if self.current is not None:
+            phases = self.current['phases']
+            phases[name] = phases.get(name, 0.0) + seconds
+
+    # called when the render queue is drawn: completes the open record (unless a traced call is still running)
+    def rendered(self):
+        if self.current is not None and self.depth == 0:
+            self.finish()
+
+    # completes the open record: wall time, phases in ms, counts; keeps it and appends it to the trace file
+    def finish(self, interrupted=False):
+        rec = self.current
+        self.current = None
+        wall = time.perf_counter() - rec.pop('t0')
+        busy = sum(rec['phases'].values())
+        rec['phases'] = {k: round(v * 1000, 3) for k, v in rec['phases'].items()}
+        rec['wall_ms'] = round(wall * 1000, 3)
+        rec['busy_ms'] = round(busy * 1000, 3)
+        rec['time'] = time.time()
+        rec['interrupted'] = interrupted
+        rec.update(self.counts())
+        self.last.append(rec)
+        if self.path:
+            try:
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(rec) + '\n')
+            except OSError:
+                self.path = None                    # unwritable trace file: keep showing the overlay only
+        if self.on_record is not None:
+            self.on_record(rec)
+        return rec
+
+
+# returns a record as the few lines shown in the overlay
+def record_text(rec):
+    head = rec['op'] + '(' + ','.join(str(a) for a in rec['args']) + ')' + (' interrupted' if rec['interrupted'] else '')
+    phases = '  '.join(k + ' ' + format(v, '.1f') for k, v in sorted(rec['phases'].items(), key=lambda kv: -kv[1]))
+    items = sum(rec.get('items', {}).values())
+    return (head + ': wall ' + format(rec['wall_ms'], '.1f') + ' ms, busy ' + format(rec['busy_ms'], '.1f') + ' ms\n'
+            + '  ' + (phases or '-') + '\n'
+            + '  items ' + str(items) + '  widgets ' + str(rec.get('widgets', 0)))
@@ -0,0 +1,17 @@
+# Author: Sal Barbosa
+# Array helpers shared by the corpus-wide (NumPy) modules: rationale spans, search index, scores and metrics
+#
+import zipfile
+import numpy as np
+
+NPZ_ERRORS = (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile)     # raised reading a damaged .npz file
+
+
+# concatenation of range(starts[i], starts[i]+counts[i]) for all i (the rows of CSR groups), and the index i of each
+# element (its group)
+def expand_ranges(starts, counts):
+    starts = np.asarray(starts, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+    owner = np.repeat(np.arange(len(counts)), counts)
+    first = np.cumsum(counts) - counts                      # position of each range in the concatenation
+    return starts[owner] + np.arange(len(owner)) - first[owner], owner
@@ -0,0 +1,58 @@
+# Author: Sal Barbosa
+# Shared fixtures: a small synthetic corpus (and its sentence scores) written by coqa_synth into a temporary directory,
+# so the Tk-free modules can be tested without the CoQA news files or a display.
+#
+import json
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import coqa_synth
+from coqa_cache import load_corpus
+
+SYNTH_ARGS = ['--passages', '12', '--sentences', '3-8', '--sent-len', '4-30', '--questions', '2-5', '--vocab', '400',
+              '--seed', '7']
+
+
+# directory holding the synthetic corpus json and its sentence-scores.txt
+@pytest.fixture(scope='session')
+def synth_dir(tmp_path_factory):
+    out = tmp_path_factory.mktemp('synth')
+    coqa_synth.main(SYNTH_ARGS + ['--out', str(out)])
+    return out
+
+
+# the synthetic corpus, loaded (and cached) as the viewer loads it
+@pytest.fixture(scope='session')
+def corpus(synth_dir):
+    c = load_corpus(str(synth_dir / 'coqa-news-preprocessed-final.json'))
+    yield c
+    c.close()
+
+
+# returns a function that writes a corpus json of hand-made passages (dictionaries of some of the preprocessed keys,
+# the others are filled in) and loads it
+@pytest.fixture
+def make_corpus(tmp_path):
+    opened = []
+
+    def make(passages, **kw):
+        data = []
+        for n, d in enumerate(passages):
+            nseg = len(d.get('seg_tagged', []))
+            nq = len(d.get('q_tagged', d.get('rationale', [])))
+            full = {'story_num': n + 1, 'id': 'hand%d' % n, 'story': '', 'seg_text': [''] * nseg, 'seg_tagged': [],
+                    'seg_dep': [[] for _ in range(nseg)], 'q_text': [''] * nq, 'q_tagged': [[] for _ in range(nq)],
+                    'quoted': [], 'q_dep': [[] for _ in range(nq)], 'a_text': [''] * nq,
+                    'a_tagged': [[] for _ in range(nq)], 'rationale': [[0, 0] for _ in range(nq)], 'corefs': {}}
+            full.update(d)
+            data.append(full)
+        path = tmp_path / 'coqa-news-preprocessed-final.json'
+        path.write_text(json.dumps({'version': '1.0', 'data': data}))
+        opened.append(load_corpus(str(path), **kw))
+        return opened[-1]
+    yield make
+    for c in opened:
+        c.close()
@@ -0,0 +1,123 @@
+# Author: Sal Barbosa
+# The binary corpus cache of coqa_cache: passages read back as json.load returns them (or, in compact mode, only the
+# keys and token fields asked for), and the cache is rebuilt (only) when the json file changes
+#
+import json
+import os
+import shutil
+import pytest
+import coqa_cache
+from coqa_cache import load_corpus, cache_path_for, cache_is_current
+
+
+# a private copy of the synthetic corpus json (the tests below modify it)
+@pytest.fixture
+def json_path(tmp_path, synth_dir):
+    path = tmp_path / 'coqa-news-preprocessed-final.json'
+    shutil.copy(synth_dir / 'coqa-news-preprocessed-final.json', path)
+    return str(path)
+
+
+# opens a corpus and returns it with the json data it was built from
+def open_corpus(json_path, **kw):
+    with open(json_path, encoding='utf-8') as f:
+        data = json.load(f)['data']
+    return load_corpus(json_path, **kw), data
+
+
+def test_round_trip(json_path):
+    corpus, data = open_corpus(json_path)
+    try:
+        assert len(corpus) == len(data)
+        for p in range(len(data)):
+            assert corpus[p] == data[p]
+            assert corpus.story(p) == data[p]['story']
+            assert corpus.extra(p)['rationale'] == data[p]['rationale']
+        assert list(corpus) == data
+        with pytest.raises(IndexError):
+            corpus[len(data)]
+    finally:
+        corpus.close()
+
+
+def test_cache_reused(json_path, monkeypatch):
+    load_corpus(json_path).close()
+    assert cache_is_current(json_path, cache_path_for(json_path))
+
+    def no_build(*args):
+        raise AssertionError('cache rebuilt')
+    monkeypatch.setattr(coqa_cache, 'build_cache', no_build)
+    load_corpus(json_path).close()
+    st = os.stat(json_path)
+    os.utime(json_path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))     # touched only: the cache is kept
+    load_corpus(json_path).close()
+    assert cache_is_current(json_path, cache_path_for(json_path))
+
+
+def test_cache_rebuilt_when_json_changes(json_path):
+    load_corpus(json_path).close()
+    with open(json_path, encoding='utf-8') as f:
+        coqa = json.load(f)
+    coqa['data'][0]['story'] = 'Changed ' + coqa['data'][0]['story'][8:]
+    coqa['data'][1]['seg_tagged'][0][0][0] = 'Changed'
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump(coqa, f)
+    assert not cache_is_current(json_path, cache_path_for(json_path))
+    corpus = load_corpus(json_path)
+    try:
+        assert corpus[0] == coqa['data'][0]
+        assert corpus[1]['seg_tagged'][0][0][0] == 'Changed'
+    finally:
+        corpus.close()
+
+
+def test_bad_cache_rebuilt(json_path):
+    with open(cache_path_for(json_path), 'wb') as f:
+        f.write(b'not a cache')
+    corpus, data = open_corpus(json_path)
+    try:
+        assert corpus[0] == data[0]
+    finally:
+        corpus.close()
+
+
+@pytest.mark.parametrize('tok_fields', [3, 5, None])
+def test_compact_mode(json_path, tok_fields):
+    keys = ('story', 'seg_tagged', 'q_dep', 'rationale')
+    corpus, data = open_corpus(json_path, keys=keys, tok_fields=tok_fields)
+    try:
+        strs = {}
+        for p in range(len(data)):
+            d = corpus[p]
+            assert sorted(d) == sorted(keys)
+            assert d['story'] == data[p]['story']
+            assert d['rationale'] == data[p]['rationale']
+            assert d['seg_tagged'] == [[tuple(t[:tok_fields]) for t in sg] for sg in data[p]['seg_tagged']]
+            assert d['q_dep'] == [[tuple(dep) for dep in deps] for deps in data[p]['q_dep']]
+            for t in (t for sg in d['seg_tagged'] for t in sg):
+                for v in t:
+                    assert strs.setdefault(v, v) is v       # (equal strings are one shared object)
+    finally:
+        corpus.close()
+
+
+def test_memory_report(json_path):
+    corpus = load_corpus(json_path, keys=('story',))
+    try:
+        report = corpus.memory_report()
+        assert report.startswith('corpus memory (compact mode):')
+        assert 'mapped cache: ' + coqa_cache._mem_text(os.path.getsize(cache_path_for(json_path))) in report
+        assert 'decoded strings: 0 of ' + str(corpus.nstrings()) + ',' in report     # (stories are not kept)
+        assert 'materialized passages: 0,' in report
+        corpus[0], corpus[1], corpus[0]
+        assert 'materialized passages: 2,' in corpus.memory_report()
+    finally:
+        corpus.close()
+    corpus = load_corpus(json_path)
+    try:
+        corpus[0]
+        report = corpus.memory_report()
+        assert report.startswith('corpus memory (full mode):')
+        assert 'decoded strings: 0 of' not in report and 'materialized passages: 1,' in report
+    finally:
+        corpus.close()
@@ -0,0 +1,92 @@
+# Author: Sal Barbosa
+# Line wrapping and hit-testing of coqa_layout (no Tk needed)
+#
+import pytest
+from coqa_layout import (TOK, W_GAP, V_GAP, FONT_W, FONT_H, X_MIN, X_MAX, Y_MIN, Q_X_MAX, Q_Y_MIN, layout_tokens,
+                         token_at, passage_layout)
+
+
+# sentences of made-up tokens of the given lengths (one list of lengths per sentence)
+def make_sentences(lengths):
+    off = 0
+    sentences = []
+    for sl in lengths:
+        sg = []
+        for n in sl:
+            sg.append(('w' * n, 'NN', '~', '-', str(off)))
+            off += n + 1
+        sentences.append(sg)
+    return sentences
+
+
+# checks the geometry of laid out sentences against the wrapping rule of the canvas
+def check_wrapping(sentences, geo, x_max):
+    toks = [t for sg in sentences for t in sg]
+    assert len(geo) == len(toks)
+    for k, t in enumerate(toks):
+        assert geo.tlen[k] == len(t[TOK])
+        assert geo.y[k] == geo.y_min + (geo.line[k] - 1) * V_GAP
+        if k == 0 or geo.line[k] != geo.line[k - 1]:
+            assert geo.x[k] == X_MIN                            # a line starts at the left margin
+        else:
+            assert geo.x[k] == geo.x[k - 1] + (2 * W_GAP + geo.tlen[k - 1]) * FONT_W
+        if k > 0 and geo.line[k] != geo.line[k - 1]:            # wrapped only if the token did not fit on the line
+            assert geo.line[k] == geo.line[k - 1] + 1
+            nxt = geo.x[k - 1] + (2 * W_GAP + geo.tlen[k - 1]) * FONT_W
+            assert nxt + (W_GAP + geo.tlen[k]) * FONT_W >= x_max
+    lines = list(geo.line)
+    assert geo.nlines == (lines[-1] if lines else 0)
+    assert list(geo.line_first) == [sum(1 for m in lines if m < l) for l in range(1, geo.nlines + 2)]
+    assert list(geo.sent_first) == [0] + [sum(len(sg) for sg in sentences[:i + 1]) for i in range(len(sentences))]
+
+
+# returns the token whose box contains a point by looking at every token (what token_at answers by bisecting)
+def naive_token_at(geo, x, y):
+    for k in range(len(geo)):
+        if geo.x[k] - 2 <= x <= geo.x[k] + geo.tlen[k] * FONT_W + 2 and geo.y[k] <= y <= geo.y[k] + FONT_H + 5:
+            return k
+    return None
+
+
+@pytest.mark.parametrize('lengths, x_max', [
+    ([[3, 5, 1, 8], [2, 2]], X_MAX),
+    ([[10] * 30, [1] * 50, [25, 40, 3]], Q_X_MAX),
+    ([[150, 6]], Q_X_MAX),                                      # the second token would end at the margin: it wraps
+    ([], X_MAX),
+])
+def test_wrapping(lengths, x_max):
+    sentences = make_sentences(lengths)
+    check_wrapping(sentences, layout_tokens(sentences, x_max, Q_Y_MIN), x_max)
+
+
+def test_wrapping_corpus(corpus):
+    for p in range(len(corpus)):
+        sentences = corpus[p]['seg_tagged']
+        check_wrapping(sentences, passage_layout(corpus, p), X_MAX)
+
+
+def test_layout_is_memoized_and_read_only(corpus):
+    geo = passage_layout(corpus, 0)
+    assert passage_layout(corpus, 0) is geo
+    with pytest.raises(TypeError):
+        geo.x[0] = 0
+
+
+def test_token_at_every_token(corpus):
+    for p in range(len(corpus)):
+        geo = passage_layout(corpus, p)
+        for k in range(len(geo)):
+            assert token_at(geo, geo.x[k] + geo.tlen[k] * FONT_W // 2, geo.y[k] + FONT_H // 2) == k
+
+
+def test_token_at_grid():
+    sentences = make_sentences([[3, 5, 1, 8, 12, 4, 9] * 6, [2, 7, 30]])
+    geo = layout_tokens(sentences, Q_X_MAX, Y_MIN)
+    for y in range(0, Y_MIN + (geo.nlines + 1) * V_GAP, 3):
+        for x in range(0, Q_X_MAX + 20, 2):
+            assert token_at(geo, x, y) == naive_token_at(geo, x, y)
+
+
+def test_token_at_empty():
+    geo = layout_tokens([], X_MAX, Y_MIN)
+    assert token_at(geo, X_MIN, Y_MIN) is None
@@ -0,0 +1,103 @@
+# Author: Sal Barbosa
+# Corpus-wide metrics of coqa_metrics, checked against a question-by-question computation from the passages and the
+# rows of the scores file
+#
+import numpy as np
+import pytest
+from coqa_layout import N_TAG
+from coqa_metrics import QuestionFacts, rationale_ranks, score_metrics, metrics_text, TOP_K, HIST_MAX, POS_MAX, NO_NE
+from coqa_model import RationaleMap
+from coqa_scores import ScoreStore, parse_scores
+
+
+# returns {(passage, question): {sentence: rank}} of the text of a scores file (ties keep file order)
+def read_ranks(text):
+    groups = {}
+    for line in text.split('\n'):
+        if line.strip():
+            key, score = line.split()
+            p, q, s = (int(v) for v in key.split('.'))
+            groups.setdefault((p, q), []).append((s, float(score)))
+    return {k: {s: r + 1 for r, (s, _) in enumerate(sorted(rows, key=lambda x: x[1], reverse=True))}
+            for k, rows in groups.items()}
+
+
+# returns [(passage, question, first sentence, last sentence, answer NE type, rank), ...] of every question, one at a
+# time (sentences -1 and rank 0 as QuestionFacts/rationale_ranks give them)
+def naive_questions(corpus, rationales, ranks):
+    out = []
+    for p in range(len(corpus)):
+        d = corpus[p]
+        sent_of = [i for i, sg in enumerate(d['seg_tagged']) for _ in sg]
+        for q in range(len(d['rationale'])):
+            span = rationales.span(p, q)
+            s_first, s_last = (sent_of[span[0]], sent_of[span[1]]) if span else (-1, -1)
+            ne = NO_NE
+            for t in (d['a_tagged'][q] if q < len(d['a_tagged']) else []):
+                tag = t[N_TAG].split(' ', 1)[0] if len(t) > N_TAG else ''
+                if tag not in ('', '-', '<', 'O'):
+                    ne = tag
+                    break
+            found = [ranks.get((p, q), {}).get(s) for s in range(s_first, s_last + 1)] if span else []
+            rank = min([r for r in found if r], default=0)
+            out.append((p, q, s_first, s_last, ne, rank))
+    return out
+
+
+# returns (n, MRR, top-k hit rates) of a list of ranks
+def naive_group(ranks):
+    n = len(ranks)
+    return n, sum(1 / r for r in ranks) / max(n, 1), [sum(r <= k for r in ranks) / max(n, 1) for k in TOP_K]
+
+
+@pytest.fixture(scope='module')
+def facts_and_scores(corpus, synth_dir):
+    text = (synth_dir / 'sentence-scores.txt').read_text()
+    rationales = RationaleMap(corpus)
+    return corpus, rationales, QuestionFacts(corpus, rationales), ScoreStore(*parse_scores(text)), read_ranks(text)
+
+
+def test_facts_and_ranks(facts_and_scores):
+    corpus, rationales, facts, store, ranks = facts_and_scores
+    expect = naive_questions(corpus, rationales, ranks)
+    got = list(zip(facts.pnum.tolist(), facts.qnum.tolist(), facts.s_first.tolist(), facts.s_last.tolist(),
+                   [facts.ne_types[n] for n in facts.ne], rationale_ranks(facts, store).tolist()))
+    assert got == expect
+    assert any(e[4] != NO_NE for e in expect) and any(e[5] > 1 for e in expect)      # (the corpus exercises both)
+
+
+def test_score_metrics(facts_and_scores):
+    corpus, rationales, facts, store, ranks = facts_and_scores
+    qs = naive_questions(corpus, rationales, ranks)
+    ranked = [x for x in qs if x[5] > 0]
+    m = score_metrics(facts, store)
+    assert (m['questions'], m['ranked'], m['unresolved']) == (len(qs), len(ranked), sum(x[2] < 0 for x in qs))
+
+    n, mrr, hits = naive_group([x[5] for x in ranked])
+    assert m['overall']['n'] == n
+    assert m['overall']['mrr'] == pytest.approx(mrr)
+    assert [m['overall']['top' + str(k)] for k in TOP_K] == pytest.approx(hits)
+    assert m['mean_rank'] == pytest.approx(np.mean([x[5] for x in ranked]))
+    assert m['median_rank'] == pytest.approx(np.median([x[5] for x in ranked]))
+    assert m['hist'].tolist() == [sum(min(x[5], HIST_MAX + 1) == b for x in ranked) for b in range(1, HIST_MAX + 2)]
+
+    for i in range(POS_MAX):
+        n, mrr, hits = naive_group([x[5] for x in ranked if min(x[1], POS_MAX - 1) == i])
+        g = m['by_position']
+        assert (g['n'][i], g['mrr'][i], [g['top' + str(k)][i] for k in TOP_K]) == (n, pytest.approx(mrr), pytest.approx(hits))
+    for i, ne in enumerate(m['ne_types']):
+        n, mrr, hits = naive_group([x[5] for x in ranked if x[4] == ne])
+        g = m['by_ne']
+        assert (g['n'][i], g['mrr'][i], [g['top' + str(k)][i] for k in TOP_K]) == (n, pytest.approx(mrr), pytest.approx(hits))
+
+    text = metrics_text(m)
+    assert text.startswith('Questions ' + str(len(qs)) + ', ranked ' + str(len(ranked)))
+    assert 'By answer NE type' in text
+
+
+def test_metrics_without_scores(facts_and_scores):
+    corpus, rationales, facts, store, ranks = facts_and_scores
+    m = score_metrics(facts, ScoreStore(*parse_scores('')))
+    assert m['ranked'] == 0 and m['overall']['n'] == 0 and m['mean_rank'] == 0.0
+    assert m['hist'].sum() == 0
+    metrics_text(m)
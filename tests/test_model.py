@@ -0,0 +1,82 @@
+# Author: Sal Barbosa
+# Rationale spans of coqa_model, checked against the linear token scan the viewer did before RationaleMap
+#
+from coqa_layout import TOK, M_TAG
+from coqa_model import RationaleMap, trim_rationale
+
+
+# returns (first token, last token) of a rationale span by scanning the passage tokens in order (None if unresolved);
+# tokens without a character offset are skipped
+def scan_rationale(d, qnum):
+    toks = [t for sg in d['seg_tagged'] for t in sg]
+    offs = [(k, int(t[M_TAG])) for k, t in enumerate(toks) if len(t) > M_TAG and t[M_TAG].isdigit()]
+    r_start, r_end = trim_rationale(d['story'], *d['rationale'][qnum][:2])
+    if r_end <= r_start or not offs:
+        return None
+    for n in range(len(offs)):
+        if offs[n][1] >= r_start:
+            break
+    if offs[n][1] > r_start and n > 0:
+        n -= 1
+    elif offs[n][1] > r_start:
+        return None                                         # (the span starts before the first token)
+    f_tok = l_tok = offs[n][0]
+    if r_end - r_start > len(toks[f_tok][TOK]):
+        for m in range(n, len(offs)):
+            if offs[m][1] >= r_end:
+                l_tok = offs[m - 1][0]
+                break
+        else:
+            l_tok = offs[-1][0]
+    return f_tok, max(l_tok, f_tok)
+
+
+# checks every rationale of a corpus against the linear scan
+def check_rationales(corpus):
+    rats = RationaleMap(corpus)
+    unresolved = 0
+    for p in range(len(corpus)):
+        d = corpus[p]
+        for q in range(len(d['rationale'])):
+            span = scan_rationale(d, q)
+            assert rats.span(p, q) == span, (p, q)
+            unresolved += span is None
+    assert len(rats.report) == unresolved
+    return rats
+
+
+def test_rationales_synthetic(corpus):
+    check_rationales(corpus)
+
+
+def test_rationales_trimmed_and_unresolved(make_corpus):
+    story = 'Tom met Ann. They left, at noon.'
+    seg = [[['Tom', 'NNP', '~', 'PERSON', '0'], ['met', 'VBD', 'meet', '-', '4'], ['Ann', 'NNP', '~', 'PERSON', '8'],
+            ['.', '.', '~', '-', '11']],
+           [['They', 'PRP', '~', '-', '13'], ['left', 'VBD', 'leave', '-', '18'], [',', ',', '~', '-', '22'],
+            ['at', 'IN', '~', '-', '24'], ['noon', 'NN', '~', '-', '27'], ['.', '.', '~', '-', '31']]]
+    rationale = [[0, 3], [3, 12], [12, 23], [19, 32], [5, 6], [22, 23], [0, 0]]
+    rats = check_rationales(make_corpus([{'story': story, 'seg_tagged': seg, 'rationale': rationale}]))
+    assert rats.span(0, 0) == (0, 0)
+    assert rats.span(0, 1) == (1, 2)                        # ' met Ann.' is trimmed to 'met Ann'
+    assert rats.span(0, 2) == (4, 5)
+    assert rats.span(0, 3) == (5, 8)                        # starts inside 'left', ends before the period
+    assert rats.span(0, 4) == (1, 1)                        # inside 'met'
+    assert rats.span(0, 5) is None                          # only punctuation: empty once trimmed
+    assert rats.span(0, 6) is None
+    assert 'empty span' in rats.report_text()
+
+
+def test_rationales_unmapped_tokens(make_corpus):
+    story = 'Tom met Ann. They left, at noon.'
+    seg = [[['Tom', 'NNP', '~', 'PERSON'], ['met', 'VBD', 'meet', '-', '4'], ['Ann', 'NNP', '~', 'PERSON', '8'],
+            ['.', '.', '~', '-', '11']],
+           [['They', 'PRP', '~', '-', '13'], ['left', 'VBD', 'leave', '-', ''], [',', ',', '~', '-', '22'],
+            ['at', 'IN', '~', '-', '24'], ['noon', 'NN', '~', '-', '27'], ['.', '.', '~', '-', '31']]]
+    rationale = [[0, 3], [4, 11], [13, 22], [19, 30], [24, 30]]
+    rats = check_rationales(make_corpus([{'story': story, 'seg_tagged': seg, 'rationale': rationale}]))
+    assert rats.span(0, 0) is None                          # before the first token with an offset ('Tom' has none)
+    assert rats.span(0, 1) == (1, 2)
+    assert rats.span(0, 2) == (4, 4)                        # ('left' has no offset: 'They left' ends at 'They')
+    assert rats.span(0, 3) == (4, 8)                        # starts inside 'left': from the token before it
+    assert rats.span(0, 4) == (7, 8)
@@ -0,0 +1,192 @@
+# Author: Sal Barbosa
+# The columnar score store of coqa_scores and its sidecar, checked against the rows of the scores file, its rank
+# table, checked against plain Python sorting, and the scores files/streams followed as rows are written to them
+#
+import os
+import time
+import numpy as np
+import pytest
+from coqa_scores import (ScoreStore, ScoreFile, ScoreStream, parse_scores, load_scores, load_score_runs,
+                         sidecar_path_for)
+
+
+# returns {(passage, question): [(sentence, score), ...] in file order} of the text of a scores file
+def read_groups(text):
+    groups = {}
+    for line in text.split('\n'):
+        if line.strip():
+            key, score = line.split()
+            p, q, s = (int(v) for v in key.split('.'))
+            groups.setdefault((p, q), []).append((s, float(score)))
+    return groups
+
+
+# checks the rows of every passage/question of a store, and the lookup of every row by its key
+def check_rows(store, groups):
+    assert len(store) == sum(len(rows) for rows in groups.values())
+    for (p, q), rows in groups.items():
+        sent, score = store.seg_scores(p, q)
+        assert list(zip(sent.tolist(), score.tolist())) == rows
+        found = store.find_rows([p] * len(rows), [q] * len(rows), [s for s, _ in rows])
+        assert store.score[found].tolist() == [v for _, v in rows]
+
+
+# checks the rank table of every passage/question against its rows sorted by score (sorted is stable: ties keep file
+# order)
+def check_ranks(store, groups):
+    for (p, q), rows in groups.items():
+        expect = sorted(rows, key=lambda r: r[1], reverse=True)
+        rs, rsc = store.ranked(p, q)
+        assert list(zip(rs.tolist(), rsc.tolist())) == expect
+        snums = [s for s, _ in expect]
+        ranks = store.lookup_ranks([p] * len(snums), [q] * len(snums), snums)
+        assert ranks.tolist() == list(range(1, len(snums) + 1))
+
+
+def test_store_synthetic(synth_dir):
+    text = (synth_dir / 'sentence-scores.txt').read_text()
+    store = ScoreStore(*parse_scores(text))
+    check_rows(store, read_groups(text))
+    check_ranks(store, read_groups(text))
+
+
+def test_store_unordered():
+    text = '1.0.2 0.5\n0.1.0 0.2\n1.0.0 0.9\n1.0.1 0.5\n0.1.1 0.7\n1.0.3 -1\n0.0.4 0.3\n1.0.4 0.5\n'
+    store = ScoreStore(*parse_scores(text))
+    check_rows(store, read_groups(text))
+    assert store.rows(0, 2) == (0, 0)                       # questions and passages without scores
+    assert store.rows(5, 0) == (0, 0)
+    assert store.find_rows([1, 1, 9, 0, -1], [0, 0, 0, 0, 0], [2, 7, 0, 9, 0]).tolist()[1:] == [-1, -1, -1, -1]
+    check_ranks(store, read_groups(text))                   # (1.0.2, 1.0.1 and 1.0.4 tie: file order)
+    assert store.lookup_ranks([1, 1, 0, 9, 0], [0, 0, 1, 0, 0], [2, 7, 1, 0, 0]).tolist() == [2, 0, 1, 0, 0]
+
+
+def test_empty_store():
+    store = ScoreStore(*parse_scores(''))
+    assert len(store) == 0 and store.rows(0, 0) == (0, 0)
+    assert store.lookup_ranks([0, 1], [0, 0], [0, 2]).tolist() == [0, 0]
+
+
+def test_malformed_scores():
+    with pytest.raises(ValueError):
+        parse_scores('0.0.0 0.5\n0.0 0.2\n')
+
+
+def test_merged_replaces_rows():
+    store = ScoreStore(*parse_scores('0.0.0 0.1\n0.0.1 0.2\n0.1.0 0.3\n'))
+    new = store.merged(*parse_scores('0.0.0 0.9\n2.0.0 0.4\n0.0.0 0.8\n'))  # (the last row of a key wins)
+    groups = {(0, 0): [(1, 0.2), (0, 0.8)], (0, 1): [(0, 0.3)], (2, 0): [(0, 0.4)]}
+    check_rows(new, groups)
+    check_ranks(new, groups)
+
+
+@pytest.mark.parametrize('damage', [lambda data: data[:len(data) // 2], lambda data: b'', lambda data: b'PK' + data[2:100]])
+def test_sidecar(tmp_path, synth_dir, damage):
+    path = tmp_path / 'sentence-scores.txt'
+    path.write_text((synth_dir / 'sentence-scores.txt').read_text())
+    fresh = load_scores(str(path))
+    side = sidecar_path_for(str(path))
+    restored = load_scores(str(path))                       # (from the sidecar written by the first load)
+    for k in ('psg', 'qst', 'sent', 'score', 'offsets', 'rank', 'rank_sent', 'rank_score'):
+        assert np.array_equal(getattr(restored, k), getattr(fresh, k))
+    check_rows(restored, read_groups(path.read_text()))
+    check_ranks(restored, read_groups(path.read_text()))
+
+    with open(side, 'rb') as f:
+        data = f.read()
+    with open(side, 'wb') as f:
+        f.write(damage(data))                               # a damaged sidecar is reparsed and rewritten
+    check_rows(load_scores(str(path)), read_groups(path.read_text()))
+    with np.load(side) as npz:
+        assert np.array_equal(npz['score'], fresh.score)
+    assert sorted(os.listdir(tmp_path)) == ['sentence-scores.npz', 'sentence-scores.txt']     # (no temp file left)
+
+
+# returns the rows of the columns read from a scores source as [(passage, question, sentence, score), ...]
+def read_rows(cols):
+    return list(zip(*(c.tolist() for c in cols)))
+
+
+# appends text to a file
+def append(path, text):
+    with open(path, 'a') as f:
+        f.write(text)
+
+
+def test_score_file_appended(tmp_path):
+    path = tmp_path / 'sentence-scores.txt'
+    path.write_text('0.0.0 0.5\n0.0.1 0.2\n0.1.0 0')
+    src = ScoreFile(str(path))
+    check_rows(src.load(use_sidecar=False), {(0, 0): [(0, 0.5), (1, 0.2)], (0, 1): [(0, 0.0)]})
+    assert src.read() == (None, False)                      # (unchanged)
+    append(path, '.7\n1.0.2 0.3\n1.0')                      # the last line is completed, another one begun
+    cols, replace = src.read()
+    assert read_rows(cols) == [(0, 1, 0, 0.7), (1, 0, 2, 0.3)] and not replace
+    append(path, '.3')                                      # (its key is still being written: no row yet)
+    assert src.read() == (None, False)
+    append(path, ' 0.1\n')
+    cols, replace = src.read()
+    assert read_rows(cols) == [(1, 0, 3, 0.1)] and not replace
+    assert src.read() == (None, False)
+
+
+def test_score_file_rewritten(tmp_path):
+    path = tmp_path / 'sentence-scores.txt'
+    path.write_text('0.0.0 0.5\n0.0.1 0.2\n')
+    src = ScoreFile(str(path))
+    src.load(use_sidecar=False)
+    path.write_text('0.0.0 0.1\n')                           # truncated
+    cols, replace = src.read()
+    assert read_rows(cols) == [(0, 0, 0, 0.1)] and replace
+    with open(path, 'r+') as f:                             # rewritten in place, same size
+        f.write('0.0.0 0.9\n')
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    cols, replace = src.read()
+    assert read_rows(cols) == [(0, 0, 0, 0.9)] and replace
+    with open(path, 'r+') as f:                             # rewritten in place and grown
+        f.write('0.0.0 0.4\n0.0.1 0.6\n')
+    cols, replace = src.read()
+    assert read_rows(cols) == [(0, 0, 0, 0.4), (0, 0, 1, 0.6)] and replace
+    new = tmp_path / 'new.txt'
+    new.write_text('2.0.0 0.3\n0.0.0 0.4\n0.0.1 0.6\n')
+    os.replace(new, path)                                   # replaced by another file
+    cols, replace = src.read()
+    assert read_rows(cols) == [(2, 0, 0, 0.3), (0, 0, 0, 0.4), (0, 0, 1, 0.6)] and replace
+
+
+def test_score_stream(tmp_path):
+    pipe = str(tmp_path / 'scores.fifo')
+    os.mkfifo(pipe)
+    src = ScoreStream(pipe)
+    assert len(src.load()) == 0
+    with open(pipe, 'w') as f:
+        f.write('0.0.0 0.5\n0.0.1 0.2\n')
+    got = []
+    for _ in range(500):
+        cols, replace = src.read()
+        if cols is not None:
+            got += read_rows(cols)
+        if len(got) == 2:
+            break
+        time.sleep(0.01)
+    assert got == [(0, 0, 0, 0.5), (0, 0, 1, 0.2)]
+    assert src.read() == (None, False)
+
+
+def test_runs_ingest(tmp_path):
+    paths = [tmp_path / 'run1.txt', tmp_path / 'run2.txt']
+    paths[0].write_text('0.0.0 0.5\n0.0.1 0.2\n')
+    paths[1].write_text('0.0.1 0.9\n')
+    runs = load_score_runs([str(p) for p in paths], use_sidecar=False)
+    assert runs.ingest() is None
+    append(paths[0], '0.0.2 0.7\n0.0.9 0.1\n1.0.0 0.3\n')
+    append(paths[1], '0.0.0 0.1\n')
+    new, pnums, qnums, skipped = runs.ingest(lambda p, q, s: s < 5)
+    assert skipped == 1
+    assert (pnums.tolist(), qnums.tolist()) == ([0, 1, 0], [0, 0, 0])
+    assert read_rows(new.base.ranked(0, 0)) == [(2, 0.7), (0, 0.5), (1, 0.2)]
+    sents, ranks = new.ranks(0, 0)
+    assert sents.tolist() == [0, 1, 2] and ranks.tolist() == [[2, 3, 1], [2, 1, 0]]
+    assert runs.ranks(0, 0)[1].tolist() == [[1, 2], [0, 1]]     # (the runs read from are not changed)
+    assert new.ingest() is None
@@ -0,0 +1,137 @@
+# Author: Sal Barbosa
+# Find over coqa_search's inverted index, checked against a scan of every token of the corpus, and phrase/regex search
+# over the story text, checked against a regex pass over each story and a scan of its token offsets
+#
+import re
+import numpy as np
+import pytest
+from coqa_layout import TOK, L_TAG, M_TAG
+from coqa_search import (SearchIndex, TextIndex, index_term, load_index, index_path_for, hit_groups, phrase_pattern,
+                         pack_hit, unpack_hit)
+
+FIELD_TAG = {'tok': TOK, 'lemma': L_TAG}
+
+
+# returns the sorted packed hits of the tokens whose field contains text (or equals it), by scanning every token
+def naive_find(corpus, text, field, exact=False):
+    text = text.lower()
+    hits = []
+    for p in range(len(corpus)):
+        d = corpus[p]
+        runs = [('P', 0, [t for sg in d['seg_tagged'] for t in sg])]
+        runs += [('Q', q, t) for q, t in enumerate(d['q_tagged'])]
+        runs += [('A', q, t) for q, t in enumerate(d['a_tagged'])]
+        for part, q, toks in runs:
+            for j, t in enumerate(toks):
+                term = index_term(field, t[FIELD_TAG[field]])
+                if term and (term == text if exact else text in term):
+                    hits.append(pack_hit(p, part, q, j))
+    return sorted(hits)
+
+
+# a few words of the corpus (and parts of them) to look for
+def queries(corpus):
+    words = [t[TOK] for sg in corpus[0]['seg_tagged'] for t in sg] + [t[TOK] for t in corpus[1]['q_tagged'][0]]
+    return sorted(set(words[:12] + [w[1:4] for w in words[:12] if len(w) > 4] + ['a', 'ko', 'the', 'zzq']))
+
+
+@pytest.fixture(scope='module')
+def index(corpus):
+    return SearchIndex.build(corpus)
+
+
+@pytest.mark.parametrize('field', ['tok', 'lemma'])
+def test_find_substring(corpus, index, field):
+    for text in queries(corpus):
+        assert index.find(text, field).tolist() == naive_find(corpus, text, field), text
+
+
+def test_find_exact(corpus, index):
+    for text in queries(corpus):
+        assert index.find(text.upper(), exact=True).tolist() == naive_find(corpus, text, 'tok', exact=True), text
+
+
+def test_hit_groups(corpus, index):
+    hits = index.find('a')
+    offsets = hit_groups(hits)
+    assert offsets[0] == 0 and offsets[-1] == len(hits)
+    groups = [unpack_hit(h)[:3] for h in hits]
+    for g in range(len(offsets) - 1):
+        a, b = offsets[g], offsets[g + 1]
+        assert a < b and len(set(groups[a:b])) == 1
+        assert b == len(hits) or groups[b] != groups[a]
+    assert hit_groups(np.zeros(0, dtype=np.uint64)).tolist() == [0]
+
+
+@pytest.mark.parametrize('damage', [lambda data: data[:len(data) // 2], lambda data: b''])
+def test_persisted_index(corpus, index, damage):
+    path = index_path_for(corpus)
+    load_index(corpus)                                      # (writes the index next to the cache)
+    loaded = load_index(corpus)
+    for text in ('the', 'ko'):
+        assert np.array_equal(loaded.find(text), index.find(text))
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(damage(data))                               # a damaged index is rebuilt and rewritten
+    assert np.array_equal(load_index(corpus).find('the'), index.find('the'))
+    with np.load(path) as npz:
+        assert np.array_equal(npz['tok_hits'], index.hits['tok'])
+
+
+# returns [(passage, first token, last token), ...] of the matches of a regular expression, by matching each story and
+# scanning its tokens' offsets (tokens without one are skipped)
+def naive_text_find(corpus, pattern):
+    out = []
+    for p in range(len(corpus)):
+        d = corpus[p]
+        toks = [t for sg in d['seg_tagged'] for t in sg]
+        offs = [(k, int(t[M_TAG])) for k, t in enumerate(toks) if len(t) > M_TAG and t[M_TAG].isdigit()]
+        if not toks:
+            continue
+        for m in re.finditer(pattern, d['story'], re.IGNORECASE):
+            if m.end() > m.start():
+                first = max([k for k, o in offs if o <= m.start()], default=0)
+                last = max([k for k, o in offs if o < m.end()], default=0)
+                out.append((p, first, max(last, first)))
+    return out
+
+
+# returns the matches found by a TextIndex as [(passage, first token, last token), ...]
+def text_find(text_index, pattern, regex=False):
+    return list(zip(*(a.tolist() for a in text_index.find(pattern, regex=regex))))
+
+
+def test_text_find(corpus):
+    text_index = TextIndex(corpus)
+    words = corpus.story(0).split()
+    phrases = [' '.join(words[k:k + 2]) for k in range(0, 20, 3)] + [words[5].upper() + '  ' + words[6]]
+    for phrase in phrases:
+        assert text_find(text_index, phrase) == naive_text_find(corpus, phrase_pattern(phrase)), phrase
+    for rx in (r'\w+ed\b', r'[A-Z]\w+ \w+', r'a\s+\w+', r'\.'):
+        assert text_find(text_index, rx, regex=True) == naive_text_find(corpus, rx), rx
+
+
+def test_text_find_unmapped_tokens(make_corpus):
+    story = 'Mr. Tom Smith met Ann in New York. They left.'
+    sent1 = [['Mr.', 'NNP', '~', '-'], ['Tom', 'NNP', '~', 'PERSON Tom_Smith', '4'], ['Smith', 'NNP', '~', '<', '8'],
+             ['met', 'VBD', 'meet', '-', '14'], ['Ann', 'NNP', '~', 'PERSON', ''], ['in', 'IN', '~', '-', '22'],
+             ['New', 'NNP', '~', 'CITY New_York', '25'], ['York', 'NNP', '~', '<', '29'], ['.', '.', '~', '-', '33']]
+    sent2 = [['They', 'PRP', '~', '-', '35'], ['left', 'VBD', 'leave', '-', '40'], ['.', '.', '~', '-', '44']]
+    corpus = make_corpus([{'story': story, 'seg_tagged': [sent1, sent2]}])
+    text_index = TextIndex(corpus)                          # ('Mr.' and 'Ann' have no character offset)
+    assert text_find(text_index, 'met ann in') == [(0, 3, 5)]
+    assert text_find(text_index, 'new york') == [(0, 6, 7)]
+    assert text_find(text_index, 'they left') == [(0, 9, 10)]
+    assert text_find(text_index, 'Mr. Tom') == [(0, 0, 1)]
+    for pattern in (r'\w+', r'\w+ \w+ \w+', r'[a-z]+\.'):
+        assert text_find(text_index, pattern, regex=True) == naive_text_find(corpus, pattern), pattern
+
+
+def test_ne_continuation_ends_with_its_segment(make_corpus):
+    sent1 = [['New', 'NNP', '~', 'CITY New_York', '0'], ['York', 'NNP', '~', '<', '4']]
+    sent2 = [['Later', 'RB', '~', '<', '9'], ['Paris', 'NNP', '~', 'CITY', '15']]
+    question = [['Where', 'WHERE', '~', '<', '0'], ['to', 'TO', '~', '-', '6']]
+    corpus = make_corpus([{'story': 'New York Later Paris', 'seg_tagged': [sent1, sent2], 'q_tagged': [question]}])
+    hits = SearchIndex.build(corpus).find('city', 'ne', exact=True)
+    assert [unpack_hit(h) for h in hits] == [(0, 'P', 0, 0), (0, 'P', 0, 1), (0, 'P', 0, 3)]